@@ -1,15 +1,39 @@
 import os
 import mimetypes
-import struct
 import re
 import json
 import time
-from flask import Flask, render_template, request, jsonify, send_file
-from google import genai
+from flask import Flask, render_template, request, jsonify, send_file, Response
+from werkzeug.datastructures import ContentRange
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import is_resource_modified
+from werkzeug.security import safe_join
 from google.genai import types
 import tempfile
 import io
 import shutil
+import itertools
+import threading
+from datetime import datetime, timezone
+from typing import NamedTuple
+from paragraph_engine import ParagraphEngine
+from batch_planner import ParagraphBatch, ParagraphBatcher, pcm_samples, pcm_bytes
+from gemini_client import ClientPool, RateLimiter
+from tts_scheduler import CircuitBreaker, TtsScheduler, estimate_tokens
+from metrics import MetricsRegistry, BYTES_BUCKETS, THROUGHPUT_BUCKETS
+from jobs import JobQueue, TERMINAL_JOB_STATES
+from coordination import InFlight, temp_name
+from config_service import ConfigService
+from singleflight import SingleFlight
+from audio_cache import AudioCache, cache_key
+from output_index import OutputIndex
+from book_parser import Book, iter_paragraphs
+from document_store import DocumentStore
+from book_export import export_book
+from audio_encoder import AudioEncoder, FORMATS, FORMAT_PREFERENCE, available_formats
+from pcm_processing import EDGE_SILENCE_SECONDS, TARGET_LOUDNESS_DBFS
+from wav_utils import (convert_to_wav, parse_audio_mime_type,
+                       concatenate_wav_files_pure_python, WavStreamWriter, wav_header, STREAMING_DATA_SIZE)
 try:
     from pydub import AudioSegment
     PYDUB_AVAILABLE = True
@@ -30,20 +54,41 @@ os.makedirs(OUTPUT_DIR, exist_ok=True)
 # Default config file path
 CONFIG_FILE = os.path.join(os.getcwd(), "config.json")
 
+# Held while config.json is read, changed and rewritten, so saves from different worker processes don't interleave
+CONFIG_LOCK_FILE = CONFIG_FILE + ".lock"
+
+# SQLite database for background generation jobs
+JOBS_DB = os.path.join(os.getcwd(), "jobs.db")
+
+# SQLite database of syntheses in progress, shared by every worker process started by serve.py
+COORDINATION_DB = os.path.join(os.getcwd(), "coordination.db")
+
+# Worker processes serving this directory (set by serve.py); per-process quotas and pools are divided by it
+WORKER_COUNT = max(1, int(os.environ.get('UGMPA_WORKERS', 1)))
+
+# Content-addressed cache of synthesized audio
+AUDIO_CACHE_DIR = os.path.join(os.getcwd(), "tts_cache")
+
+# Uploaded books, kept on disk so they are parsed once and survive restarts
+DOCUMENTS_DIR = os.path.join(os.getcwd(), "documents")
+
+# Extensions checked when looking for a full chapter audio file
+CHAPTER_AUDIO_EXTENSIONS = ['.wav', '.flac', '.ogg', '.mp3']
+
+# Gemini TTS model used for all generation
+TTS_MODEL = "gemini-2.5-pro-preview-tts"
+
+# config.json parsed once and kept in memory; re-read when the file changes, written back in batches
+CONFIG = ConfigService(CONFIG_FILE, defaults={
+    'prompt': 'Please read carefully and don\'t mis-read any word.',
+    'voice1': 'Puck',
+    'voice2': 'Zephyr',
+    'api_key': ''  # API key can be set in config.json
+}, lock_path=CONFIG_LOCK_FILE)
+
 def load_config():
-    """Load default configuration from file."""
-    if os.path.exists(CONFIG_FILE):
-        try:
-            with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"Error loading config: {e}")
-    return {
-        'prompt': 'Please read carefully and don\'t mis-read any word.',
-        'voice1': 'Puck',
-        'voice2': 'Zephyr',
-        'api_key': ''  # API key can be set in config.json
-    }
+    """Return the current configuration as a read-only snapshot, without reading config.json unless it changed."""
+    return CONFIG.snapshot()
 
 # Load config and get API key (priority: config.json > environment variable)
 # API key must be set in config.json or as environment variable GEMINI_API_KEY
@@ -57,68 +102,128 @@ if not API_KEY:
     print("   2. Set GEMINI_API_KEY environment variable")
     print("   The application may not work without a valid API key.")
 
-def save_config(config):
-    """Save default configuration to file."""
-    try:
-        with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(config, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print(f"Error saving config: {e}")
+# Shared worker pool for paragraph generation (size comes from config.json)
+PARAGRAPH_ENGINE = ParagraphEngine(max_workers=config.get('paragraph_workers', 4))
 
-# Load default config on startup
-DEFAULT_CONFIG = load_config()
+# Consecutive short paragraphs share one TTS request of up to 'paragraph_batch_chars' characters (0 disables)
+PARAGRAPH_BATCHER = ParagraphBatcher(
+    max_chars=config.get('paragraph_batch_chars', 1000),
+    max_paragraphs=config.get('paragraph_batch_max', 16)
+)
 
-def convert_to_wav(audio_data: bytes, mime_type: str) -> bytes:
-    """Generates a WAV file header for the given audio data and parameters."""
-    parameters = parse_audio_mime_type(mime_type)
-    bits_per_sample = parameters["bits_per_sample"]
-    sample_rate = parameters["rate"]
-    num_channels = 1
-    data_size = len(audio_data)
-    bytes_per_sample = bits_per_sample // 8
-    block_align = num_channels * bytes_per_sample
-    byte_rate = sample_rate * block_align
-    chunk_size = 36 + data_size
-
-    header = struct.pack(
-        "<4sI4s4sIHHIIHH4sI",
-        b"RIFF",
-        chunk_size,
-        b"WAVE",
-        b"fmt ",
-        16,
-        1,
-        num_channels,
-        sample_rate,
-        byte_rate,
-        block_align,
-        bits_per_sample,
-        b"data",
-        data_size
-    )
-    return header + audio_data
+# Process-wide Gemini clients, one warm client per API key ('api_keys' in config.json adds extra keys
+# that are rotated between calls; 'requests_per_minute' and 'tokens_per_minute' are enforced per key,
+# each worker process taking an equal share)
+CLIENT_POOL = ClientPool(
+    [API_KEY] + list(config.get('api_keys', [])),
+    rate_limiter=RateLimiter(config.get('requests_per_minute', 0) / WORKER_COUNT,
+                             config.get('tokens_per_minute', 0) / WORKER_COUNT)
+)
 
-def parse_audio_mime_type(mime_type: str) -> dict[str, int | None]:
-    """Parses bits per sample and rate from an audio MIME type string."""
-    bits_per_sample = 16
-    rate = 24000
+# Retries rate-limited and failed Gemini calls with backoff, and stops calling for a while when the API keeps failing
+TTS_SCHEDULER = TtsScheduler(
+    CLIENT_POOL,
+    max_attempts=config.get('tts_max_attempts', 5),
+    backoff_base=config.get('tts_backoff_base', 1.0),
+    backoff_max=config.get('tts_backoff_max', 60.0),
+    breaker=CircuitBreaker(config.get('circuit_failure_threshold', 5), config.get('circuit_reset_seconds', 30))
+)
 
-    parts = mime_type.split(";")
-    for param in parts:
-        param = param.strip()
-        if param.lower().startswith("rate="):
-            try:
-                rate_str = param.split("=", 1)[1]
-                rate = int(rate_str)
-            except (ValueError, IndexError):
-                pass
-        elif param.startswith("audio/L"):
-            try:
-                bits_per_sample = int(param.split("L", 1)[1])
-            except (ValueError, IndexError):
-                pass
+# Identical (model, prompt, voices, text) requests are served from here instead of the API
+AUDIO_CACHE = AudioCache(AUDIO_CACHE_DIR, max_bytes=int(config.get('cache_max_mb', 2048)) * 1024 * 1024)
+
+# A synthesis claims its cache key here first, so worker processes asked for the same audio make one API call
+IN_FLIGHT = InFlight(COORDINATION_DB)
+
+# Requests in this process for an output file that is already being generated with the same parameters
+# (a double click, a second tab) attach to that generation and get its result
+GENERATIONS = SingleFlight()
+
+# In-memory listing of OUTPUT_DIR used by every status check (kept current with inotify, or by polling
+# once start_background_workers() runs)
+OUTPUT_INDEX = OutputIndex(OUTPUT_DIR, poll_interval=config.get('output_index_poll_seconds', 5))
+
+# Transcodes finished WAVs to the formats listed in 'output_formats' (e.g. ["flac"]), one process per core
+# (shared between worker processes) unless 'encoder_workers' says otherwise
+AUDIO_ENCODER = AudioEncoder(max_workers=config.get('encoder_workers') or max(1, (os.cpu_count() or 1) // WORKER_COUNT),
+                             on_encoded=OUTPUT_INDEX.refresh)
+OUTPUT_FORMATS = []
+for fmt in config.get('output_formats', []):
+    if fmt in available_formats():
+        OUTPUT_FORMATS.append(fmt)
+    else:
+        print(f"⚠ Warning: output format {fmt} is not available (install ffmpeg for ogg and mp3)")
 
-    return {"bits_per_sample": bits_per_sample, "rate": rate}
+# Parsed uploads, served to the browser a table of contents and a page of paragraphs at a time,
+# and referenced by (doc_id, chapter, paragraph) from the generation endpoints
+DOCUMENT_STORE = DocumentStore(
+    DOCUMENTS_DIR,
+    max_documents=config.get('max_documents', 8),
+    max_spilled=config.get('max_spilled_documents', 100)
+)
+
+# Largest page of paragraphs returned by /documents/<doc_id>/chapters/<n>
+MAX_PARAGRAPH_PAGE = 1000
+
+# /concatenate-audio cuts the silence at each end of a paragraph down to 'edge_silence_seconds' and brings
+# its speech to 'target_loudness_dbfs' before joining (requests can turn either off)
+CONCAT_EDGE_SILENCE = config.get('edge_silence_seconds', EDGE_SILENCE_SECONDS)
+CONCAT_TARGET_DBFS = config.get('target_loudness_dbfs', TARGET_LOUDNESS_DBFS)
+
+# Latency histograms and counters served at /metrics in the Prometheus text format
+METRICS = MetricsRegistry(prefix='ugmpa_')
+TTS_FIRST_CHUNK_SECONDS = METRICS.histogram(
+    'tts_first_chunk_seconds', 'Time from sending a Gemini TTS request to its first audio chunk')
+TTS_SYNTHESIS_SECONDS = METRICS.histogram(
+    'tts_synthesis_seconds', 'Time from sending a Gemini TTS request to its last audio chunk')
+TTS_AUDIO_BYTES = METRICS.histogram(
+    'tts_audio_bytes', 'Bytes of audio returned by one Gemini TTS request', BYTES_BUCKETS)
+DECODE_SECONDS = METRICS.histogram(
+    'decode_file_seconds', 'Time to decode and parse an upload in /decode-file')
+CONCATENATE_THROUGHPUT = METRICS.histogram(
+    'concatenate_bytes_per_second', 'Output bytes written per second by /concatenate-audio', THROUGHPUT_BUCKETS)
+FILE_WRITE_SECONDS = METRICS.histogram(
+    'output_write_seconds', 'Time spent writing one audio file into outputs/')
+HTTP_ERRORS = METRICS.counter(
+    'http_errors_total', 'Requests answered with a server error, by endpoint', ('endpoint',))
+
+def component_metrics():
+    """Counters kept by the cache, scheduler, encoder, in-flight claims and generations, exported as they are."""
+    cache = AUDIO_CACHE.stats()
+    scheduler = TTS_SCHEDULER.stats()
+    encoder = AUDIO_ENCODER.stats()
+    in_flight = IN_FLIGHT.stats()
+    generations = GENERATIONS.stats()
+    return [
+        ('cache_hits_total', 'counter', 'Audio cache hits', cache['hits']),
+        ('cache_misses_total', 'counter', 'Audio cache misses', cache['misses']),
+        ('cache_bytes', 'gauge', 'Bytes of audio in the cache', cache['bytes']),
+        ('tts_calls_total', 'counter', 'Gemini TTS calls', scheduler['calls']),
+        ('tts_retries_total', 'counter', 'Gemini TTS calls retried', scheduler['retries']),
+        ('tts_failures_total', 'counter', 'Gemini TTS calls that failed after retries', scheduler['failures']),
+        ('tts_rate_limited_total', 'counter', 'Gemini TTS calls answered with 429', scheduler['rate_limited']),
+        ('tts_throttle_seconds_total', 'counter', 'Seconds spent waiting for rate limits', scheduler['throttle_seconds_total']),
+        ('tts_backoff_seconds_total', 'counter', 'Seconds spent backing off before retries', scheduler['backoff_seconds_total']),
+        ('tts_circuit_open', 'gauge', '1 while the circuit breaker is open', int(scheduler['circuit_state'] == 'open')),
+        ('encoder_failures_total', 'counter', 'Failed compressed encodings', encoder['failed']),
+        ('encoder_pending', 'gauge', 'Encodings waiting or running', encoder['pending']),
+        ('in_flight_waits_total', 'counter', 'Syntheses that waited for another worker making the same audio', in_flight['waits']),
+        ('in_flight_held', 'gauge', 'Syntheses in progress across all worker processes', in_flight['held']),
+        ('generations_joined_total', 'counter', 'Requests that joined an identical generation in progress', generations['joined']),
+    ]
+
+METRICS.register_collector(component_metrics)
+
+@app.after_request
+def count_server_errors(response):
+    if response.status_code >= 500:
+        HTTP_ERRORS.inc(endpoint=request.endpoint or 'unknown')
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Endpoint exposing latency histograms and counters in the Prometheus text format."""
+    return Response(METRICS.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/')
 def index():
@@ -130,15 +235,13 @@ def save_config_endpoint():
     """Endpoint to save default configuration."""
     try:
         data = request.json
-        # Load existing config to preserve api_key
-        existing_config = load_config()
-        config = {
+        # Merged into the existing config, which keeps api_key and the server settings; edits
+        # arriving in quick succession (the page saves as the prompt is typed) share one write
+        CONFIG.update({
             'prompt': data.get('prompt', ''),
             'voice1': data.get('voice1', 'Puck'),
             'voice2': data.get('voice2', 'Zephyr'),
-            'api_key': existing_config.get('api_key', '')  # Preserve existing api_key
-        }
-        save_config(config)
+        })
         return jsonify({'success': True, 'message': 'Configuration saved'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -175,16 +278,24 @@ def test_api():
             'error': error_msg
         }), 500
 
-def decode_file_content(file_data: bytes) -> str:
-    """Decode file content trying multiple encodings, prioritizing Chinese encodings."""
-    encodings = ['utf-8', 'utf-8-sig', 'gbk', 'gb2312', 'gb18030', 'big5', 'latin-1', 'cp1252', 'iso-8859-1']
-    for encoding in encodings:
-        try:
-            return file_data.decode(encoding)
-        except (UnicodeDecodeError, LookupError):
-            continue
-    # Fallback: use UTF-8 with error replacement
-    return file_data.decode('utf-8', errors='replace')
+def document_reference(source) -> tuple | None:
+    """
+    Read a (document, chapter_index, paragraph_index) reference from form or JSON fields.
+    
+    Returns None when no doc_id is given. paragraph_index is None when absent.
+    Raises LookupError for an unknown document, chapter or paragraph.
+    """
+    doc_id = source.get('doc_id')
+    if not doc_id:
+        return None
+    document = DOCUMENT_STORE.get(doc_id)
+    if document is None:
+        raise LookupError('Document not found; please upload the file again')
+    chapter_index = int(source.get('chapter_index', 0))
+    document.chapter(chapter_index)
+    paragraph_index = source.get('paragraph_index')
+    paragraph_index = int(paragraph_index) if paragraph_index not in (None, '') else None
+    return document, chapter_index, paragraph_index
 
 def parse_chapters(text: str) -> list[dict]:
     """
@@ -196,63 +307,7 @@ def parse_chapters(text: str) -> list[dict]:
     Returns:
         List of dictionaries with 'title' and 'content' keys
     """
-    # Pattern to match chapter markers: 第 followed by numbers or Chinese numbers, then 章
-    # Examples: 第1章, 第一章, 第10章, etc.
-    # Also captures optional chapter name after 章
-    chapter_pattern = r'(第[0-9一二三四五六七八九十百千万]+章[^\n]*)'
-    
-    chapters = []
-    # Find all chapter markers
-    matches = list(re.finditer(chapter_pattern, text))
-    
-    if not matches:
-        # No chapters found, return entire text as single item with paragraphs
-        full_text = text.strip()
-        paragraphs = parse_paragraphs(full_text)
-        return [{'title': '全文', 'content': full_text, 'paragraphs': paragraphs}]
-    
-    # Handle content before first chapter
-    if matches[0].start() > 0:
-        preface_content = text[:matches[0].start()].strip()
-        preface_paragraphs = parse_paragraphs(preface_content)
-        # Prepend chapter title as the first paragraph
-        preface_paragraphs.insert(0, '前言')
-        chapters.append({
-            'title': '前言',
-            'content': preface_content,
-            'paragraphs': preface_paragraphs
-        })
-    
-    # Split text by chapter markers
-    for i, match in enumerate(matches):
-        chapter_start = match.start()
-        chapter_title = match.group(1).strip()
-        
-        # Get content until next chapter or end of text
-        if i < len(matches) - 1:
-            next_match = matches[i + 1]
-            chapter_end = next_match.start()
-            chapter_content = text[chapter_start:chapter_end]
-        else:
-            # Last chapter - get remaining text
-            chapter_content = text[chapter_start:]
-        
-        # Remove the chapter title from content (it's already in title)
-        chapter_content = chapter_content.replace(chapter_title, '', 1).strip()
-        
-        # Parse paragraphs from chapter content
-        paragraphs = parse_paragraphs(chapter_content)
-        
-        # Prepend chapter title as the first paragraph
-        paragraphs.insert(0, chapter_title)
-        
-        chapters.append({
-            'title': chapter_title,
-            'content': chapter_content,
-            'paragraphs': paragraphs
-        })
-    
-    return chapters
+    return Book.from_text(text).to_dicts()
 
 def parse_paragraphs(text: str) -> list[str]:
     """
@@ -267,35 +322,69 @@ def parse_paragraphs(text: str) -> list[str]:
     """
     if not text:
         return []
-    
-    # Split by double newlines first (common paragraph separator)
-    paragraphs = re.split(r'\n\s*\n', text)
-    
-    # Further split by single newlines if paragraphs are too long
-    # This handles cases where paragraphs are separated by single newlines
-    result = []
-    for para in paragraphs:
-        para = para.strip()
-        if not para:
-            continue
-        
-        # If paragraph is very long and contains single newlines, 
-        # it might be multiple paragraphs separated by single newlines
-        if len(para) > 500 and '\n' in para:
-            # Split by single newlines and treat each as a paragraph
-            sub_paras = re.split(r'\n+', para)
-            for sub_para in sub_paras:
-                sub_para = sub_para.strip()
-                if sub_para:
-                    result.append(sub_para)
-        else:
-            result.append(para)
-    
-    return result if result else [text.strip()]
+    return list(iter_paragraphs(text)) or [text.strip()]
+
+@app.route('/client-stats', methods=['GET'])
+def client_stats():
+    """Endpoint to report Gemini client pool reuse and acquisition timings."""
+    return jsonify(CLIENT_POOL.stats())
+
+@app.route('/scheduler-stats', methods=['GET'])
+def scheduler_stats():
+    """Endpoint to report TTS retries, rate limiting, throttle time and circuit breaker state."""
+    return jsonify(TTS_SCHEDULER.stats())
+
+@app.route('/coordination-stats', methods=['GET'])
+def coordination_stats():
+    """Endpoint to report syntheses claimed, waited for and in progress across worker processes."""
+    return jsonify(IN_FLIGHT.stats())
+
+@app.route('/config-stats', methods=['GET'])
+def config_stats():
+    """Endpoint to report config.json reloads, and how many saves were written."""
+    return jsonify(CONFIG.stats())
+
+@app.route('/generation-stats', methods=['GET'])
+def generation_stats():
+    """Endpoint to report generations started, and requests that joined one already in progress."""
+    return jsonify(GENERATIONS.stats())
+
+@app.route('/batch-stats', methods=['GET'])
+def batch_stats():
+    """Endpoint to report how many API requests paragraph batching saved."""
+    return jsonify(PARAGRAPH_BATCHER.stats())
+
+@app.route('/cache-stats', methods=['GET'])
+def cache_stats():
+    """Endpoint to report audio cache size and hit rate."""
+    return jsonify(AUDIO_CACHE.stats())
+
+@app.route('/output-index/stats', methods=['GET'])
+def output_index_stats():
+    """Endpoint to report output index size and refresh cost."""
+    return jsonify(OUTPUT_INDEX.stats())
+
+@app.route('/encoder/stats', methods=['GET'])
+def encoder_stats():
+    """Endpoint to report output transcoding progress and cost."""
+    stats = AUDIO_ENCODER.stats()
+    stats['output_formats'] = OUTPUT_FORMATS
+    return jsonify(stats)
+
+@app.route('/documents/stats', methods=['GET'])
+def document_stats():
+    """Endpoint to report how many parsed uploads are held and how much parsing they cost."""
+    return jsonify(DOCUMENT_STORE.stats())
 
 @app.route('/decode-file', methods=['POST'])
 def decode_file():
-    """Endpoint to decode uploaded file and return content and chapters for preview."""
+    """
+    Endpoint to decode and parse an uploaded file for preview.
+    
+    The parsed book stays on the server; the response only carries its document id
+    and table of contents (chapter titles and paragraph counts). Paragraph text is
+    fetched per chapter from /documents/<doc_id>/chapters/<n>.
+    """
     try:
         if 'text_file' not in request.files:
             return jsonify({'error': 'No file provided'}), 400
@@ -304,17 +393,47 @@ def decode_file():
         if not file.filename:
             return jsonify({'error': 'No file selected'}), 400
         
-        file_data = file.read()
-        # Reset file stream position if possible (for Flask file objects)
-        if hasattr(file, 'seek'):
-            file.seek(0)
+        # Decode and split the upload block by block instead of reading it whole
+        with DECODE_SECONDS.time():
+            document = DOCUMENT_STORE.add_upload(file.stream, file.filename)
+        return jsonify(document.toc())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/documents/<doc_id>', methods=['GET'])
+def get_document(doc_id):
+    """Endpoint to fetch the table of contents of a parsed upload."""
+    document = DOCUMENT_STORE.get(doc_id)
+    if document is None:
+        return jsonify({'error': 'Document not found'}), 404
+    return jsonify(document.toc())
+
+@app.route('/documents/<doc_id>/chapters/<int:chapter_index>', methods=['GET'])
+def get_document_chapter(doc_id, chapter_index):
+    """
+    Endpoint to fetch one page of a chapter's paragraphs.
+    
+    Query parameters: offset (default 0) and limit (default 200, at most MAX_PARAGRAPH_PAGE).
+    """
+    try:
+        document = DOCUMENT_STORE.get(doc_id)
+        if document is None:
+            return jsonify({'error': 'Document not found'}), 404
+        try:
+            chapter = document.chapter(chapter_index)
+        except LookupError as e:
+            return jsonify({'error': str(e)}), 404
         
-        text_content = decode_file_content(file_data)
-        chapters = parse_chapters(text_content)
+        offset = max(0, request.args.get('offset', 0, type=int))
+        limit = min(max(1, request.args.get('limit', 200, type=int)), MAX_PARAGRAPH_PAGE)
         
         return jsonify({
-            'content': text_content,
-            'chapters': chapters
+            'doc_id': doc_id,
+            'index': chapter_index,
+            'title': chapter.title,
+            'total': document.paragraph_counts[chapter_index],
+            'offset': offset,
+            'paragraphs': document.paragraphs(chapter_index, offset, limit)
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -330,15 +449,7 @@ def check_audio_files():
         if not chapter_title or not total_paragraphs:
             return jsonify({'error': 'Chapter title and paragraph count required'}), 400
         
-        safe_title = sanitize_filename(chapter_title)
-        existing_files = {}
-        
-        # Check for each paragraph file
-        for index in range(1, total_paragraphs + 1):
-            filename = f"{safe_title}_{index:03d}.wav"
-            file_path = os.path.join(OUTPUT_DIR, filename)
-            if os.path.exists(file_path):
-                existing_files[index] = filename
+        existing_files = chapter_paragraph_files(chapter_title, total_paragraphs)
         
         return jsonify({
             'success': True,
@@ -347,6 +458,76 @@ def check_audio_files():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def output_entry(filename: str) -> dict | None:
+    """
+    OUTPUT_INDEX entry of an output file.
+    
+    Files written by another process may not be indexed until the next rescan, so
+    a miss checks the disk and indexes the file if it is there.
+    """
+    entry = OUTPUT_INDEX.get(filename)
+    if entry is None:
+        file_path = safe_join(OUTPUT_DIR, filename)
+        # The index is flat; names with directories never refer to outputs
+        if file_path is not None and os.path.basename(filename) == filename and os.path.isfile(file_path):
+            OUTPUT_INDEX.refresh(file_path)
+            entry = OUTPUT_INDEX.get(filename)
+    return entry
+
+def output_exists(filename: str) -> bool:
+    """Whether an output file exists, according to OUTPUT_INDEX or else the disk (see output_entry)."""
+    return output_entry(filename) is not None
+
+def chapter_paragraph_files(chapter_title: str, total_paragraphs: int) -> dict[int, str]:
+    """Existing paragraph files of a chapter, {paragraph number: filename}, looked up in OUTPUT_INDEX."""
+    paragraph_files = OUTPUT_INDEX.paragraph_files(sanitize_filename(chapter_title))
+    return {index: filename for index, filename in sorted(paragraph_files.items()) if 1 <= index <= total_paragraphs}
+
+def chapter_audio_filename(chapter_title: str) -> str | None:
+    """Filename of a chapter's full audio file, if one exists."""
+    safe_title = sanitize_filename(chapter_title)
+    for ext in CHAPTER_AUDIO_EXTENSIONS:
+        filename = f"{safe_title}{ext}"
+        if output_exists(filename):
+            return filename
+    return None
+
+def chapter_audio_status(chapter_title: str, total_paragraphs: int) -> dict:
+    """Status of one chapter's audio, answered from OUTPUT_INDEX; includes the chapter WAV's duration in seconds."""
+    status = {'existing_files': chapter_paragraph_files(chapter_title, total_paragraphs), 'generated': False}
+    filename = chapter_audio_filename(chapter_title)
+    if filename:
+        status['generated'] = True
+        status['filename'] = filename
+        duration = OUTPUT_INDEX.duration(filename)
+        if duration is not None:
+            status['duration'] = round(duration, 2)
+    return status
+
+@app.route('/check-audio-status', methods=['POST'])
+def check_audio_status():
+    """
+    Batch version of /check-audio-files and /check-chapter-generated for a whole book.
+    
+    JSON body: {"chapters": [{"title": ..., "total_paragraphs": N}, ...]}
+    Answers from the in-memory output index instead of one stat call per file.
+    """
+    try:
+        data = request.json or {}
+        chapters = data.get('chapters', [])
+        if not isinstance(chapters, list):
+            return jsonify({'error': 'chapters must be a list'}), 400
+        
+        return jsonify({
+            'success': True,
+            'chapters': [
+                chapter_audio_status(chapter.get('title', ''), int(chapter.get('total_paragraphs', 0)))
+                for chapter in chapters
+            ]
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/check-chapter-generated', methods=['POST'])
 def check_chapter_generated():
     """Endpoint to check if a chapter audio file exists (full chapter generation)."""
@@ -357,19 +538,15 @@ def check_chapter_generated():
         if not chapter_title:
             return jsonify({'error': 'Chapter title required'}), 400
         
-        safe_title = sanitize_filename(chapter_title)
         # Check for full chapter audio file (format: {chapter_title}.wav)
         # Also check common audio extensions
-        extensions = ['.wav', '.mp3', '.ogg']
-        for ext in extensions:
-            filename = f"{safe_title}{ext}"
-            file_path = os.path.join(OUTPUT_DIR, filename)
-            if os.path.exists(file_path):
-                return jsonify({
-                    'success': True,
-                    'generated': True,
-                    'filename': filename
-                })
+        filename = chapter_audio_filename(chapter_title)
+        if filename:
+            return jsonify({
+                'success': True,
+                'generated': True,
+                'filename': filename
+            })
         
         return jsonify({
             'success': True,
@@ -380,7 +557,7 @@ def check_chapter_generated():
 
 def generate_tts(text_content: str, prompt: str, speaker1_voice: str, speaker2_voice: str):
     """
-    Generate TTS audio from text content.
+    Generate TTS audio from text content, reusing cached audio for identical requests.
     
     Args:
         text_content: The text content to convert to speech
@@ -391,12 +568,329 @@ def generate_tts(text_content: str, prompt: str, speaker1_voice: str, speaker2_v
     Returns:
         Tuple of (audio_data: bytes, file_extension: str)
     """
+    key = cache_key(TTS_MODEL, prompt, speaker1_voice, speaker2_voice, text_content)
+    cached_path = AUDIO_CACHE.lookup(key)
+    if cached_path:
+        with open(cached_path, 'rb') as f:
+            return f.read(), os.path.splitext(cached_path)[1]
+    
+    audio_data, extension = call_tts_api(text_content, prompt, speaker1_voice, speaker2_voice)
+    AUDIO_CACHE.put_bytes(key, audio_data, extension)
+    return audio_data, extension
+
+def output_finished(output_path: str):
+    """Record a finished output file in OUTPUT_INDEX and queue its encodings in OUTPUT_FORMATS."""
+    OUTPUT_INDEX.refresh(output_path)
+    if output_path.endswith('.wav'):
+        for fmt in OUTPUT_FORMATS:
+            AUDIO_ENCODER.submit(output_path, fmt)
+
+def synthesize_to_file(text_content: str, prompt: str, speaker1_voice: str, speaker2_voice: str, output_base: str,
+                       regenerate: bool = False) -> str:
+    """
+    Synthesize text into `output_base` + extension and return the output path.
+    
+    Cache hits are hard-linked (or copied) into place without reading the audio.
+    The output is replaced atomically, never rewritten in place, because it may
+    share its inode with a cache entry. A call for a file that is already being
+    generated from the same text and voices waits for that generation instead.
+    With `regenerate`, the cache is skipped and the new take replaces its entry.
+    """
+    key = cache_key(TTS_MODEL, prompt, speaker1_voice, speaker2_voice, text_content)
+    return GENERATIONS.do((output_base, key, regenerate), lambda: write_synthesis(
+        key, text_content, prompt, speaker1_voice, speaker2_voice, output_base, regenerate))
+
+def write_synthesis(key: str, text_content: str, prompt: str, speaker1_voice: str, speaker2_voice: str,
+                    output_base: str, regenerate: bool = False) -> str:
+    """Place the audio for cache key `key` at `output_base` + extension, from the cache or from the API."""
+    output_path = None if regenerate else AUDIO_CACHE.fetch_to(key, output_base)
+    if not output_path:
+        with IN_FLIGHT.claim(key):
+            # Another worker may have synthesized it while we waited for the claim
+            if not regenerate and key in AUDIO_CACHE:
+                output_path = AUDIO_CACHE.fetch_to(key, output_base)
+            if not output_path:
+                output_path = TTS_SCHEDULER.run(lambda: write_audio_stream(
+                    stream_tts_audio(text_content, prompt, speaker1_voice, speaker2_voice), output_base))
+                AUDIO_CACHE.put_file(key, output_path)
+    output_finished(output_path)
+    return output_path
+
+def plan_paragraph_batches(paragraphs: list[tuple[int, str]], prompt: str, voice1: str, voice2: str) -> list[ParagraphBatch]:
+    """Batch the paragraphs that need an API call; paragraphs already in the cache stay on their own."""
+    cached = []
+    uncached = []
+    for index, paragraph in paragraphs:
+        if cache_key(TTS_MODEL, prompt, voice1, voice2, paragraph) in AUDIO_CACHE:
+            cached.append(ParagraphBatch([index], [paragraph]))
+        else:
+            uncached.append((index, paragraph))
+    return sorted(cached + PARAGRAPH_BATCHER.plan(uncached), key=lambda batch: batch.indexes[0])
+
+def synthesize_paragraph_batch(batch: ParagraphBatch, prompt: str, voice1: str, voice2: str, safe_title: str) -> list[str]:
+    """
+    Synthesize a batch of paragraphs with one API call and write {safe_title}_{NNN}.wav for each.
+    
+    The batch's audio is cut at the pauses between paragraphs (see ParagraphBatcher.split),
+    and each cut is cached under its own paragraph's key. Single paragraphs, and responses
+    that are not 16-bit PCM, go through synthesize_to_file one paragraph at a time.
+    
+    Returns:
+        Output filenames, in paragraph order
+    """
+    claim_key = batch_claim_key(batch, prompt, voice1, voice2)
+    return GENERATIONS.do((safe_title, tuple(batch.indexes), claim_key), lambda: write_paragraph_batch(
+        batch, prompt, voice1, voice2, safe_title, claim_key))
+
+def write_paragraph_batch(batch: ParagraphBatch, prompt: str, voice1: str, voice2: str, safe_title: str,
+                          claim_key: str) -> list[str]:
+    """The work of synthesize_paragraph_batch, done once however many requests ask for the batch."""
+    def synthesize_each():
+        return [
+            os.path.basename(synthesize_to_file(text, prompt, voice1, voice2, paragraph_output_base(safe_title, index)))
+            for index, text in zip(batch.indexes, batch.texts)
+        ]
+    
+    if len(batch.indexes) == 1:
+        return synthesize_each()
+    
+    def collect():
+        return list(stream_tts_audio(batch.text, prompt, voice1, voice2))
+    
+    with IN_FLIGHT.claim(claim_key):
+        if batch_cached(batch, prompt, voice1, voice2):
+            # Synthesized by another worker while we waited for the claim
+            return synthesize_each()
+        filenames = write_batch_audio(batch, TTS_SCHEDULER.run(collect), prompt, voice1, voice2, safe_title)
+    if filenames is None:
+        return synthesize_each()
+    return filenames
+
+def batch_claim_key(batch: ParagraphBatch, prompt: str, voice1: str, voice2: str) -> str:
+    return 'batch:' + cache_key(TTS_MODEL, prompt, voice1, voice2, batch.text)
+
+def batch_cached(batch: ParagraphBatch, prompt: str, voice1: str, voice2: str) -> bool:
+    return all(cache_key(TTS_MODEL, prompt, voice1, voice2, text) in AUDIO_CACHE for text in batch.texts)
+
+def paragraph_output_base(safe_title: str, index: int) -> str:
+    return os.path.join(OUTPUT_DIR, f"{safe_title}_{index:03d}")
+
+def write_batch_audio(batch: ParagraphBatch, chunks: list[tuple[bytes, str]], prompt: str, voice1: str, voice2: str,
+                      safe_title: str) -> list[str] | None:
+    """
+    Cut a batch's (data, mime_type) audio chunks into one WAV per paragraph.
+    
+    Paragraphs are cached only when every cut fell at a detected pause; estimated cuts
+    are kept as outputs but regenerating those paragraphs makes a new request.
+    
+    Returns:
+        Output filenames, in paragraph order, or None for audio that cannot be cut (not 16-bit PCM)
+    """
+    if not chunks:
+        raise Exception('No audio generated')
+    mime_type = chunks[-1][1]
+    parameters = parse_audio_mime_type(mime_type)
+    if mimetypes.guess_extension(mime_type) is not None or parameters['bits_per_sample'] != 16:
+        print(f"Cannot cut {mime_type} audio, generating paragraphs {batch.indexes} one by one")
+        return None
+    
+    samples = pcm_samples(b''.join(data for data, _ in chunks))
+    ranges, method = PARAGRAPH_BATCHER.split(samples, parameters['rate'], batch.texts)
+    if method == 'split_proportional':
+        # Estimated cuts may split a word or hand speech to the next paragraph; cached, they would stick for good
+        print(f"Paragraphs {batch.indexes} cut at estimated positions, not caching them")
+    filenames = []
+    for index, text, (start, end) in zip(batch.indexes, batch.texts, ranges):
+        output_path = paragraph_output_base(safe_title, index) + '.wav'
+        writer = WavStreamWriter(temp_name(output_path), parameters['rate'], parameters['bits_per_sample'])
+        writer.write(pcm_bytes(samples[start:end]))
+        writer.close()
+        os.replace(writer.path, output_path)
+        FILE_WRITE_SECONDS.observe(writer.write_seconds)
+        if method != 'split_proportional':
+            AUDIO_CACHE.put_file(cache_key(TTS_MODEL, prompt, voice1, voice2, text), output_path)
+        output_finished(output_path)
+        filenames.append(os.path.basename(output_path))
+    return filenames
+
+def write_audio_stream(chunks, output_base: str) -> str:
+    """
+    Write streamed (data, mime_type) audio chunks to `output_base` + extension as they arrive.
+    
+    Raw PCM goes into a single WAV whose header is patched once the stream ends.
+    The file is written under a temporary name and renamed when complete.
+    """
+    writer = None
+    output_path = None
+    try:
+        for data, mime_type in chunks:
+            if writer is None:
+                extension = mimetypes.guess_extension(mime_type)
+                if extension is None:
+                    extension = ".wav"
+                    parameters = parse_audio_mime_type(mime_type)
+                    output_path = output_base + extension
+                    temp_path = temp_name(output_path)
+                    writer = WavStreamWriter(temp_path, parameters["rate"], parameters["bits_per_sample"])
+                else:
+                    # Already an encoded container; chunks are appended as-is
+                    output_path = output_base + extension
+                    temp_path = temp_name(output_path)
+                    writer = open(temp_path, 'wb')
+            writer.write(data)
+    except BaseException:
+        if writer is not None:
+            writer.close()
+            os.remove(temp_path)
+        raise
+    
+    if writer is None:
+        raise Exception('No audio generated')
+    writer.close()
+    os.replace(temp_path, output_path)
+    if isinstance(writer, WavStreamWriter):
+        FILE_WRITE_SECONDS.observe(writer.write_seconds)
+    return output_path
+
+def audio_file_response(output_path: str):
+    """Send a finished output file, named in X-Output-Filename for the page."""
+    response = send_file(output_path, mimetype=mimetypes.guess_type(output_path)[0])
+    response.headers['X-Output-Filename'] = os.path.basename(output_path)
+    return response
+
+def stream_tts_response(text_content: str, prompt: str, speaker1_voice: str, speaker2_voice: str, output_base: str,
+                        regenerate: bool = False):
+    """
+    Build a chunked audio/wav response that forwards PCM as soon as Gemini streams it.
+    
+    The same audio is teed to `output_base`.wav and added to the cache once complete.
+    Errors before the first chunk raise normally, so the caller can still return a JSON error.
+    A request for audio already being generated into the same file is not streamed; it
+    gets the file once that generation has written it. With `regenerate`, the cache is skipped.
+    """
+    key = cache_key(TTS_MODEL, prompt, speaker1_voice, speaker2_voice, text_content)
+    cached_path = None if regenerate else AUDIO_CACHE.fetch_to(key, output_base)
+    if cached_path:
+        output_finished(cached_path)
+        return audio_file_response(cached_path)
+    
+    flight_key = (output_base, key, regenerate)
+    flight, leader = GENERATIONS.begin(flight_key)
+    if not leader:
+        return audio_file_response(flight.wait())
+    
+    try:
+        chunks = stream_tts_audio(text_content, prompt, speaker1_voice, speaker2_voice)
+        first = next(chunks, None)
+        if first is None:
+            raise Exception('No audio generated')
+        
+        data, mime_type = first
+        if mimetypes.guess_extension(mime_type) is not None:
+            # Not raw PCM - there is no header to stream ahead of the data, so send the finished file
+            output_path = write_audio_stream(itertools.chain([first], chunks), output_base)
+            AUDIO_CACHE.put_file(key, output_path)
+            output_finished(output_path)
+            GENERATIONS.end(flight_key, flight, output_path)
+            return audio_file_response(output_path)
+        
+        parameters = parse_audio_mime_type(mime_type)
+        output_path = output_base + ".wav"
+        writer = WavStreamWriter(temp_name(output_path), parameters["rate"], parameters["bits_per_sample"])
+    except BaseException as e:
+        GENERATIONS.end(flight_key, flight, error=e)
+        raise
+    
+    started = False
+    
+    def generate():
+        nonlocal started
+        started = True
+        completed = False
+        error = None
+        try:
+            yield wav_header(STREAMING_DATA_SIZE, parameters["rate"], parameters["bits_per_sample"])
+            writer.write(data)
+            yield data
+            for chunk_data, _ in chunks:
+                writer.write(chunk_data)
+                yield chunk_data
+            completed = True
+        except GeneratorExit:
+            # The browser went away; the audio is already paid for, so finish writing it to disk
+            try:
+                for chunk_data, _ in chunks:
+                    writer.write(chunk_data)
+                completed = True
+            except Exception as e:
+                print(f"Error finishing streamed audio for {output_path}: {e}")
+                error = e
+        except Exception as e:
+            print(f"Error streaming audio for {output_path}: {e}")
+            error = e
+        finally:
+            if completed:
+                writer.close()
+                os.replace(writer.path, output_path)
+                FILE_WRITE_SECONDS.observe(writer.write_seconds)
+                AUDIO_CACHE.put_file(key, output_path)
+                output_finished(output_path)
+                print(f"Streamed audio saved to {output_path}")
+                GENERATIONS.end(flight_key, flight, output_path)
+            else:
+                writer.abort()
+                GENERATIONS.end(flight_key, flight, error=error or Exception('Streaming was interrupted'))
+    
+    response = Response(generate(), mimetype='audio/wav', headers={
+        'Cache-Control': 'no-cache',
+        'X-Output-Filename': os.path.basename(output_path)
+    })
+    
+    def close_unstarted():
+        # A response closed before it was iterated (a HEAD request, or a client gone before the first byte)
+        # never runs generate(): release the Gemini stream, drop the partial file and don't leave joined
+        # requests waiting
+        if started:
+            return
+        chunks.close()
+        writer.abort()
+        GENERATIONS.end(flight_key, flight, error=Exception('The stream was closed before the audio was saved'))
+    
+    response.call_on_close(close_unstarted)
+    return response
+
+def call_tts_api(text_content: str, prompt: str, speaker1_voice: str, speaker2_voice: str):
+    """
+    Generate TTS audio from text content by calling the Gemini API.
+    
+    All streamed chunks are assembled into one file; raw PCM gets a single WAV header.
+    
+    Args:
+        text_content: The text content to convert to speech
+        prompt: The prompt/instruction for how to read the text
+        speaker1_voice: Voice name for Speaker 1
+        speaker2_voice: Voice name for Speaker 2
+    
+    Returns:
+        Tuple of (audio_data: bytes, file_extension: str)
+    """
+    chunks = TTS_SCHEDULER.run(lambda: list(stream_tts_audio(text_content, prompt, speaker1_voice, speaker2_voice)))
+    if not chunks:
+        raise Exception('No audio generated')
+    
+    mime_type = chunks[0][1]
+    audio_data = b''.join(data for data, _ in chunks)
+    file_extension = mimetypes.guess_extension(mime_type)
+    if file_extension is None:
+        file_extension = ".wav"
+        audio_data = convert_to_wav(audio_data, mime_type)
+    return audio_data, file_extension
+
+def tts_request(text_content: str, prompt: str, speaker1_voice: str, speaker2_voice: str) -> tuple:
+    """Build the (full_text, contents, config) of a Gemini TTS request."""
     # Combine prompt and text content
     full_text = f"{prompt}\n{text_content}" if prompt else text_content
     
-    # Initialize client
-    client = genai.Client(api_key=API_KEY)
-    
     # Prepare content
     contents = [
         types.Content(
@@ -433,38 +927,51 @@ def generate_tts(text_content: str, prompt: str, speaker1_voice: str, speaker2_v
         ),
     )
     
-    # Generate audio
-    model = "gemini-2.5-pro-preview-tts"
-    audio_chunks = []
-    
-    for chunk in client.models.generate_content_stream(
-        model=model,
-        contents=contents,
-        config=generate_content_config,
+    return full_text, contents, generate_content_config
+
+def chunk_audio(chunk):
+    """Yield (audio_data, mime_type) for every inline audio part of a streamed response chunk."""
+    if (
+        chunk.candidates is None
+        or chunk.candidates[0].content is None
+        or chunk.candidates[0].content.parts is None
     ):
-        if (
-            chunk.candidates is None
-            or chunk.candidates[0].content is None
-            or chunk.candidates[0].content.parts is None
-        ):
-            continue
-        
-        if chunk.candidates[0].content.parts[0].inline_data and chunk.candidates[0].content.parts[0].inline_data.data:
-            inline_data = chunk.candidates[0].content.parts[0].inline_data
-            data_buffer = inline_data.data
-            file_extension = mimetypes.guess_extension(inline_data.mime_type)
-            
-            if file_extension is None:
-                file_extension = ".wav"
-                data_buffer = convert_to_wav(inline_data.data, inline_data.mime_type)
-            
-            audio_chunks.append((data_buffer, file_extension))
+        return
     
-    if not audio_chunks:
-        raise Exception('No audio generated')
+    for part in chunk.candidates[0].content.parts:
+        if part.inline_data and part.inline_data.data:
+            yield part.inline_data.data, part.inline_data.mime_type
+
+def stream_tts_audio(text_content: str, prompt: str, speaker1_voice: str, speaker2_voice: str):
+    """
+    Call the Gemini API and yield audio as it is streamed back.
+    
+    The call goes through TTS_SCHEDULER: it waits for the key's rate limits and is
+    retried until audio starts to arrive; a failure after that raises StreamInterrupted.
     
-    # Return the first audio chunk (or combine all if needed)
-    return audio_chunks[0]
+    Yields:
+        Tuples of (audio_data: bytes, mime_type: str) for every inline audio part, in order
+    """
+    full_text, contents, generate_content_config = tts_request(text_content, prompt, speaker1_voice, speaker2_voice)
+    
+    # Generate audio
+    def call(lease):
+        start = time.perf_counter()
+        audio_bytes = 0
+        for chunk in lease.client.models.generate_content_stream(
+            model=TTS_MODEL,
+            contents=contents,
+            config=generate_content_config,
+        ):
+            for data, mime_type in chunk_audio(chunk):
+                if not audio_bytes:
+                    TTS_FIRST_CHUNK_SECONDS.observe(time.perf_counter() - start)
+                audio_bytes += len(data)
+                yield data, mime_type
+        TTS_SYNTHESIS_SECONDS.observe(time.perf_counter() - start)
+        TTS_AUDIO_BYTES.observe(audio_bytes)
+    
+    yield from TTS_SCHEDULER.stream(call, tokens=estimate_tokens(full_text))
 
 def sanitize_filename(filename: str) -> str:
     """Sanitize filename for filesystem compatibility."""
@@ -474,204 +981,295 @@ def sanitize_filename(filename: str) -> str:
     sanitized = sanitized.strip('. ')
     return sanitized
 
-def read_wav_header(file_path: str) -> dict:
-    """Read WAV file header and return audio parameters."""
-    with open(file_path, 'rb') as f:
-        # Read RIFF header
-        riff_chunk = f.read(12)
-        if riff_chunk[:4] != b'RIFF' or riff_chunk[8:12] != b'WAVE':
-            raise ValueError("Not a valid WAV file")
-        
-        # Read fmt chunk
-        fmt_chunk_id = f.read(4)
-        if fmt_chunk_id != b'fmt ':
-            raise ValueError("Missing fmt chunk")
-        
-        fmt_chunk_size = struct.unpack('<I', f.read(4))[0]
-        fmt_data = f.read(fmt_chunk_size)
-        
-        # Parse fmt data
-        audio_format, num_channels, sample_rate = struct.unpack('<HHI', fmt_data[:8])
-        byte_rate, block_align = struct.unpack('<IH', fmt_data[8:14])
-        bits_per_sample = struct.unpack('<H', fmt_data[14:16])[0] if fmt_chunk_size >= 16 else 16
-        
-        # Find data chunk
-        while True:
-            chunk_id = f.read(4)
-            if chunk_id == b'data':
-                data_size = struct.unpack('<I', f.read(4))[0]
-                data_offset = f.tell()
-                break
-            elif chunk_id == b'':
-                raise ValueError("Missing data chunk")
-            else:
-                chunk_size = struct.unpack('<I', f.read(4))[0]
-                f.seek(chunk_size, 1)
-        
-        return {
-            'num_channels': num_channels,
-            'sample_rate': sample_rate,
-            'bits_per_sample': bits_per_sample,
-            'byte_rate': byte_rate,
-            'block_align': block_align,
-            'data_size': data_size,
-            'data_offset': data_offset
-        }
+def concatenate_with_pydub(file_paths: list[str], output_path: str, pause_seconds: float = 1.5):
+    """Concatenate audio files of any format pydub can read, converting them to the first file's format."""
+    segments = [AudioSegment.from_file(file_path) for file_path in file_paths]
+    first = segments[0]
+    silence = (AudioSegment.silent(duration=int(pause_seconds * 1000), frame_rate=first.frame_rate)
+               .set_channels(first.channels).set_sample_width(first.sample_width))
+    
+    # Join raw PCM once instead of chaining AudioSegment additions, which copies the whole result every step
+    pieces = []
+    for i, segment in enumerate(segments):
+        segment = segment.set_frame_rate(first.frame_rate).set_channels(first.channels).set_sample_width(first.sample_width)
+        if i > 0:
+            pieces.append(silence.raw_data)
+        pieces.append(segment.raw_data)
+    
+    temp_path = temp_name(output_path)
+    first._spawn(b''.join(pieces)).export(temp_path, format="wav")
+    os.replace(temp_path, output_path)
 
-def read_wav_data(file_path: str, header: dict) -> bytes:
-    """Read audio data from WAV file."""
-    with open(file_path, 'rb') as f:
-        f.seek(header['data_offset'])
-        return f.read(header['data_size'])
+# WSGI servers whose file_wrapper stops at Content-Length, so it can carry a byte range
+SENDFILE_RANGE_SERVERS = ('gunicorn', 'waitress')
 
-def concatenate_wav_files_pure_python(audio_files: list[str], output_path: str, silence_seconds: float = 1.5):
+def audio_etag(entry: dict) -> str:
+    """Validator for an output file; files are replaced (never edited in place), so mtime and size identify a version."""
+    return f"{entry['mtime_ns']:x}-{entry['size']:x}"
+
+def audio_preconditions(entry: dict, etag: str):
     """
-    Concatenate multiple WAV files without requiring ffmpeg.
-    Assumes all WAV files have the same format.
+    Evaluate a request's conditional headers against an output file.
+    
+    Done before any Range handling, which would otherwise answer 206 to a request
+    whose If-Modified-Since or If-None-Match says the client's copy is current.
+    Returns a 412 or 304 response, or None to serve the file.
     """
-    if not audio_files:
-        raise ValueError("No audio files provided")
+    last_modified = datetime.fromtimestamp(int(entry['mtime']), timezone.utc)
+    if request.if_match:
+        if not request.if_match.contains(etag):
+            return Response(status=412)
+    elif request.if_unmodified_since is not None and last_modified > request.if_unmodified_since:
+        return Response(status=412)
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        return response
+    return None
+
+def send_audio_range(file_path: str, entry: dict, etag: str, mimetype: str):
+    """
+    Answer a single-range request through the server's wsgi.file_wrapper.
     
-    # Read first file to get format
-    first_header = read_wav_header(audio_files[0])
-    sample_rate = first_header['sample_rate']
-    bits_per_sample = first_header['bits_per_sample']
-    num_channels = first_header['num_channels']
-    bytes_per_sample = bits_per_sample // 8
+    The file is positioned at the range start and Content-Length is set to the range
+    length, which servers with a sendfile-backed wrapper (gunicorn, waitress) honor,
+    so partial content is sent without copying through Python. Returns None when the
+    request should get Werkzeug's regular conditional handling instead.
+    """
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    server = request.environ.get('SERVER_SOFTWARE', '').lower()
+    if file_wrapper is None or not server.startswith(SENDFILE_RANGE_SERVERS):
+        return None
+    if request.range is None or len(request.range.ranges) != 1:
+        return None
+    if request.if_range.etag is not None and request.if_range.etag != etag:
+        return None
+    if request.if_range.date is not None:
+        return None
     
-    # Calculate silence duration
-    silence_samples = int(sample_rate * silence_seconds)
-    silence_bytes = silence_samples * num_channels * bytes_per_sample
-    silence_data = b'\x00' * silence_bytes
+    byte_range = request.range.range_for_length(entry['size'])
+    if byte_range is None:
+        return None
+    start, stop = byte_range
     
-    # Read all audio data
-    all_audio_data = []
-    for i, file_path in enumerate(audio_files):
-        header = read_wav_header(file_path)
-        
-        # Verify format matches
-        if header['sample_rate'] != sample_rate or header['bits_per_sample'] != bits_per_sample or header['num_channels'] != num_channels:
-            print(f"Warning: {file_path} has different format, skipping...")
-            continue
-        
-        audio_data = read_wav_data(file_path, header)
-        all_audio_data.append(audio_data)
-        
-        # Add silence between files (except after the last one)
-        if i < len(audio_files) - 1:
-            all_audio_data.append(silence_data)
-    
-    # Combine all audio data
-    combined_data = b''.join(all_audio_data)
-    total_data_size = len(combined_data)
-    
-    # Write WAV file
-    byte_rate = sample_rate * num_channels * bytes_per_sample
-    block_align = num_channels * bytes_per_sample
-    chunk_size = 36 + total_data_size
-    
-    header = struct.pack(
-        "<4sI4s4sIHHIIHH4sI",
-        b"RIFF",
-        chunk_size,
-        b"WAVE",
-        b"fmt ",
-        16,
-        1,
-        num_channels,
-        sample_rate,
-        byte_rate,
-        block_align,
-        bits_per_sample,
-        b"data",
-        total_data_size
-    )
+    f = open(file_path, 'rb')
+    try:
+        f.seek(start)
+        response = Response(file_wrapper(f), status=206, mimetype=mimetype, direct_passthrough=True)
+        response.content_length = stop - start
+        response.content_range = ContentRange('bytes', start, stop, entry['size'])
+        response.set_etag(etag)
+        response.last_modified = entry['mtime']
+    except BaseException:
+        # The response never took ownership of the file
+        f.close()
+        raise
+    return response
+
+def negotiate_encoding(filename: str, entry: dict) -> str | None:
+    """
+    Choose an encoding of a WAV output to serve in its place.
+    
+    ?format=flac|ogg|mp3 asks for one explicitly and waits for it to be encoded.
+    Otherwise the smallest current encoding whose media type the Accept header
+    names is used; wildcards keep the WAV, so plain downloads are unchanged.
+    Encodings in OUTPUT_FORMATS that are accepted but missing or stale are
+    queued for the next request.
     
-    with open(output_path, 'wb') as f:
-        f.write(header)
-        f.write(combined_data)
+    Returns:
+        The filename of the encoding to serve, or None to serve the WAV itself
+    """
+    requested = request.args.get('format', '').lower()
+    if not filename.endswith('.wav') or requested == 'wav':
+        return None
+    stem = filename[:-len('.wav')]
+    if requested:
+        if requested not in available_formats():
+            raise ValueError(f"Format {requested} is not available (available: wav, {', '.join(available_formats())})")
+        encoded_path = AUDIO_ENCODER.encode(os.path.join(OUTPUT_DIR, filename), requested)
+        OUTPUT_INDEX.refresh(encoded_path)
+        return os.path.basename(encoded_path)
+    
+    accepted = {mimetype for mimetype, quality in request.accept_mimetypes if quality > 0}
+    for fmt in FORMAT_PREFERENCE:
+        if FORMATS[fmt]['mimetype'] not in accepted:
+            continue
+        encoded_name = stem + FORMATS[fmt]['extension']
+        encoded = OUTPUT_INDEX.get(encoded_name)
+        if encoded is not None and encoded['mtime_ns'] == entry['mtime_ns']:
+            return encoded_name
+        if fmt in OUTPUT_FORMATS:
+            AUDIO_ENCODER.submit(os.path.join(OUTPUT_DIR, filename), fmt)
+    return None
 
 @app.route('/outputs/<filename>')
 def serve_audio(filename):
-    """Serve audio files from the outputs directory."""
+    """
+    Serve audio files from the outputs directory.
+    
+    Supports byte ranges (so seeking only fetches what the player needs) and
+    ETag / Last-Modified validators. Responses are cacheable but revalidated on
+    every use, because regenerating a paragraph replaces the file under the same name.
+    WAV files may be answered with a compressed encoding (see negotiate_encoding).
+    """
     try:
-        file_path = os.path.join(OUTPUT_DIR, filename)
-        if os.path.exists(file_path):
-            return send_file(file_path, mimetype='audio/wav')
-        else:
+        file_path = safe_join(OUTPUT_DIR, filename)
+        entry = output_entry(filename)
+        if file_path is None or entry is None:
             return jsonify({'error': 'File not found'}), 404
+        
+        try:
+            encoded_name = negotiate_encoding(filename, entry)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        mimetype = mimetypes.guess_type(file_path)[0] or 'audio/wav'
+        encoded = OUTPUT_INDEX.get(encoded_name) if encoded_name else None
+        if encoded is not None:
+            entry = encoded
+            file_path = os.path.join(OUTPUT_DIR, encoded_name)
+            mimetype = FORMATS[os.path.splitext(encoded_name)[1][1:]]['mimetype']
+        
+        etag = audio_etag(entry)
+        
+        response = audio_preconditions(entry, etag)
+        if response is None:
+            response = send_audio_range(file_path, entry, etag, mimetype)
+        if response is None:
+            response = send_file(
+                file_path,
+                mimetype=mimetype,
+                conditional=True,
+                etag=etag,
+                last_modified=entry['mtime']
+            )
+        response.headers['Accept-Ranges'] = 'bytes'
+        if filename.endswith('.wav'):
+            response.vary.add('Accept')
+        response.cache_control.public = True
+        response.cache_control.no_cache = True
+        return response
+    except HTTPException:
+        # e.g. 416 Range Not Satisfiable from send_file
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+class GenerationRequest(NamedTuple):
+    """What /generate was asked to synthesize, and where the audio goes."""
+    text_content: str
+    prompt: str
+    voice1: str
+    voice2: str
+    output_base: str
+    chapter_title: str
+    save_to_file: bool
+    stream: bool
+    regenerate: bool
+
+def generation_request(form, files) -> GenerationRequest:
+    """
+    Read a /generate request's form fields and uploaded file.
+    
+    Raises LookupError for an unknown document reference and ValueError when there is no text.
+    """
+    # Get form data - prioritize uploaded file over text_content field
+    text_content = ''
+    
+    # Check if this is a chapter generation request
+    chapter_title = form.get('chapter_title', '')
+    save_to_file = form.get('save_to_file', 'false').lower() == 'true'
+    paragraph_index = form.get('paragraph_index', '')
+    stream = form.get('stream', 'false').lower() == 'true'
+    # Ask the API for a new take instead of serving the cached audio for this text
+    regenerate = form.get('regenerate', 'false').lower() == 'true'
+    
+    # Handle file upload first (takes priority); a file already decoded by /decode-file is not decoded again
+    if 'text_file' in files:
+        file = files['text_file']
+        if file.filename:
+            document = DOCUMENT_STORE.add_upload(file.stream, file.filename)
+            text_content = document.book.text()
+    
+    # A chapter or paragraph of an uploaded document, referenced by doc_id / chapter_index / paragraph_index
+    if not text_content:
+        reference = document_reference(form)
+        if reference:
+            document, chapter_index, reference_paragraph = reference
+            chapter_title = chapter_title or document.book.chapters[chapter_index].title
+            if reference_paragraph is None:
+                text_content = document.chapter_text(chapter_index)
+            else:
+                text_content = document.paragraph(chapter_index, reference_paragraph)
+    
+    # If no file uploaded, use text_content field
+    if not text_content:
+        text_content = form.get('text_content', '')
+    
+    # Get other parameters
+    defaults = CONFIG.snapshot()
+    prompt = form.get('prompt', defaults.get('prompt', ''))
+    voice1 = form.get('voice1', defaults.get('voice1', 'Puck'))
+    voice2 = form.get('voice2', defaults.get('voice2', 'Zephyr'))
+    
+    if not text_content:
+        raise ValueError('No text content provided. Please upload a file or enter text.')
+    
+    print(f"Generating TTS: prompt={prompt[:50]}..., voice1={voice1}, voice2={voice2}, save_to_file={save_to_file}, chapter_title={chapter_title}, paragraph_index={paragraph_index}")
+    
+    # Save to outputs folder with timestamp if requested or always for main generate button
+    if save_to_file and chapter_title:
+        # Chapter generation - save with chapter title
+        safe_title = sanitize_filename(chapter_title)
+        if paragraph_index:
+            # Individual paragraph generation - include sequence number
+            output_base = os.path.join(OUTPUT_DIR, f"{safe_title}_{int(paragraph_index)+1:03d}")
+        else:
+            # Full chapter generation - save without sequence number
+            output_base = os.path.join(OUTPUT_DIR, safe_title)
+    else:
+        # Main generate button - save with timestamp
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        output_base = os.path.join(OUTPUT_DIR, f"tts_output_{timestamp}")
+    
+    return GenerationRequest(text_content, prompt, voice1, voice2, output_base, chapter_title, save_to_file, stream,
+                             regenerate)
+
+def saved_audio_result(output_path: str) -> dict:
+    """JSON answer of /generate for audio saved under a chapter title."""
+    return {
+        'success': True,
+        'message': f'Audio saved to outputs/{os.path.basename(output_path)}',
+        'file_path': output_path,
+        'filename': os.path.basename(output_path)
+    }
+
 @app.route('/generate', methods=['POST'])
 def generate_endpoint():
     """Route handler for generating TTS audio - only called when Generate button is clicked."""
     try:
-        # Get form data - prioritize uploaded file over text_content field
-        text_content = ''
-        
-        # Handle file upload first (takes priority)
-        if 'text_file' in request.files:
-            file = request.files['text_file']
-            if file.filename:
-                file_data = file.read()
-                text_content = decode_file_content(file_data)
-        
-        # If no file uploaded, use text_content field
-        if not text_content:
-            text_content = request.form.get('text_content', '')
-        
-        # Get other parameters
-        prompt = request.form.get('prompt', '')
-        voice1 = request.form.get('voice1', 'Puck')
-        voice2 = request.form.get('voice2', 'Zephyr')
-        
-        # Check if this is a chapter generation request
-        chapter_title = request.form.get('chapter_title', '')
-        save_to_file = request.form.get('save_to_file', 'false').lower() == 'true'
-        paragraph_index = request.form.get('paragraph_index', '')
-        
-        if not text_content:
-            error_msg = 'No text content provided. Please upload a file or enter text.'
-            print(f"ERROR: {error_msg}")
-            return jsonify({'error': error_msg}), 400
-        
-        print(f"Generating TTS: prompt={prompt[:50]}..., voice1={voice1}, voice2={voice2}, save_to_file={save_to_file}, chapter_title={chapter_title}, paragraph_index={paragraph_index}")
-        
-        # Call the generate function with parameters
-        audio_data, extension = generate_tts(text_content, prompt, voice1, voice2)
+        try:
+            target = generation_request(request.form, request.files)
+        except LookupError as e:
+            return jsonify({'error': str(e)}), 404
+        except ValueError as e:
+            print(f"ERROR: {e}")
+            return jsonify({'error': str(e)}), 400
+        text_content, prompt, voice1, voice2, output_base = target[:5]
         
-        print(f"Generated audio: {len(audio_data)} bytes, extension={extension}")
+        # Streaming mode - send audio to the browser while it is being generated
+        if target.stream:
+            return stream_tts_response(text_content, prompt, voice1, voice2, output_base, target.regenerate)
         
-        # Save to outputs folder with timestamp if requested or always for main generate button
-        if save_to_file and chapter_title:
-            # Chapter generation - save with chapter title
-            safe_title = sanitize_filename(chapter_title)
-            if paragraph_index:
-                # Individual paragraph generation - include sequence number
-                output_path = os.path.join(OUTPUT_DIR, f"{safe_title}_{int(paragraph_index)+1:03d}{extension}")
-            else:
-                # Full chapter generation - save without sequence number
-                output_path = os.path.join(OUTPUT_DIR, f"{safe_title}{extension}")
-        else:
-            # Main generate button - save with timestamp
-            timestamp = time.strftime("%Y%m%d_%H%M%S")
-            output_path = os.path.join(OUTPUT_DIR, f"tts_output_{timestamp}{extension}")
+        # Call the generate function with parameters (served from the audio cache unless regenerating)
+        output_path = synthesize_to_file(text_content, prompt, voice1, voice2, output_base, target.regenerate)
+        extension = os.path.splitext(output_path)[1]
         
-        # Save audio to outputs folder
-        print(f"Saving audio to: {output_path}")
-        with open(output_path, 'wb') as f:
-            f.write(audio_data)
-        print(f"Audio saved successfully to {output_path}")
+        print(f"Audio saved successfully to {output_path} ({os.path.getsize(output_path)} bytes)")
         
         # Save config if this is a chapter generation
-        if save_to_file and chapter_title:
-            return jsonify({
-                'success': True,
-                'message': f'Audio saved to outputs/{os.path.basename(output_path)}',
-                'file_path': output_path,
-                'filename': os.path.basename(output_path)
-            })
+        if target.save_to_file and target.chapter_title:
+            return jsonify(saved_audio_result(output_path))
         
         # Return file for download (main generate button)
         return send_file(
@@ -688,67 +1286,102 @@ def generate_endpoint():
         traceback.print_exc()
         return jsonify({'error': error_msg}), 500
 
+class ParagraphRequest(NamedTuple):
+    """The paragraphs /generate-paragraphs was asked to synthesize, already batched."""
+    batches: list[ParagraphBatch]
+    prompt: str
+    voice1: str
+    voice2: str
+    safe_title: str
+
+def paragraph_request(form) -> ParagraphRequest:
+    """
+    Read a /generate-paragraphs request's form fields and plan its batches.
+    
+    Raises LookupError for an unknown document reference and ValueError for a request without paragraphs or title.
+    """
+    paragraphs = form.getlist('paragraphs[]')
+    chapter_title = form.get('chapter_title', '')
+    defaults = CONFIG.snapshot()
+    prompt = form.get('prompt', defaults.get('prompt', ''))
+    voice1 = form.get('voice1', defaults.get('voice1', 'Puck'))
+    voice2 = form.get('voice2', defaults.get('voice2', 'Zephyr'))
+    
+    # Paragraphs of an uploaded document can be referenced by doc_id and chapter_index instead of posted
+    if not paragraphs:
+        reference = document_reference(form)
+        if reference:
+            document, chapter_index, _ = reference
+            paragraphs = document.paragraphs(chapter_index)
+            chapter_title = chapter_title or document.book.chapters[chapter_index].title
+    
+    if not paragraphs:
+        raise ValueError('No paragraphs provided')
+    
+    if not chapter_title:
+        raise ValueError('Chapter title required')
+    
+    # Short paragraphs are batched into shared requests
+    pending = [(index, paragraph) for index, paragraph in enumerate(paragraphs, start=1) if paragraph.strip()]
+    batches = plan_paragraph_batches(pending, prompt, voice1, voice2)
+    return ParagraphRequest(batches, prompt, voice1, voice2, sanitize_filename(chapter_title))
+
+def paragraph_results(batches: list[ParagraphBatch], results: list[tuple[int, list[str]]]) -> tuple[dict, int]:
+    """JSON answer and status of /generate-paragraphs from (first index, filenames) of the batches that succeeded."""
+    saved_files = [filename for _, filenames in results for filename in filenames]
+    # Paragraphs whose batch still failed after retries, so the page can offer to retry just those
+    finished = {first for first, _ in results}
+    failed = [index for batch in batches if batch.indexes[0] not in finished for index in batch.indexes]
+    
+    if not saved_files:
+        return {'error': 'Failed to generate any paragraphs', 'failed_paragraphs': failed}, 500
+    
+    return {
+        'success': True,
+        'message': f'Generated {len(saved_files)} paragraph(s)',
+        'files': saved_files,
+        'failed_paragraphs': failed,
+        'output_dir': OUTPUT_DIR
+    }, 200
+
 @app.route('/generate-paragraphs', methods=['POST'])
 def generate_paragraphs_endpoint():
     """Route handler for generating TTS audio paragraph by paragraph."""
     try:
-        paragraphs = request.form.getlist('paragraphs[]')
-        chapter_title = request.form.get('chapter_title', '')
-        prompt = request.form.get('prompt', '')
-        voice1 = request.form.get('voice1', 'Puck')
-        voice2 = request.form.get('voice2', 'Zephyr')
-        
-        if not paragraphs:
-            return jsonify({'error': 'No paragraphs provided'}), 400
-        
-        if not chapter_title:
-            return jsonify({'error': 'Chapter title required'}), 400
-        
-        safe_title = sanitize_filename(chapter_title)
-        saved_files = []
+        try:
+            batches, prompt, voice1, voice2, safe_title = paragraph_request(request.form)
+        except LookupError as e:
+            return jsonify({'error': str(e)}), 404
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        # Generate TTS for each paragraph
-        for index, paragraph in enumerate(paragraphs, start=1):
-            if not paragraph.strip():
-                continue
-                
-            try:
-                audio_data, extension = generate_tts(paragraph, prompt, voice1, voice2)
-                
-                # Save to outputs folder with sequence number
-                output_filename = f"{safe_title}_{index:03d}{extension}"
-                output_path = os.path.join(OUTPUT_DIR, output_filename)
-                
-                with open(output_path, 'wb') as f:
-                    f.write(audio_data)
-                
-                saved_files.append(output_filename)
-            except Exception as e:
-                # Continue with next paragraph if one fails
-                print(f"Error generating paragraph {index}: {e}")
-                continue
+        def synthesize(index, batch):
+            # Save to outputs folder with sequence numbers, one file per paragraph
+            return synthesize_paragraph_batch(batch, prompt, voice1, voice2, safe_title)
         
-        if not saved_files:
-            return jsonify({'error': 'Failed to generate any paragraphs'}), 500
-        
-        return jsonify({
-            'success': True,
-            'message': f'Generated {len(saved_files)} paragraph(s)',
-            'files': saved_files,
-            'output_dir': OUTPUT_DIR
-        })
+        # Batches run in parallel and files are written as each one finishes
+        results = PARAGRAPH_ENGINE.run([(batch.indexes[0], batch) for batch in batches], synthesize)
+        result, status = paragraph_results(batches, results)
+        return jsonify(result), status
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/concatenate-audio', methods=['POST'])
 def concatenate_audio():
-    """Concatenate multiple audio files into one with pauses."""
+    """
+    Concatenate multiple audio files into one with pauses.
+    
+    Files are joined as they are unless the request opts in with "trim_silence"
+    (cut each paragraph's edge silence) or "normalize" (level each paragraph).
+    """
     try:
         data = request.json
         chapter_title = data.get('chapter_title', '')
         audio_files = data.get('audio_files', [])
         pause_seconds = data.get('pause_seconds', 1.5)  # Default 1.5 seconds
+        trim_silence = data.get('trim_silence', False)
+        normalize = data.get('normalize', False)
         
         print(f"Concatenate request: chapter_title={chapter_title}, audio_files={audio_files}, pause_seconds={pause_seconds}")
         
@@ -764,55 +1397,36 @@ def concatenate_audio():
         output_filename = f"{safe_title}_cat.wav"
         output_path = os.path.join(OUTPUT_DIR, output_filename)
         
-        # Try to use pydub first (if available and ffmpeg is installed)
-        if PYDUB_AVAILABLE:
-            try:
-                combined_audio = None
-                pause_ms = int(pause_seconds * 1000)
-                
-                for i, filename in enumerate(audio_files):
-                    file_path = os.path.join(OUTPUT_DIR, filename)
-                    if not os.path.exists(file_path):
-                        print(f"Warning: File not found: {file_path}, skipping...")
-                        continue
-                    
-                    audio = AudioSegment.from_wav(file_path)
-                    
-                    if combined_audio is None:
-                        combined_audio = audio
-                    else:
-                        silence = AudioSegment.silent(duration=pause_ms)
-                        combined_audio = combined_audio + silence + audio
-                    
-                    print(f"Added audio file {i+1}/{len(audio_files)}: {filename}")
-                
-                if combined_audio is None:
-                    return jsonify({'error': 'No valid audio files found to concatenate'}), 400
-                
-                combined_audio.export(output_path, format="wav")
-                print(f"Concatenated audio saved using pydub: {output_path}")
-                
-                return jsonify({
-                    'success': True,
-                    'message': f'Concatenated {len(audio_files)} audio file(s) with {pause_seconds}s pauses',
-                    'filename': output_filename,
-                    'file_path': output_path
-                })
-            except Exception as e:
-                print(f"pydub concatenation failed: {e}, falling back to pure Python method")
-        
-        # Fall back to pure Python concatenation
         file_paths = []
         for filename in audio_files:
             file_path = os.path.join(OUTPUT_DIR, filename)
-            if os.path.exists(file_path):
+            if output_exists(filename):
                 file_paths.append(file_path)
+            else:
+                print(f"Warning: File not found: {file_path}, skipping...")
         
         if not file_paths:
             return jsonify({'error': 'No valid audio files found to concatenate'}), 400
         
-        concatenate_wav_files_pure_python(file_paths, output_path, pause_seconds)
-        print(f"Concatenated audio saved using pure Python: {output_path}")
+        # Stream the PCM data through from memory-mapped inputs (constant memory), trimming and leveling
+        # each paragraph on the way when asked to; pydub is only a fallback for inputs the pure Python path cannot parse
+        # and joins them as they are
+        start = time.perf_counter()
+        try:
+            concatenate_wav_files_pure_python(file_paths, output_path, pause_seconds,
+                                              edge_silence=CONCAT_EDGE_SILENCE if trim_silence else None,
+                                              target_dbfs=CONCAT_TARGET_DBFS if normalize else None)
+            print(f"Concatenated audio saved using pure Python: {output_path}")
+        except ValueError as e:
+            if not PYDUB_AVAILABLE:
+                raise
+            print(f"Pure Python concatenation failed: {e}, falling back to pydub")
+            concatenate_with_pydub(file_paths, output_path, pause_seconds)
+            print(f"Concatenated audio saved using pydub: {output_path}")
+        elapsed = time.perf_counter() - start
+        if elapsed > 0:
+            CONCATENATE_THROUGHPUT.observe(os.path.getsize(output_path) / elapsed)
+        output_finished(output_path)
         
         return jsonify({
             'success': True,
@@ -828,6 +1442,261 @@ def concatenate_audio():
         traceback.print_exc()
         return jsonify({'error': error_msg}), 500
 
+def write_job_output(payload: dict) -> str:
+    """Job handler: synthesize one chapter or paragraph (or paragraph batch) unless its output file already exists."""
+    if 'indexes' in payload:
+        return write_job_batch(payload)
+    output_filename = payload['output']
+    output_path = os.path.join(OUTPUT_DIR, output_filename)
+    if output_exists(output_filename):
+        # Generated before a restart (or by an earlier run) - nothing to do
+        return output_filename
+    
+    output_base = os.path.splitext(output_path)[0]
+    output_path = synthesize_to_file(payload['text'], payload['prompt'], payload['voice1'], payload['voice2'], output_base)
+    return os.path.basename(output_path)
+
+def write_job_batch(payload: dict) -> str:
+    """Synthesize the paragraphs of a batch whose files do not exist yet; returns all of its filenames."""
+    safe_title = sanitize_filename(payload['chapter_title'])
+    filenames = [f"{safe_title}_{index:03d}.wav" for index in payload['indexes']]
+    missing = [
+        (index, text) for index, text, filename in zip(payload['indexes'], payload['texts'], filenames)
+        if not output_exists(filename)
+    ]
+    if missing:
+        batch = ParagraphBatch([index for index, _ in missing], [text for _, text in missing])
+        synthesize_paragraph_batch(batch, payload['prompt'], payload['voice1'], payload['voice2'], safe_title)
+    return ', '.join(filenames)
+
+def chapter_export_files(chapter_title: str, total_paragraphs: int) -> list[str]:
+    """Paths of a chapter's audio for a book export: its paragraph files, else its full chapter WAV."""
+    paragraph_files = chapter_paragraph_files(chapter_title, total_paragraphs)
+    if paragraph_files:
+        return [os.path.join(OUTPUT_DIR, filename) for filename in paragraph_files.values()]
+    filename = chapter_audio_filename(chapter_title)
+    if filename and filename.endswith('.wav'):
+        return [os.path.join(OUTPUT_DIR, filename)]
+    return []
+
+def export_book_job(payload: dict) -> str:
+    """Job handler: join every chapter's audio into one WAV with chapter markers."""
+    chapters = [
+        (chapter['title'], chapter_export_files(chapter['title'], chapter['total_paragraphs']))
+        for chapter in payload['chapters']
+    ]
+    output_path = os.path.join(OUTPUT_DIR, payload['output'])
+    plan = export_book(chapters, output_path, payload['paragraph_silence'], payload['chapter_silence'])
+    output_finished(output_path)
+    print(f"Exported {len(plan.cues)} chapter(s), {plan.duration:.0f}s of audio: {output_path}")
+    return payload['output']
+
+JOB_QUEUE = JobQueue(JOBS_DB, workers=config.get('job_workers', 2))
+JOB_QUEUE.register('chapters', write_job_output)
+JOB_QUEUE.register('paragraphs', write_job_output)
+JOB_QUEUE.register('export', export_book_job)
+
+BACKGROUND_LOCK = threading.Lock()
+background_started = False
+
+def start_background_workers():
+    """
+    Start the output index watcher and the job workers; later calls do nothing.
+    
+    Not done at import: the Werkzeug reloader imports this module in its watcher
+    process too, which must not claim jobs. Entry points call this when they start
+    serving, and the first request starts them under any other server.
+    """
+    global background_started
+    if background_started:
+        return
+    with BACKGROUND_LOCK:
+        if not background_started:
+            OUTPUT_INDEX.start()
+            JOB_QUEUE.start()
+            background_started = True
+
+@app.before_request
+def ensure_background_workers():
+    start_background_workers()
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """
+    Submit a book or chapter for background generation.
+    
+    JSON body: {
+        "mode": "chapters" (one file per chapter) or "paragraphs" (one file per paragraph),
+        "title": optional job title,
+        "prompt", "voice1", "voice2",
+        "chapters": [{"title": ..., "paragraphs": [...]}, ...]
+    }
+    With a "doc_id", chapters of that uploaded document can be given as {"index": n} instead.
+    """
+    try:
+        data = request.json or {}
+        mode = data.get('mode', 'chapters')
+        chapters = data.get('chapters', [])
+        defaults = CONFIG.snapshot()
+        prompt = data.get('prompt', defaults.get('prompt', ''))
+        voice1 = data.get('voice1', defaults.get('voice1', 'Puck'))
+        voice2 = data.get('voice2', defaults.get('voice2', 'Zephyr'))
+        
+        if mode not in ('chapters', 'paragraphs'):
+            return jsonify({'error': 'mode must be "chapters" or "paragraphs"'}), 400
+        
+        if not chapters or not isinstance(chapters, list):
+            return jsonify({'error': 'chapters must be a non-empty list'}), 400
+        
+        document = None
+        if data.get('doc_id'):
+            document = DOCUMENT_STORE.get(data['doc_id'])
+            if document is None:
+                return jsonify({'error': 'Document not found; please upload the file again'}), 404
+        
+        payloads = []
+        for chapter in chapters:
+            if document is not None and 'index' in chapter:
+                try:
+                    chapter_index = int(chapter['index'])
+                    chapter = {
+                        'title': document.chapter(chapter_index).title,
+                        'paragraphs': document.paragraphs(chapter_index)
+                    }
+                except LookupError as e:
+                    return jsonify({'error': str(e)}), 404
+            chapter_title = chapter.get('title', '')
+            paragraphs = chapter.get('paragraphs') or []
+            if not chapter_title:
+                return jsonify({'error': 'Every chapter needs a title'}), 400
+            
+            safe_title = sanitize_filename(chapter_title)
+            common = {'prompt': prompt, 'voice1': voice1, 'voice2': voice2, 'chapter_title': chapter_title}
+            if mode == 'chapters':
+                # Same text layout as the "Generate Chapter" button: title, then all paragraphs
+                text = chapter_title + '\n\n' + '\n\n'.join(paragraphs)
+                payloads.append(dict(common, text=text, output=f"{safe_title}.wav"))
+            else:
+                pending = [(index, paragraph) for index, paragraph in enumerate(paragraphs, start=1) if paragraph.strip()]
+                for batch in plan_paragraph_batches(pending, prompt, voice1, voice2):
+                    payloads.append(dict(common, texts=batch.texts, indexes=batch.indexes))
+        
+        if not payloads:
+            return jsonify({'error': 'Nothing to generate'}), 400
+        
+        title = data.get('title') or chapters[0].get('title', '')
+        job_id = JOB_QUEUE.submit(mode, title, payloads)
+        return jsonify({'success': True, 'job_id': job_id, 'total': len(payloads)})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/export-book', methods=['POST'])
+def export_book_endpoint():
+    """
+    Export a whole book as one WAV file with a chapter marker per chapter, as a background job.
+    
+    JSON body: {
+        "doc_id": uploaded document (all its chapters), or
+        "chapters": [{"title": ..., "total_paragraphs": N}, ...],
+        "title": optional output title,
+        "paragraph_silence": seconds between paragraphs (default 1.5),
+        "chapter_silence": seconds between chapters (default 3.0)
+    }
+    Chapters are read from their paragraph files, or their full chapter file when
+    they have none, as they exist when the job runs. Poll /jobs/<job_id> for the result;
+    the job fails if the book is over the 4 GiB a WAV file can hold (about 24.8 hours).
+    """
+    try:
+        data = request.json or {}
+        title = data.get('title', '')
+        paragraph_silence = float(data.get('paragraph_silence', 1.5))
+        chapter_silence = float(data.get('chapter_silence', 3.0))
+        if paragraph_silence < 0 or chapter_silence < 0:
+            return jsonify({'error': 'Silence durations must not be negative'}), 400
+        
+        if data.get('doc_id'):
+            document = DOCUMENT_STORE.get(data['doc_id'])
+            if document is None:
+                return jsonify({'error': 'Document not found; please upload the file again'}), 404
+            chapters = [
+                {'title': chapter['title'], 'total_paragraphs': chapter['paragraph_count']}
+                for chapter in document.toc()['chapters']
+            ]
+            title = title or os.path.splitext(document.filename)[0]
+        else:
+            chapters = data.get('chapters', [])
+            if not chapters or not isinstance(chapters, list):
+                return jsonify({'error': 'doc_id or a non-empty chapters list required'}), 400
+            chapters = [
+                {'title': chapter.get('title', ''), 'total_paragraphs': int(chapter.get('total_paragraphs', 0))}
+                for chapter in chapters
+            ]
+        
+        title = title or chapters[0]['title']
+        output_filename = f"{sanitize_filename(title) or 'book'}_book.wav"
+        payload = {
+            'chapters': chapters,
+            'output': output_filename,
+            'paragraph_silence': paragraph_silence,
+            'chapter_silence': chapter_silence
+        }
+        job_id = JOB_QUEUE.submit('export', title, [payload])
+        return jsonify({'success': True, 'job_id': job_id, 'filename': output_filename})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    """Endpoint to list recent background jobs."""
+    try:
+        return jsonify({'success': True, 'jobs': JOB_QUEUE.list_jobs()})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Endpoint to poll a job's progress, including per-item results."""
+    try:
+        job = JOB_QUEUE.get(job_id, include_items=True)
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+        return jsonify({'success': True, 'job': job})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Endpoint to cancel the pending items of a job."""
+    try:
+        if JOB_QUEUE.get(job_id) is None:
+            return jsonify({'error': 'Job not found'}), 404
+        cancelled = JOB_QUEUE.cancel(job_id)
+        return jsonify({'success': True, 'cancelled': cancelled})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Stream job progress as Server-Sent Events until the job finishes."""
+    if JOB_QUEUE.get(job_id) is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    def stream():
+        last_updated = None
+        while True:
+            job = JOB_QUEUE.get(job_id, include_items=True)
+            if job['updated'] != last_updated:
+                last_updated = job['updated']
+                yield f"data: {json.dumps(job, ensure_ascii=False)}\n\n"
+            if job['status'] in TERMINAL_JOB_STATES:
+                break
+            time.sleep(1)
+    
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
 if __name__ == '__main__':
+    # With debug=True this runs twice: in the reloader's watcher and in the serving child it starts
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_workers()
     app.run(debug=True, host='0.0.0.0', port=5000)
 
@@ -0,0 +1,568 @@
+"""
+ASGI entry point: the generation endpoints run on asyncio, everything else on the Flask app.
+
+A Gemini call can take minutes. Under app.run() (or any threaded WSGI server)
+each one holds a thread for that long, so a few chapter generations exhaust the
+pool and /outputs playback waits behind them. Here POST /generate and
+POST /generate-paragraphs are served as coroutines using the async genai
+client, with file I/O handed to worker threads, so one process holds hundreds of
+syntheses while waiting on almost no threads. Every other route is passed to the
+Flask app on a thread pool of its own, which therefore stays free for serving audio.
+
+Run it with any ASGI server, for example:
+
+    pip install uvicorn
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+"""
+import asyncio
+import json
+import mimetypes
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.wrappers import Request
+from coordination import remove_quietly, temp_name
+from tts_scheduler import estimate_tokens
+from wav_utils import WavStreamWriter, parse_audio_mime_type, wav_header, STREAMING_DATA_SIZE
+from app import (app as flask_app, config, AUDIO_CACHE, GENERATIONS, IN_FLIGHT, TTS_SCHEDULER, TTS_MODEL,
+                 FILE_WRITE_SECONDS, HTTP_ERRORS, TTS_AUDIO_BYTES, TTS_FIRST_CHUNK_SECONDS, TTS_SYNTHESIS_SECONDS,
+                 batch_cached, batch_claim_key, cache_key, chunk_audio, generation_request, output_finished,
+                 paragraph_output_base, paragraph_request, paragraph_results, saved_audio_result,
+                 start_background_workers, tts_request, write_batch_audio)
+
+# Request bodies larger than this are spooled to a temporary file instead of memory
+SPOOL_BYTES = 1024 * 1024
+
+# Block size for sending files from the async handlers and from the WSGI bridge's file_wrapper
+SEND_BLOCK_SIZE = 256 * 1024
+
+# Gemini calls in flight at once from the async handlers ('async_max_syntheses' in config.json)
+SYNTHESIS_SLOTS = asyncio.Semaphore(config.get('async_max_syntheses', 256))
+
+
+class FileWrapper:
+    """wsgi.file_wrapper reading large blocks, so a file takes few trips through the thread pool."""
+
+    def __init__(self, file, block_size: int = SEND_BLOCK_SIZE):
+        self.file = file
+        self.block_size = max(block_size, SEND_BLOCK_SIZE)
+
+    # Werkzeug seeks to the start of a Range instead of reading through to it when the wrapper can seek
+    def seekable(self) -> bool:
+        return self.file.seekable()
+
+    def seek(self, *args):
+        self.file.seek(*args)
+
+    def tell(self) -> int:
+        return self.file.tell()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        data = self.file.read(self.block_size)
+        if not data:
+            raise StopIteration
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+async def read_body(receive):
+    """Read an ASGI request body into a spooled temporary file; returns (file, disconnected)."""
+    body = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return body, True
+        body.write(message.get('body', b''))
+        if not message.get('more_body'):
+            body.seek(0)
+            return body, False
+
+
+def wsgi_environ(scope: dict, body) -> dict:
+    """Build a WSGI environ for an ASGI HTTP scope."""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': str(server[0]),
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'SERVER_SOFTWARE': 'ugmpa-asgi',
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.input_terminated': True,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+        'wsgi.file_wrapper': FileWrapper,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name == 'CONTENT_LENGTH':
+            environ['CONTENT_LENGTH'] = value
+        else:
+            key = 'HTTP_' + name
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+class WsgiBridge:
+    """
+    Serve a WSGI app from ASGI, running it on a dedicated thread pool.
+
+    Responses are forwarded block by block as the app produces them, so
+    streamed responses (job events, audio) stay streamed; when the client goes
+    away the response iterable is closed.
+    """
+
+    def __init__(self, wsgi_app, max_workers: int = 32):
+        self.wsgi_app = wsgi_app
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='wsgi')
+
+    async def __call__(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+        body, disconnected = await read_body(receive)
+        if disconnected:
+            return
+        environ = wsgi_environ(scope, body)
+        response_start = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response_start.get('sent'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            response_start['status'] = int(status.split(' ', 1)[0])
+            response_start['headers'] = [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+            return lambda data: None
+
+        iterable = await loop.run_in_executor(self._executor, self.wsgi_app, environ, start_response)
+        iterator = iter(iterable)
+        done = object()
+
+        # Watch for the client going away while the response is being produced
+        client_gone = asyncio.Event()
+
+        async def watch():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            client_gone.set()
+
+        watcher = asyncio.ensure_future(watch())
+        try:
+            while not client_gone.is_set():
+                block = await loop.run_in_executor(self._executor, next, iterator, done)
+                if not response_start.get('sent'):
+                    response_start['sent'] = True
+                    await send({'type': 'http.response.start', 'status': response_start['status'],
+                                'headers': response_start['headers']})
+                if block is done:
+                    await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+                    break
+                if block:
+                    await send({'type': 'http.response.body', 'body': block, 'more_body': True})
+        finally:
+            watcher.cancel()
+            if hasattr(iterable, 'close'):
+                await loop.run_in_executor(self._executor, iterable.close)
+            body.close()
+
+
+async def send_json(send, data: dict, status: int = 200, endpoint: str = ''):
+    if status >= 500:
+        HTTP_ERRORS.inc(endpoint=endpoint or 'unknown')
+    payload = json.dumps(data, ensure_ascii=False).encode('utf-8')
+    await send({'type': 'http.response.start', 'status': status, 'headers': [
+        (b'content-type', b'application/json'),
+        (b'content-length', str(len(payload)).encode('latin-1')),
+    ]})
+    await send({'type': 'http.response.body', 'body': payload})
+
+
+async def send_file(send, path: str, mimetype: str, headers: list[tuple[bytes, bytes]] = ()):
+    """Send a whole file; reads happen on worker threads."""
+    size = os.path.getsize(path)
+    await send({'type': 'http.response.start', 'status': 200, 'headers': [
+        (b'content-type', mimetype.encode('latin-1')),
+        (b'content-length', str(size).encode('latin-1')),
+    ] + list(headers)})
+    with open(path, 'rb') as f:
+        while True:
+            block = await asyncio.to_thread(f.read, SEND_BLOCK_SIZE)
+            if not block:
+                break
+            await send({'type': 'http.response.body', 'body': block, 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def astream_tts_audio(text_content: str, prompt: str, speaker1_voice: str, speaker2_voice: str):
+    """Async counterpart of app.stream_tts_audio, on the async genai client."""
+    full_text, contents, generate_content_config = tts_request(text_content, prompt, speaker1_voice, speaker2_voice)
+
+    async def call(lease):
+        start = time.perf_counter()
+        audio_bytes = 0
+        async for chunk in await lease.client.aio.models.generate_content_stream(
+            model=TTS_MODEL,
+            contents=contents,
+            config=generate_content_config,
+        ):
+            for data, mime_type in chunk_audio(chunk):
+                if not audio_bytes:
+                    TTS_FIRST_CHUNK_SECONDS.observe(time.perf_counter() - start)
+                audio_bytes += len(data)
+                yield data, mime_type
+        TTS_SYNTHESIS_SECONDS.observe(time.perf_counter() - start)
+        TTS_AUDIO_BYTES.observe(audio_bytes)
+
+    async with SYNTHESIS_SLOTS:
+        async for item in TTS_SCHEDULER.astream(call, tokens=estimate_tokens(full_text)):
+            yield item
+
+
+def open_output(output_base: str, mime_type: str):
+    """Open the temporary output file for audio of `mime_type`; returns (writer, output_path)."""
+    extension = mimetypes.guess_extension(mime_type)
+    if extension is None:
+        parameters = parse_audio_mime_type(mime_type)
+        output_path = output_base + '.wav'
+        return WavStreamWriter(temp_name(output_path), parameters['rate'], parameters['bits_per_sample']), output_path
+    # Already an encoded container; chunks are appended as-is
+    output_path = output_base + extension
+    return open(temp_name(output_path), 'wb'), output_path
+
+
+def writer_path(writer) -> str:
+    """The temporary file behind a writer from open_output()."""
+    return writer.path if isinstance(writer, WavStreamWriter) else writer.name
+
+
+def finish_output(writer, output_path: str, key: str):
+    writer.close()
+    os.replace(writer_path(writer), output_path)
+    if isinstance(writer, WavStreamWriter):
+        FILE_WRITE_SECONDS.observe(writer.write_seconds)
+    AUDIO_CACHE.put_file(key, output_path)
+    output_finished(output_path)
+
+
+def abort_output(writer, output_path: str):
+    writer.close()
+    remove_quietly(writer_path(writer))
+
+
+async def awrite_audio_stream(chunks, output_base: str, key: str) -> str:
+    """Async counterpart of app.write_audio_stream; the file is cached and indexed once complete."""
+    writer = None
+    output_path = None
+    try:
+        async for data, mime_type in chunks:
+            if writer is None:
+                writer, output_path = await asyncio.to_thread(open_output, output_base, mime_type)
+            await asyncio.to_thread(writer.write, data)
+    except BaseException:
+        if writer is not None:
+            await asyncio.to_thread(abort_output, writer, output_path)
+        raise
+
+    if writer is None:
+        raise Exception('No audio generated')
+    await asyncio.to_thread(finish_output, writer, output_path, key)
+    return output_path
+
+
+async def asynthesize_to_file(text_content: str, prompt: str, voice1: str, voice2: str, output_base: str,
+                              regenerate: bool = False) -> str:
+    """Async counterpart of app.synthesize_to_file."""
+    key = cache_key(TTS_MODEL, prompt, voice1, voice2, text_content)
+    return await GENERATIONS.ado((output_base, key, regenerate), lambda: awrite_synthesis(
+        key, text_content, prompt, voice1, voice2, output_base, regenerate))
+
+
+async def awrite_synthesis(key: str, text_content: str, prompt: str, voice1: str, voice2: str, output_base: str,
+                           regenerate: bool = False) -> str:
+    """Async counterpart of app.write_synthesis."""
+    output_path = None if regenerate else await asyncio.to_thread(AUDIO_CACHE.fetch_to, key, output_base)
+    if not output_path:
+        async with IN_FLIGHT.aclaim(key):
+            # Another worker may have synthesized it while we waited for the claim
+            if not regenerate:
+                output_path = await asyncio.to_thread(
+                    lambda: AUDIO_CACHE.fetch_to(key, output_base) if key in AUDIO_CACHE else None)
+            if not output_path:
+                return await TTS_SCHEDULER.arun(lambda: awrite_audio_stream(
+                    astream_tts_audio(text_content, prompt, voice1, voice2), output_base, key))
+    await asyncio.to_thread(output_finished, output_path)
+    return output_path
+
+
+async def asynthesize_paragraph_batch(batch, prompt: str, voice1: str, voice2: str, safe_title: str) -> list[str]:
+    """Async counterpart of app.synthesize_paragraph_batch."""
+    claim_key = batch_claim_key(batch, prompt, voice1, voice2)
+    return await GENERATIONS.ado((safe_title, tuple(batch.indexes), claim_key), lambda: awrite_paragraph_batch(
+        batch, prompt, voice1, voice2, safe_title, claim_key))
+
+
+async def awrite_paragraph_batch(batch, prompt: str, voice1: str, voice2: str, safe_title: str,
+                                 claim_key: str) -> list[str]:
+    """Async counterpart of app.write_paragraph_batch."""
+    async def synthesize_each():
+        return [
+            os.path.basename(await asynthesize_to_file(text, prompt, voice1, voice2, paragraph_output_base(safe_title, index)))
+            for index, text in zip(batch.indexes, batch.texts)
+        ]
+
+    if len(batch.indexes) == 1:
+        return await synthesize_each()
+
+    async def collect():
+        return [item async for item in astream_tts_audio(batch.text, prompt, voice1, voice2)]
+
+    async with IN_FLIGHT.aclaim(claim_key):
+        if await asyncio.to_thread(batch_cached, batch, prompt, voice1, voice2):
+            # Synthesized by another worker while we waited for the claim
+            return await synthesize_each()
+        chunks = await TTS_SCHEDULER.arun(collect)
+        # Cutting and writing the paragraphs is CPU and disk work; keep it off the event loop
+        filenames = await asyncio.to_thread(write_batch_audio, batch, chunks, prompt, voice1, voice2, safe_title)
+    if filenames is None:
+        return await synthesize_each()
+    return filenames
+
+
+async def send_output_file(send, output_path: str):
+    await send_file(send, output_path, mimetypes.guess_type(output_path)[0] or 'application/octet-stream',
+                    [(b'x-output-filename', os.path.basename(output_path).encode('utf-8'))])
+
+
+async def stream_tts_response(send, text_content: str, prompt: str, voice1: str, voice2: str, output_base: str,
+                              regenerate: bool = False):
+    """
+    Async counterpart of app.stream_tts_response: forward PCM as it arrives and tee it to disk.
+
+    As there, a request for audio already being generated into the same file gets the
+    file once it is written.
+    """
+    key = cache_key(TTS_MODEL, prompt, voice1, voice2, text_content)
+    cached_path = None if regenerate else await asyncio.to_thread(AUDIO_CACHE.fetch_to, key, output_base)
+    if cached_path:
+        await asyncio.to_thread(output_finished, cached_path)
+        await send_output_file(send, cached_path)
+        return
+
+    flight_key = (output_base, key, regenerate)
+    flight, leader = GENERATIONS.begin(flight_key)
+    if not leader:
+        await send_output_file(send, await flight.wait_async())
+        return
+
+    try:
+        output_path = await stream_new_audio(send, key, text_content, prompt, voice1, voice2, output_base)
+    except BaseException as e:
+        GENERATIONS.end(flight_key, flight, error=e)
+        raise
+    if output_path is None:
+        GENERATIONS.end(flight_key, flight, error=Exception('Streaming was interrupted'))
+    else:
+        GENERATIONS.end(flight_key, flight, output_path)
+
+
+async def stream_new_audio(send, key: str, text_content: str, prompt: str, voice1: str, voice2: str,
+                           output_base: str) -> str | None:
+    """
+    Synthesize and stream audio that is not cached; returns the saved output path.
+
+    Errors before the response starts raise. Once audio has been sent an error can only
+    end the response early, so it is reported by returning None.
+    """
+    chunks = astream_tts_audio(text_content, prompt, voice1, voice2)
+    try:
+        first = await anext(chunks, None)
+        if first is None:
+            raise Exception('No audio generated')
+
+        data, mime_type = first
+        if mimetypes.guess_extension(mime_type) is not None:
+            # Not raw PCM - there is no header to stream ahead of the data, so send the finished file
+            async def rest():
+                yield first
+                async for item in chunks:
+                    yield item
+
+            output_path = await awrite_audio_stream(rest(), output_base, key)
+            await send_output_file(send, output_path)
+            return output_path
+
+        parameters = parse_audio_mime_type(mime_type)
+        writer, output_path = await asyncio.to_thread(open_output, output_base, mime_type)
+        client_connected = True
+
+        async def forward(block: bytes):
+            # The browser may go away; the audio is already paid for, so keep writing it to disk
+            nonlocal client_connected
+            if client_connected:
+                try:
+                    await send({'type': 'http.response.body', 'body': block, 'more_body': True})
+                except OSError:
+                    client_connected = False
+
+        saved = False
+        try:
+            await send({'type': 'http.response.start', 'status': 200, 'headers': [
+                (b'content-type', b'audio/wav'),
+                (b'cache-control', b'no-cache'),
+                (b'x-output-filename', os.path.basename(output_path).encode('utf-8')),
+            ]})
+            await forward(wav_header(STREAMING_DATA_SIZE, parameters['rate'], parameters['bits_per_sample']))
+            await asyncio.to_thread(writer.write, data)
+            await forward(data)
+            async for chunk_data, _ in chunks:
+                await asyncio.to_thread(writer.write, chunk_data)
+                await forward(chunk_data)
+        except Exception as e:
+            print(f"Error streaming audio for {output_path}: {e}")
+        else:
+            await asyncio.to_thread(finish_output, writer, output_path, key)
+            print(f"Streamed audio saved to {output_path}")
+            saved = True
+        finally:
+            if not saved:
+                # Also reached when a client disconnect cancels the task; done inline, as another await could be cancelled too
+                abort_output(writer, output_path)
+        if client_connected:
+            await send({'type': 'http.response.body', 'body': b''})
+        return output_path if saved else None
+    finally:
+        # Ends the upstream stream and frees its synthesis slot, also when a client disconnect cancels the task
+        await chunks.aclose()
+
+
+async def parse_form(receive, scope):
+    """Read and parse a form request with Werkzeug; returns the Request, or None if the client went away."""
+    body, disconnected = await read_body(receive)
+    if disconnected:
+        return None
+    request = Request(wsgi_environ(scope, body))
+    # Multipart parsing of an uploaded book is real work; do it off the event loop
+    await asyncio.to_thread(lambda: (request.form, request.files))
+    return request
+
+
+async def generate(scope, receive, send):
+    """POST /generate, as app.generate_endpoint but without holding a thread while Gemini answers."""
+    request = await parse_form(receive, scope)
+    if request is None:
+        return
+    try:
+        try:
+            target = await asyncio.to_thread(generation_request, request.form, request.files)
+        except LookupError as e:
+            return await send_json(send, {'error': str(e)}, 404)
+        except ValueError as e:
+            print(f"ERROR: {e}")
+            return await send_json(send, {'error': str(e)}, 400)
+        text_content, prompt, voice1, voice2, output_base = target[:5]
+
+        if target.stream:
+            return await stream_tts_response(send, text_content, prompt, voice1, voice2, output_base, target.regenerate)
+
+        output_path = await asynthesize_to_file(text_content, prompt, voice1, voice2, output_base, target.regenerate)
+        print(f"Audio saved successfully to {output_path} ({os.path.getsize(output_path)} bytes)")
+        if target.save_to_file and target.chapter_title:
+            return await send_json(send, saved_audio_result(output_path))
+
+        extension = os.path.splitext(output_path)[1]
+        await send_file(send, output_path, f'audio/{extension[1:]}', [
+            (b'content-disposition', f'attachment; filename=tts_output{extension}'.encode('latin-1')),
+        ])
+    except Exception as e:
+        error_msg = f'Failed to generate audio: {str(e)}'
+        print(f"EXCEPTION in generate: {error_msg}")
+        await send_json(send, {'error': error_msg}, 500, 'generate_endpoint')
+    finally:
+        request.close()
+
+
+async def generate_paragraphs(scope, receive, send):
+    """POST /generate-paragraphs, with every batch of the chapter awaited concurrently."""
+    request = await parse_form(receive, scope)
+    if request is None:
+        return
+    try:
+        try:
+            batches, prompt, voice1, voice2, safe_title = await asyncio.to_thread(paragraph_request, request.form)
+        except LookupError as e:
+            return await send_json(send, {'error': str(e)}, 404)
+        except ValueError as e:
+            return await send_json(send, {'error': str(e)}, 400)
+
+        outcomes = await asyncio.gather(
+            *(asynthesize_paragraph_batch(batch, prompt, voice1, voice2, safe_title) for batch in batches),
+            return_exceptions=True,
+        )
+        results = []
+        for batch, outcome in zip(batches, outcomes):
+            if isinstance(outcome, Exception):
+                # Continue with the other paragraphs if one fails
+                print(f"Error generating paragraph {batch.indexes[0]}: {outcome}")
+            else:
+                results.append((batch.indexes[0], outcome))
+        result, status = paragraph_results(batches, results)
+        await send_json(send, result, status, 'generate_paragraphs_endpoint')
+    except Exception as e:
+        await send_json(send, {'error': str(e)}, 500, 'generate_paragraphs_endpoint')
+    finally:
+        request.close()
+
+
+ASYNC_ROUTES = {
+    ('POST', '/generate'): generate,
+    ('POST', '/generate-paragraphs'): generate_paragraphs,
+}
+
+# Everything else (pages, /outputs audio, status checks, jobs) runs on the Flask app
+WSGI_APP = WsgiBridge(flask_app.wsgi_app, max_workers=config.get('wsgi_threads', 32))
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                start_background_workers()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+    # Servers without lifespan support; the Flask app's own hook does not see the async routes
+    start_background_workers()
+    handler = ASYNC_ROUTES.get((scope['method'], scope['path']))
+    if handler is None:
+        await WSGI_APP(scope, receive, send)
+    else:
+        await handler(scope, receive, send)
+
+
+if __name__ == '__main__':
+    try:
+        import uvicorn
+    except ImportError:
+        sys.exit("uvicorn is not installed: pip install uvicorn (or run asgi:application with another ASGI server)")
+    uvicorn.run(application, host=os.environ.get('HOST', '127.0.0.1'), port=int(os.environ.get('PORT', 5000)))
@@ -0,0 +1,270 @@
+"""Content-addressed, size-bounded on-disk cache of synthesized audio."""
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from coordination import atomic_write, temp_name
+
+# Last use of each entry, kept beside the shards. Recency cannot live in file mtimes: outputs are hard
+# links to the entries, and their mtimes are the outputs' ETags and encoder staleness checks
+ACCESS_DB = 'access.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS access (
+    key TEXT PRIMARY KEY,
+    used REAL NOT NULL
+);
+"""
+
+
+def normalize_text(text: str) -> str:
+    """Normalize paragraph text so formatting-only differences share a cache entry."""
+    text = unicodedata.normalize('NFC', text)
+    lines = (re.sub(r'\s+', ' ', line).strip() for line in text.splitlines())
+    return '\n'.join(line for line in lines if line)
+
+
+def cache_key(model: str, prompt: str, voice1: str, voice2: str, text: str) -> str:
+    """Hash of everything that determines the synthesized audio."""
+    material = json.dumps([model, prompt or '', voice1, voice2, normalize_text(text)], ensure_ascii=False)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+def link_or_copy(src: str, dst: str):
+    """Place `src` at `dst` by hard link when possible, otherwise by copy. Replaces `dst` atomically."""
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        # Already linked; renaming a link over another link to the same file is a no-op
+        return
+    temp_path = temp_name(dst, '.tmp')
+    try:
+        os.link(src, temp_path)
+    except OSError:
+        # Different filesystem, or a filesystem without hard links
+        shutil.copyfile(src, temp_path)
+    os.replace(temp_path, dst)
+
+
+class AudioCache:
+    """
+    LRU cache of audio files stored as `<directory>/<key[:2]>/<key><ext>`.
+
+    Recency survives restarts through an access index (SQLite, shared by every
+    process using the directory) that records each hit; entry files themselves
+    are never touched, since outputs share their inodes. Entries are linked (not
+    copied) in and out where the filesystem allows, so a hit costs a directory
+    entry rather than a file copy. Because of that, files placed from the cache
+    must be replaced, never rewritten in place. Several processes may share the
+    directory; entries another one adds are found on a miss.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (extension, size), least recently used first
+        self._total_bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+        self._load()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(os.path.join(self.directory, ACCESS_DB), timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _conn(self) -> sqlite3.Connection:
+        """Return this thread's connection (sqlite3 connections are not shared across threads)."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def _touch(self, key: str):
+        """Record a use of `key` in the access index; recency is best effort, so errors are only logged."""
+        try:
+            self._conn().execute("INSERT OR REPLACE INTO access (key, used) VALUES (?, ?)", (key, time.time()))
+        except sqlite3.Error as e:
+            print(f"Error recording cache access: {e}")
+
+    def _forget(self, keys: list[str]):
+        try:
+            self._conn().executemany("DELETE FROM access WHERE key = ?", [(key,) for key in keys])
+        except sqlite3.Error as e:
+            print(f"Error recording cache eviction: {e}")
+
+    def _load(self):
+        used = dict(self._conn().execute("SELECT key, used FROM access").fetchall())
+        found = []
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                key, extension = os.path.splitext(entry.name)
+                if entry.is_file() and extension != '.tmp':
+                    stat = entry.stat()
+                    # Entries from before the access index was kept fall back to their mtime
+                    found.append((used.get(key, stat.st_mtime), key, extension, stat.st_size))
+        for _, key, extension, size in sorted(found):
+            previous = self._entries.pop(key, None)
+            if previous:
+                # Left by a re-cache in another format that was interrupted; the newer file wins
+                self._total_bytes -= previous[1]
+                self._remove(self._path(key, previous[0]))
+            self._entries[key] = (extension, size)
+            self._total_bytes += size
+
+    def _path(self, key: str, extension: str) -> str:
+        return os.path.join(self.directory, key[:2], key + extension)
+
+    def __contains__(self, key: str) -> bool:
+        """Whether `key` is cached, without counting a hit or miss."""
+        with self._lock:
+            if key in self._entries:
+                return True
+        return self._discover(key) is not None
+
+    def _discover(self, key: str) -> tuple | None:
+        """
+        Find and index an entry written by another process sharing the directory.
+
+        Each worker process keeps its own index, so a miss looks in the key's shard
+        before giving up. Returns (extension, size), or None if there is no such file.
+        """
+        try:
+            shard = os.scandir(os.path.join(self.directory, key[:2]))
+        except FileNotFoundError:
+            return None
+        with shard:
+            for entry in shard:
+                name, extension = os.path.splitext(entry.name)
+                if name == key and extension != '.tmp' and entry.is_file():
+                    found = (extension, entry.stat().st_size)
+                    break
+            else:
+                return None
+        self._add(key, *found)
+        return found
+
+    def lookup(self, key: str) -> str | None:
+        """Return the cached file path for `key` and mark it recently used, or None on a miss."""
+        path = self._find(key)
+        self._count(key, path is not None)
+        return path
+
+    def _find(self, key: str) -> str | None:
+        """The path of `key`'s file if it exists, without counting a hit or miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None:
+            entry = self._discover(key)
+            if entry is None:
+                return None
+        path = self._path(key, entry[0])
+        if not os.path.isfile(path):
+            # Removed behind our back
+            self._drop(key)
+            return None
+        return path
+
+    def _count(self, key: str, hit: bool):
+        with self._lock:
+            if hit:
+                self._hits += 1
+            else:
+                self._misses += 1
+        if hit:
+            self._touch(key)
+
+    def _drop(self, key: str):
+        """Forget an entry whose file is gone, e.g. evicted by another process sharing the directory."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry:
+                self._total_bytes -= entry[1]
+        self._forget([key])
+
+    def fetch_to(self, key: str, output_base: str) -> str | None:
+        """Place a cached entry at `output_base` + its extension. Returns the output path, or None on a miss."""
+        path = self._find(key)
+        output_path = None
+        if path is not None:
+            output_path = output_base + os.path.splitext(path)[1]
+            try:
+                link_or_copy(path, output_path)
+            except FileNotFoundError:
+                # Evicted by another process since it was found
+                self._drop(key)
+                output_path = None
+        self._count(key, output_path is not None)
+        return output_path
+
+    def put_file(self, key: str, src_path: str):
+        """Add an existing audio file to the cache."""
+        extension = os.path.splitext(src_path)[1]
+        path = self._path(key, extension)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        link_or_copy(src_path, path)
+        self._add(key, extension, os.path.getsize(path))
+
+    def put_bytes(self, key: str, data: bytes, extension: str):
+        """Add in-memory audio to the cache."""
+        path = self._path(key, extension)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with atomic_write(path) as f:
+            f.write(data)
+        self._add(key, extension, len(data))
+
+    def _add(self, key: str, extension: str, size: int):
+        evicted = []
+        evicted_keys = []
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous:
+                self._total_bytes -= previous[1]
+                if previous[0] != extension:
+                    # Re-cached in another format; the old file is no longer indexed
+                    evicted.append(self._path(key, previous[0]))
+            self._entries[key] = (extension, size)
+            self._total_bytes += size
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                old_key, (old_extension, old_size) = self._entries.popitem(last=False)
+                self._total_bytes -= old_size
+                evicted.append(self._path(old_key, old_extension))
+                evicted_keys.append(old_key)
+        self._touch(key)
+        if evicted_keys:
+            self._forget(evicted_keys)
+        for path in evicted:
+            self._remove(path)
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError as e:
+            print(f"Error evicting cached audio {path}: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_ratio': self._hits / lookups if lookups else 0.0,
+            }
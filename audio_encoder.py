@@ -0,0 +1,380 @@
+"""Transcoding of finished WAV outputs to compressed formats on a process pool."""
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from coordination import temp_name
+from wav_utils import read_wav_header
+
+# Output formats, by file extension. ffmpeg_args select the codec and container.
+FORMATS = {
+    'flac': {'extension': '.flac', 'mimetype': 'audio/flac', 'ffmpeg_args': ['-c:a', 'flac', '-f', 'flac']},
+    'ogg': {'extension': '.ogg', 'mimetype': 'audio/ogg',
+            'ffmpeg_args': ['-c:a', 'libopus', '-b:a', '32k', '-f', 'ogg']},
+    'mp3': {'extension': '.mp3', 'mimetype': 'audio/mpeg',
+            'ffmpeg_args': ['-c:a', 'libmp3lame', '-b:a', '64k', '-f', 'mp3']},
+}
+
+# Smallest first; the order in which negotiated formats are preferred
+FORMAT_PREFERENCE = ['ogg', 'mp3', 'flac']
+
+FFMPEG = shutil.which('ffmpeg')
+
+# Samples per FLAC frame
+FLAC_BLOCK_SIZE = 4096
+
+# With 4-bit Rice parameters, 15 is the escape code
+MAX_RICE_PARAMETER = 14
+
+# FLAC frame header sample size codes
+FLAC_SAMPLE_SIZE_CODES = {8: 1, 12: 2, 16: 4, 20: 5, 24: 6}
+
+# Maps unsigned 8-bit WAV samples to the signed bytes FLAC's MD5 signature is computed over
+SIGNED_8BIT = bytes((i - 128) & 0xFF for i in range(256))
+
+
+def _crc_table(polynomial: int, width: int) -> list[int]:
+    top = 1 << (width - 1)
+    mask = (1 << width) - 1
+    table = []
+    for byte in range(256):
+        crc = byte << (width - 8)
+        for _ in range(8):
+            crc = ((crc << 1) ^ polynomial) if crc & top else crc << 1
+        table.append(crc & mask)
+    return table
+
+
+CRC8_TABLE = _crc_table(0x07, 8)
+CRC16_TABLE = _crc_table(0x8005, 16)
+
+
+def crc8(data: bytes) -> int:
+    crc = 0
+    for byte in data:
+        crc = CRC8_TABLE[crc ^ byte]
+    return crc
+
+
+def crc16(data: bytes) -> int:
+    crc = 0
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFF) ^ CRC16_TABLE[(crc >> 8) ^ byte]
+    return crc
+
+
+def available_formats() -> list[str]:
+    """Formats this machine can produce: FLAC always, Opus and MP3 only through ffmpeg."""
+    if FFMPEG:
+        return list(FORMATS)
+    return ['flac']
+
+
+def variant_path(wav_path: str, fmt: str) -> str:
+    """Path of the `fmt` encoding of a WAV file: same name, other extension."""
+    return os.path.splitext(wav_path)[0] + FORMATS[fmt]['extension']
+
+
+def is_fresh(wav_stat, encoded_stat) -> bool:
+    """An encoding is current when it carries the mtime of the WAV it was made from."""
+    return encoded_stat.st_mtime_ns == wav_stat.st_mtime_ns
+
+
+def encode_file(wav_path: str, fmt: str) -> tuple[str, float]:
+    """
+    Encode a WAV file to `fmt` next to it, unless a current encoding exists.
+
+    The encoding is written under a temporary name, renamed into place and given
+    the WAV's mtime, so a WAV replaced later makes it stale. Runs in pool workers.
+
+    Returns:
+        (encoded path, seconds spent encoding; 0.0 when it was already current)
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format: {fmt}")
+    output_path = variant_path(wav_path, fmt)
+    wav_stat = os.stat(wav_path)
+    try:
+        if is_fresh(wav_stat, os.stat(output_path)):
+            return output_path, 0.0
+    except FileNotFoundError:
+        pass
+
+    start = time.perf_counter()
+    temp_path = temp_name(output_path)
+    try:
+        if FFMPEG:
+            encode_with_ffmpeg(wav_path, temp_path, fmt)
+        elif fmt == 'flac':
+            encode_flac(wav_path, temp_path)
+        else:
+            raise ValueError(f"Encoding to {fmt} requires ffmpeg")
+        os.utime(temp_path, ns=(wav_stat.st_atime_ns, wav_stat.st_mtime_ns))
+        os.replace(temp_path, output_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    return output_path, time.perf_counter() - start
+
+
+def encode_with_ffmpeg(wav_path: str, output_path: str, fmt: str):
+    command = [FFMPEG, '-nostdin', '-loglevel', 'error', '-y', '-i', wav_path] + FORMATS[fmt]['ffmpeg_args'] + [output_path]
+    result = subprocess.run(command, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.decode('utf-8', 'replace').strip()}")
+
+
+def _twos(value: int, bits: int) -> str:
+    return format(value & ((1 << bits) - 1), f'0{bits}b')
+
+
+def _rice_parameter(total: int, count: int) -> tuple[int, int]:
+    """Best Rice parameter for `count` values summing to `total`, by estimated size; returns (parameter, bits)."""
+    best = None
+    for k in range(MAX_RICE_PARAMETER + 1):
+        bits = count * (k + 1) + (total >> k)
+        if best is None or bits < best[1]:
+            best = (k, bits)
+        elif total >> k == 0:
+            break
+    return best
+
+
+def _residual_bits(residual: list[int], order: int, block_size: int) -> str:
+    """Rice-coded residual, with the partition order that gives the smallest estimate."""
+    folded = [value << 1 if value >= 0 else (-value << 1) - 1 for value in residual]
+
+    # Finest usable partitioning: equal partitions, the first one longer than the warm-up
+    max_order = 0
+    while max_order < 8 and block_size % (2 << max_order) == 0 and (block_size >> (max_order + 1)) > order:
+        max_order += 1
+    size = block_size >> max_order
+    bounds = [(max(0, j * size - order), (j + 1) * size - order) for j in range(1 << max_order)]
+    sums = [sum(folded[start:end]) for start, end in bounds]
+
+    best = None
+    for partition_order in range(max_order + 1):
+        group = 1 << (max_order - partition_order)
+        parameters = []
+        estimate = 0
+        for g in range(0, len(bounds), group):
+            count = bounds[g + group - 1][1] - bounds[g][0]
+            k, bits = _rice_parameter(sum(sums[g:g + group]), count)
+            parameters.append(k)
+            estimate += 4 + bits
+        if best is None or estimate < best[0]:
+            best = (estimate, partition_order, parameters)
+
+    _, partition_order, parameters = best
+    group = 1 << (max_order - partition_order)
+    pieces = ['00', format(partition_order, '04b')]
+    for g, k in zip(range(0, len(bounds), group), parameters):
+        pieces.append(format(k, '04b'))
+        values = folded[bounds[g][0]:bounds[g + group - 1][1]]
+        if k:
+            mask = (1 << k) - 1
+            high = 1 << k
+            pieces.append(''.join('0' * (u >> k) + format((u & mask) | high, 'b') for u in values))
+        else:
+            pieces.append(''.join('0' * u + '1' for u in values))
+    return ''.join(pieces)
+
+
+def _subframe_bits(samples: list[int], bits_per_sample: int) -> str:
+    """One channel of a frame: CONSTANT for silence, else the best FIXED predictor, else VERBATIM."""
+    first = samples[0]
+    if samples.count(first) == len(samples):
+        return '00000000' + _twos(first, bits_per_sample)
+
+    # Residuals of the fixed predictors are successive differences of the samples
+    best = None
+    residual = samples
+    for order in range(min(4, len(samples) - 1) + 1):
+        if order:
+            residual = [b - a for a, b in zip(residual, residual[1:])]
+        cost = sum(map(abs, residual))
+        if best is None or cost < best[0]:
+            best = (cost, order, residual)
+
+    _, order, residual = best
+    warm_up = ''.join(_twos(sample, bits_per_sample) for sample in samples[:order])
+    bits = '0001' + format(order, '03b') + '0' + warm_up + _residual_bits(residual, order, len(samples))
+    if len(bits) >= 8 + len(samples) * bits_per_sample:
+        return '00000010' + ''.join(_twos(sample, bits_per_sample) for sample in samples)
+    return bits
+
+
+def _utf8_number(number: int) -> bytes:
+    """Frame number in FLAC's UTF-8-like variable length coding."""
+    if number < 0x80:
+        return bytes([number])
+    for length, limit in ((2, 0x800), (3, 0x10000), (4, 0x200000), (5, 0x4000000), (6, 0x80000000), (7, 1 << 36)):
+        if number < limit:
+            break
+    tail = []
+    for _ in range(length - 1):
+        tail.append(0x80 | (number & 0x3F))
+        number >>= 6
+    return bytes([((0xFF00 >> length) & 0xFF) | number] + tail[::-1])
+
+
+def _flac_frame(channels: list[list[int]], frame_number: int, bits_per_sample: int) -> bytes:
+    block_size = len(channels[0])
+    header = bytearray([0xFF, 0xF8, 0x70, ((len(channels) - 1) << 4) | (FLAC_SAMPLE_SIZE_CODES[bits_per_sample] << 1)])
+    header += _utf8_number(frame_number)
+    header += (block_size - 1).to_bytes(2, 'big')
+    header.append(crc8(header))
+
+    bits = ''.join(_subframe_bits(samples, bits_per_sample) for samples in channels)
+    bits += '0' * (-len(bits) % 8)
+    frame = bytes(header) + int(bits, 2).to_bytes(len(bits) // 8, 'big')
+    return frame + crc16(frame).to_bytes(2, 'big')
+
+
+def encode_flac(wav_path: str, output_path: str, block_size: int = FLAC_BLOCK_SIZE):
+    """
+    Pure Python FLAC encoder for 8 and 16-bit PCM WAV files (used when ffmpeg is missing).
+
+    Each frame uses a constant subframe for digital silence, otherwise the best
+    of FLAC's fixed polynomial predictors with partitioned Rice coding. The WAV is
+    read one frame at a time. STREAMINFO is patched at the end with the frame
+    sizes and the MD5 of the audio.
+    """
+    header = read_wav_header(wav_path)
+    bits_per_sample = header['bits_per_sample']
+    num_channels = header['num_channels']
+    if bits_per_sample not in (8, 16):
+        raise ValueError(f"Pure Python FLAC encoding supports 8 and 16-bit PCM, not {bits_per_sample}-bit")
+    block_align = num_channels * (bits_per_sample // 8)
+    total_samples = header['data_size'] // block_align
+
+    md5 = hashlib.md5()
+    frame_sizes = []
+    with open(wav_path, 'rb') as src, open(output_path, 'wb') as out:
+        out.write(b'fLaC' + bytes([0x80, 0, 0, 34]) + bytes(34))
+        src.seek(header['data_offset'])
+        remaining = total_samples
+        frame_number = 0
+        while remaining > 0:
+            count = min(block_size, remaining)
+            data = src.read(count * block_align)
+            if len(data) < count * block_align:
+                raise ValueError(f"{wav_path} is shorter than its header says")
+            if bits_per_sample == 16:
+                samples = array('h', data)
+                if sys.byteorder == 'big':
+                    samples.byteswap()
+                md5.update(data)
+            else:
+                signed = data.translate(SIGNED_8BIT)
+                samples = array('b', signed)
+                md5.update(signed)
+            frame = _flac_frame([samples[c::num_channels].tolist() for c in range(num_channels)],
+                                frame_number, bits_per_sample)
+            out.write(frame)
+            frame_sizes.append(len(frame))
+            remaining -= count
+            frame_number += 1
+
+        out.seek(8)
+        out.write(block_size.to_bytes(2, 'big') * 2)
+        out.write(min(frame_sizes, default=0).to_bytes(3, 'big'))
+        out.write(max(frame_sizes, default=0).to_bytes(3, 'big'))
+        packed = (header['sample_rate'] << 44) | ((num_channels - 1) << 41) | ((bits_per_sample - 1) << 36) | total_samples
+        out.write(packed.to_bytes(8, 'big'))
+        out.write(md5.digest())
+
+
+class AudioEncoder:
+    """
+    Encode finished WAV files to compressed formats on a pool of worker processes.
+
+    Encoding is CPU bound (the FLAC fallback entirely so), so it runs in
+    `max_workers` processes, by default one per core. Submitting a file that is
+    already being encoded to the same format returns the pending future.
+    `on_encoded(path)` is called with each new encoding.
+    """
+
+    def __init__(self, max_workers: int | None = None, on_encoded=None):
+        self.max_workers = max(1, int(max_workers or os.cpu_count() or 1))
+        self.on_encoded = on_encoded
+        self._executor = None
+        self._pending = {}  # (wav path, format) -> Future
+        self._lock = threading.Lock()
+        self._stats = {
+            'submitted': 0,
+            'encoded': 0,
+            'up_to_date': 0,
+            'failed': 0,
+            'encode_seconds_total': 0.0,
+        }
+
+    def _get_executor(self):
+        if self._executor is None:
+            try:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            except (OSError, NotImplementedError) as e:
+                # e.g. no working semaphores in a sandbox; ffmpeg still runs in parallel from threads
+                print(f"Process pool unavailable, encoding on threads: {e}")
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='encoder')
+        return self._executor
+
+    def submit(self, wav_path: str, fmt: str):
+        """Queue `wav_path` for encoding to `fmt`; returns a Future of encode_file's (path, seconds)."""
+        if fmt not in available_formats():
+            raise ValueError(f"Format {fmt} is not available (available: {', '.join(available_formats())})")
+        key = (wav_path, fmt)
+        with self._lock:
+            future = self._pending.get(key)
+            if future is not None:
+                return future
+            self._stats['submitted'] += 1
+            try:
+                future = self._get_executor().submit(encode_file, wav_path, fmt)
+            except BrokenProcessPool:
+                # A worker died (e.g. killed for memory); start a fresh pool
+                self._executor = None
+                future = self._get_executor().submit(encode_file, wav_path, fmt)
+            self._pending[key] = future
+        future.add_done_callback(lambda done: self._finished(key, done))
+        return future
+
+    def encode(self, wav_path: str, fmt: str, timeout: float | None = None) -> str:
+        """Encode and wait; returns the encoded path."""
+        return self.submit(wav_path, fmt).result(timeout)[0]
+
+    def _finished(self, key: tuple[str, str], future):
+        with self._lock:
+            self._pending.pop(key, None)
+            error = future.exception()
+            if error is not None:
+                self._stats['failed'] += 1
+            else:
+                _, seconds = future.result()
+                if seconds:
+                    self._stats['encoded'] += 1
+                    self._stats['encode_seconds_total'] += seconds
+                else:
+                    self._stats['up_to_date'] += 1
+        if error is not None:
+            print(f"Error encoding {key[0]} to {key[1]}: {error}")
+        elif self.on_encoded is not None:
+            self.on_encoded(future.result()[0])
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._pending)
+        stats['workers'] = self.max_workers
+        stats['formats'] = available_formats()
+        stats['ffmpeg'] = bool(FFMPEG)
+        return stats
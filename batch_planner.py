@@ -0,0 +1,226 @@
+"""Packing of short paragraphs into shared TTS requests, and cutting their audio back apart."""
+import sys
+import threading
+from array import array
+from typing import NamedTuple
+
+# Text placed between paragraphs of a batch; read as a paragraph pause
+PARAGRAPH_SEPARATOR = '\n\n'
+
+# Silence detection works on the peak-to-peak level of short windows
+WINDOW_SECONDS = 0.01
+MIN_GAP_SECONDS = 0.2
+# A window is silent below this fraction of the loud (90th percentile) level, or below MIN_SILENCE_LEVEL
+SILENCE_RATIO = 0.08
+MIN_SILENCE_LEVEL = 64
+
+# Preference for longer gaps when choosing cuts, relative to the cost of a cut one whole batch away from its expected place
+GAP_LENGTH_WEIGHT = 0.1
+
+# A cut paragraph shorter than this fraction of its expected length means the silences were misread
+MIN_SEGMENT_RATIO = 0.3
+
+# Proportional cuts are moved to the quietest window within this distance
+SNAP_SECONDS = 0.5
+
+
+class ParagraphBatch(NamedTuple):
+    """Consecutive paragraphs synthesized in one request."""
+    indexes: list[int]
+    texts: list[str]
+
+    @property
+    def text(self) -> str:
+        return PARAGRAPH_SEPARATOR.join(self.texts)
+
+
+def pcm_samples(data: bytes) -> array:
+    """16-bit little-endian PCM as an array of samples."""
+    samples = array('h', data[:len(data) - len(data) % 2])
+    if sys.byteorder == 'big':
+        samples.byteswap()
+    return samples
+
+
+def pcm_bytes(samples: array) -> bytes:
+    if sys.byteorder == 'big':
+        samples = array('h', samples)
+        samples.byteswap()
+    return samples.tobytes()
+
+
+def window_levels(samples: array, window: int) -> list[int]:
+    """Peak-to-peak level of each `window` samples (max and min run in C on array slices)."""
+    levels = []
+    for start in range(0, len(samples), window):
+        segment = samples[start:start + window]
+        levels.append(max(segment) - min(segment))
+    return levels
+
+
+def find_silences(levels: list[int], min_windows: int) -> list[tuple[int, int]]:
+    """
+    Silent runs of at least `min_windows` windows, as (start, end) window indexes.
+
+    Leading and trailing silence is not a gap between paragraphs and is left out.
+    """
+    if not levels:
+        return []
+    loud = sorted(levels)[int(len(levels) * 0.9)]
+    threshold = max(MIN_SILENCE_LEVEL, loud * SILENCE_RATIO)
+    silences = []
+    start = None
+    for i, level in enumerate(levels):
+        if level < threshold:
+            if start is None:
+                start = i
+        elif start is not None:
+            if start > 0 and i - start >= min_windows:
+                silences.append((start, i))
+            start = None
+    return silences
+
+
+def choose_gaps(gaps: list[tuple[int, int]], expected: list[float], total: int) -> list[int] | None:
+    """
+    Pick one gap per expected cut, in order, minimizing distance to the expected
+    positions while preferring longer gaps (dynamic programming over gaps).
+
+    Returns the chosen gap indexes, or None when there are fewer gaps than cuts.
+    """
+    if len(gaps) < len(expected):
+        return None
+    longest = max(end - start for start, end in gaps)
+    costs = [
+        [abs((start + end) / 2 - position) / total - GAP_LENGTH_WEIGHT * (end - start) / longest
+         for start, end in gaps]
+        for position in expected
+    ]
+    # best[j]: lowest cost of cuts so far with the latest cut at gap j
+    best = costs[0][:]
+    choices = []
+    for cut in range(1, len(expected)):
+        previous = [None] * len(gaps)
+        running = None
+        current = [float('inf')] * len(gaps)
+        for j in range(cut, len(gaps)):
+            if running is None or best[j - 1] < best[running]:
+                running = j - 1
+            current[j] = best[running] + costs[cut][j]
+            previous[j] = running
+        choices.append(previous)
+        best = current
+
+    last = min(range(len(expected) - 1, len(gaps)), key=lambda j: best[j])
+    chosen = [last]
+    for previous in reversed(choices):
+        chosen.append(previous[chosen[-1]])
+    return chosen[::-1]
+
+
+class ParagraphBatcher:
+    """
+    Plans which paragraphs share a TTS request and cuts the shared audio per paragraph.
+
+    Consecutive paragraphs are packed up to `max_chars` characters (about one
+    token per character for Chinese text) and `max_paragraphs` paragraphs; a
+    paragraph over the budget is sent alone. The audio of a batch is cut at the
+    pauses between paragraphs: silent gaps are detected from window levels and
+    matched to the positions expected from each paragraph's share of the text.
+    When the gaps do not fit, cuts fall at the expected positions, moved to the
+    nearest quiet window.
+    """
+
+    def __init__(self, max_chars: int = 1000, max_paragraphs: int = 16):
+        self.max_chars = max(0, int(max_chars))
+        self.max_paragraphs = max(1, int(max_paragraphs))
+        self._lock = threading.Lock()
+        self._stats = {
+            'paragraphs': 0,
+            'requests': 0,
+            'split_by_silence': 0,
+            'split_proportional': 0,
+        }
+
+    def plan(self, paragraphs: list[tuple[int, str]]) -> list[ParagraphBatch]:
+        """Group (index, text) pairs, in order, into batches."""
+        batches = []
+        indexes, texts, size = [], [], 0
+        for index, text in paragraphs:
+            added = len(text) + (len(PARAGRAPH_SEPARATOR) if texts else 0)
+            if texts and (size + added > self.max_chars or len(texts) >= self.max_paragraphs):
+                batches.append(ParagraphBatch(indexes, texts))
+                indexes, texts, size = [], [], 0
+                added = len(text)
+            indexes.append(index)
+            texts.append(text)
+            size += added
+        if texts:
+            batches.append(ParagraphBatch(indexes, texts))
+        with self._lock:
+            self._stats['paragraphs'] += len(paragraphs)
+            self._stats['requests'] += len(batches)
+        return batches
+
+    def split(self, samples: array, sample_rate: int, texts: list[str],
+              num_channels: int = 1) -> tuple[list[tuple[int, int]], str]:
+        """
+        Cut a batch's audio into one (start, end) sample range per paragraph.
+
+        Ranges are in samples of `samples` (interleaved for several channels) and
+        always fall on frame boundaries; together they cover the whole audio.
+        Returns (ranges, method): 'single' for a one-paragraph batch, 'split_by_silence'
+        when every cut is at a detected pause, or 'split_proportional' when the cuts
+        are estimates from the text lengths and may fall mid-word.
+        """
+        frames = len(samples) // num_channels
+        if len(texts) == 1:
+            return [(0, frames * num_channels)], 'single'
+
+        window_frames = max(1, int(sample_rate * WINDOW_SECONDS))
+        window = window_frames * num_channels
+        levels = window_levels(samples, window)
+        total_chars = sum(len(text) for text in texts)
+        expected = []
+        chars = 0
+        for text in texts[:-1]:
+            chars += len(text)
+            expected.append(frames * chars / total_chars)
+
+        gaps = [(start * window_frames, end * window_frames)
+                for start, end in find_silences(levels, max(1, int(MIN_GAP_SECONDS / WINDOW_SECONDS)))]
+        chosen = choose_gaps(gaps, expected, frames)
+        cuts = None
+        if chosen is not None:
+            cuts = [(gaps[j][0] + gaps[j][1]) // 2 for j in chosen]
+            bounds = [0] + cuts + [frames]
+            expected_bounds = [0] + expected + [frames]
+            for i in range(len(texts)):
+                if bounds[i + 1] - bounds[i] < MIN_SEGMENT_RATIO * (expected_bounds[i + 1] - expected_bounds[i]):
+                    cuts = None
+                    break
+
+        if cuts is not None:
+            method = 'split_by_silence'
+        else:
+            method = 'split_proportional'
+            radius = max(1, int(SNAP_SECONDS / WINDOW_SECONDS))
+            cuts = []
+            for position in expected:
+                center = int(position) // window_frames
+                candidates = range(max(0, center - radius), min(len(levels), center + radius + 1))
+                quietest = min(candidates, key=lambda w: (levels[w], abs(w - center)), default=center)
+                cuts.append(min(frames, max(cuts[-1] if cuts else 0, quietest * window_frames + window_frames // 2)))
+
+        with self._lock:
+            self._stats[method] += 1
+        bounds = [0] + cuts + [frames]
+        return [(bounds[i] * num_channels, bounds[i + 1] * num_channels) for i in range(len(texts))], method
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats['max_chars'] = self.max_chars
+        stats['max_paragraphs'] = self.max_paragraphs
+        stats['requests_saved'] = stats['paragraphs'] - stats['requests']
+        return stats
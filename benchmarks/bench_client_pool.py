@@ -0,0 +1,74 @@
+"""
+Compare a new genai.Client per call against the pooled clients in gemini_client.
+
+Runs entirely offline against FakeGeminiTransport:
+
+    python benchmarks/bench_client_pool.py --calls 50 --connect-latency 0.05
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google import genai
+from google.genai import types
+from gemini_client import ClientPool
+from fake_gemini import FakeGeminiTransport
+
+MODEL = "gemini-2.5-pro-preview-tts"
+CONFIG = types.GenerateContentConfig(response_modalities=["audio"])
+
+
+def synthesize(client):
+    size = 0
+    for chunk in client.models.generate_content_stream(model=MODEL, contents="benchmark", config=CONFIG):
+        size += len(chunk.candidates[0].content.parts[0].inline_data.data)
+    return size
+
+
+def bench_per_call(calls, args):
+    start = time.perf_counter()
+    for _ in range(calls):
+        transport = FakeGeminiTransport(args.latency, args.connect_latency, args.audio_seconds)
+        client = genai.Client(api_key='bench', http_options=types.HttpOptions(client_args={'transport': transport}))
+        synthesize(client)
+        client.close()
+    return time.perf_counter() - start
+
+
+def bench_pooled(calls, args):
+    transport = FakeGeminiTransport(args.latency, args.connect_latency, args.audio_seconds)
+    pool = ClientPool(['bench'], http_options=types.HttpOptions(client_args={'transport': transport}))
+    start = time.perf_counter()
+    for _ in range(calls):
+        with pool.acquire() as lease:
+            synthesize(lease.client)
+    elapsed = time.perf_counter() - start
+    stats = pool.stats()
+    pool.close()
+    return elapsed, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--calls', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds charged on every request')
+    parser.add_argument('--connect-latency', type=float, default=0.05, help='seconds charged on a new connection')
+    parser.add_argument('--audio-seconds', type=float, default=1.0)
+    args = parser.parse_args()
+
+    per_call = bench_per_call(args.calls, args)
+    pooled, stats = bench_pooled(args.calls, args)
+
+    print(f"calls:                 {args.calls}")
+    print(f"new client per call:   {per_call / args.calls * 1000:8.2f} ms/call")
+    print(f"pooled client:         {pooled / args.calls * 1000:8.2f} ms/call")
+    print(f"saving per call:       {(per_call - pooled) / args.calls * 1000:8.2f} ms")
+    print(f"client reuse ratio:    {stats['client_reuse_ratio']:.2%}")
+    print(f"avg acquire time:      {stats['acquire_seconds_avg'] * 1e6:8.1f} us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+"""Local stand-in for the Gemini streaming TTS endpoint, used by the benchmarks."""
+import base64
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import httpx
+
+SAMPLE_RATE = 24000
+MIME_TYPE = f"audio/L16;codec=pcm;rate={SAMPLE_RATE}"
+
+# Synthetic speech: a loud triangle wave per paragraph, with a pause between paragraphs
+SPEECH_AMPLITUDE = 4000
+PARAGRAPH_PAUSE_SECONDS = 0.6
+
+
+def synthetic_pcm(seconds: float) -> bytes:
+    """Return `seconds` of 16-bit mono silence-with-noise PCM."""
+    samples = int(SAMPLE_RATE * seconds)
+    pattern = b'\x10\x00\xf0\xff'
+    return (pattern * (samples // 2 + 1))[:samples * 2]
+
+
+def _speech_second() -> bytes:
+    period = 120
+    wave = bytearray()
+    for i in range(SAMPLE_RATE):
+        phase = i % period
+        level = SPEECH_AMPLITUDE * (4 * abs(phase / period - 0.5) - 1)
+        wave += int(level).to_bytes(2, 'little', signed=True)
+    return bytes(wave)
+
+
+SPEECH_SECOND = _speech_second()
+
+
+def synthetic_speech(paragraph_seconds: list[float]) -> bytes:
+    """PCM with one stretch of 'speech' per paragraph, separated by pauses, like a batched TTS response."""
+    pause = bytes(int(SAMPLE_RATE * PARAGRAPH_PAUSE_SECONDS) * 2)
+    parts = []
+    for i, seconds in enumerate(paragraph_seconds):
+        if i:
+            parts.append(pause)
+        size = int(SAMPLE_RATE * seconds) * 2
+        parts.append((SPEECH_SECOND * (size // len(SPEECH_SECOND) + 1))[:size])
+    return b''.join(parts)
+
+
+def sse_event(pcm: bytes) -> bytes:
+    payload = {
+        'candidates': [{
+            'content': {
+                'role': 'model',
+                'parts': [{'inlineData': {
+                    'mimeType': MIME_TYPE,
+                    'data': base64.b64encode(pcm).decode('ascii'),
+                }}],
+            },
+        }],
+    }
+    return b'data: ' + json.dumps(payload).encode('utf-8') + b'\r\n\r\n'
+
+
+def sse_body(pcm: bytes, chunk_count: int = 1) -> bytes:
+    """Encode PCM as a streamGenerateContent server-sent-events body."""
+    chunk_size = max(2, (len(pcm) // chunk_count) & ~1)
+    return b''.join(sse_event(pcm[offset:offset + chunk_size]) for offset in range(0, len(pcm), chunk_size))
+
+
+def error_body(status: int, retry_delay: float = 1.0) -> bytes:
+    """A google.rpc error body, with RetryInfo for 429 like the real API."""
+    error = {'code': status, 'message': 'Synthetic error from the fake Gemini server'}
+    if status == 429:
+        error['status'] = 'RESOURCE_EXHAUSTED'
+        error['details'] = [{'@type': 'type.googleapis.com/google.rpc.RetryInfo', 'retryDelay': f'{retry_delay:g}s'}]
+    else:
+        error['status'] = 'UNAVAILABLE'
+    return json.dumps({'error': error}).encode('utf-8')
+
+
+def request_text(body: bytes) -> str:
+    """The text of a generateContent request body."""
+    try:
+        request = json.loads(body or b'{}')
+    except ValueError:
+        return ''
+    return ''.join(part.get('text', '') for content in request.get('contents', []) for part in content.get('parts', []))
+
+
+class FakeTts:
+    """
+    Behaviour of the fake TTS endpoint: how long a response takes, how it is chunked, and when it fails.
+
+    Audio length follows the request text (`seconds_per_char`, about right for
+    Chinese narration); paragraphs separated by a blank line get their own stretch
+    of audio with a pause between them. The first chunk arrives after `latency`
+    plus up to `jitter` seconds, later chunks every `chunk_interval` seconds.
+    A request fails with 503 at `error_rate` and with 429 at `rate_limit_rate`.
+    """
+
+    def __init__(self, latency: float = 0.3, jitter: float = 0.1, chunk_seconds: float = 2.0,
+                 chunk_interval: float = 0.05, seconds_per_char: float = 0.2, error_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, retry_delay: float = 1.0, seed: int | None = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.chunk_seconds = chunk_seconds
+        self.chunk_interval = chunk_interval
+        self.seconds_per_char = seconds_per_char
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_delay = retry_delay
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'errors': 0, 'rate_limited': 0, 'audio_bytes': 0}
+
+    def respond(self, body: bytes):
+        """Return (status, chunks) for a request body; chunks is an iterator that sleeps between chunks."""
+        with self._lock:
+            self.stats['requests'] += 1
+            roll = self._random.random()
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            if roll < self.error_rate:
+                self.stats['errors'] += 1
+                status = 503
+            elif roll < self.error_rate + self.rate_limit_rate:
+                self.stats['rate_limited'] += 1
+                status = 429
+            else:
+                status = 200
+        if status != 200:
+            time.sleep(delay)
+            return status, iter([error_body(status, self.retry_delay)])
+
+        paragraphs = [p for p in request_text(body).split('\n\n') if p.strip()] or ['']
+        pcm = synthetic_speech([max(0.2, len(p) * self.seconds_per_char) for p in paragraphs])
+        with self._lock:
+            self.stats['audio_bytes'] += len(pcm)
+        return status, self._chunks(pcm, delay)
+
+    def _chunks(self, pcm: bytes, delay: float):
+        time.sleep(delay)
+        chunk_size = max(2, int(SAMPLE_RATE * self.chunk_seconds) * 2)
+        for offset in range(0, len(pcm), chunk_size):
+            if offset:
+                time.sleep(self.chunk_interval)
+            yield sse_event(pcm[offset:offset + chunk_size])
+
+
+class FakeGeminiTransport(httpx.BaseTransport):
+    """
+    httpx transport that answers every request with synthetic TTS audio.
+
+    `connect_latency` is charged on the first request of each transport, standing
+    in for the TCP + TLS handshake a fresh client pays; `latency` is charged on
+    every request.
+    """
+
+    def __init__(self, latency: float = 0.0, connect_latency: float = 0.0, audio_seconds: float = 1.0):
+        self.latency = latency
+        self.connect_latency = connect_latency
+        self.body = sse_body(synthetic_pcm(audio_seconds))
+        self.requests = 0
+        self.connections = 0
+        self._connected = False
+        self._lock = threading.Lock()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        with self._lock:
+            self.requests += 1
+            connect = not self._connected
+            if connect:
+                self._connected = True
+                self.connections += 1
+        time.sleep(self.latency + (self.connect_latency if connect else 0.0))
+        return httpx.Response(200, headers={'content-type': 'text/event-stream'}, content=self.body)
+
+
+class FakeGeminiServer:
+    """
+    A local HTTP server speaking enough of the Gemini API for streamed TTS.
+
+    Point a client at it with HttpOptions(base_url=server.url). Responses are
+    streamed with chunked transfer encoding, as the real endpoint does, so
+    time-to-first-chunk and connection reuse behave as in production.
+    """
+
+    def __init__(self, tts: FakeTts, host: str = '127.0.0.1', port: int = 0):
+        self.tts = tts
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(handler):
+                length = int(handler.headers.get('Content-Length') or 0)
+                status, chunks = tts.respond(handler.rfile.read(length))
+                handler.send_response(status)
+                handler.send_header('Content-Type', 'text/event-stream' if status == 200 else 'application/json')
+                handler.send_header('Transfer-Encoding', 'chunked')
+                handler.end_headers()
+                try:
+                    for chunk in chunks:
+                        handler.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                        handler.wfile.flush()
+                    handler.wfile.write(b'0\r\n\r\n')
+                except (BrokenPipeError, ConnectionResetError):
+                    handler.close_connection = True
+
+            def log_message(handler, format, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            # Benchmarks open hundreds of connections at once; the default backlog of 5 would reset them
+            request_queue_size = 1024
+            daemon_threads = True
+
+        self._server = Server((host, port), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-gemini', daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
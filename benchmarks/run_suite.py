@@ -0,0 +1,315 @@
+"""
+End-to-end benchmarks of the app's endpoints against a local fake Gemini TTS server.
+
+Runs entirely offline. Every scenario runs in its own process, in a fresh
+temporary working directory, so peak RSS is measured per scenario:
+
+    python benchmarks/run_suite.py --novel-chapters 1000 --latency 0.3 --jitter 0.2 --error-rate 0.02
+    python benchmarks/run_suite.py --scenarios paragraphs --chapters 16 --json
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import httpx
+from fake_gemini import SAMPLE_RATE, FakeGeminiServer, FakeTts, synthetic_speech
+
+SCENARIOS = ('decode', 'generate', 'paragraphs', 'concatenate')
+
+# Characters the synthetic novel is written in; the parser only cares about chapter headings and blank lines
+NOVEL_CHARACTERS = '的一是了我不人在他有这个上们来到时大地为子中你说生国年着就那和要她出也得里后自以会家可下而过天去能对小多然于心学么之都好看起发当没成只如事把还用第样道想作种开美总从无情己面最女但现前些所同日手又行意动方期它头经长儿回位分爱老因很给名法间斯知世什两次使身者被高已亲其进此话常与活正感'
+NOVEL_PUNCTUATION = '，，，。。！？'
+
+
+def synthetic_novel(chapters: int, paragraphs: int, paragraph_chars: int, seed: int = 0) -> str:
+    """A Chinese-looking novel: `chapters` chapters of `paragraphs` paragraphs of about `paragraph_chars` characters."""
+    rng = random.Random(seed)
+    parts = []
+    for chapter in range(1, chapters + 1):
+        parts.append(f"第{chapter}章 {''.join(rng.choices(NOVEL_CHARACTERS, k=4))}\n\n")
+        for _ in range(paragraphs):
+            length = max(4, int(rng.gauss(paragraph_chars, paragraph_chars / 3)))
+            words = rng.choices(NOVEL_CHARACTERS, k=length)
+            for i in range(rng.randrange(6, 12), length - 1, rng.randrange(6, 12)):
+                words[i] = rng.choice(NOVEL_PUNCTUATION)
+            parts.append(''.join(words) + '。\n\n')
+    return ''.join(parts)
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Nearest-rank percentile, q in [0, 100]."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, int(round(q / 100 * len(ordered) + 0.5)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def timed_requests(send, items, concurrency: int) -> tuple[list[float], int, float]:
+    """Call send(item) for every item on `concurrency` threads; returns (latencies, errors, elapsed)."""
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def run(item):
+        nonlocal errors
+        start = time.perf_counter()
+        ok = send(item)
+        latency = time.perf_counter() - start
+        with lock:
+            latencies.append(latency)
+            if not ok:
+                errors += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(run, items))
+    return latencies, errors, time.perf_counter() - start
+
+
+def start_app(args, fake_url: str):
+    """Import the app in the current (temporary) directory, point it at the fake server and serve it."""
+    with open('config.json', 'w', encoding='utf-8') as f:
+        json.dump({
+            'api_key': 'benchmark',
+            'paragraph_workers': args.workers,
+            'paragraph_batch_chars': args.batch_chars,
+            'tts_backoff_base': 0.05,
+            'tts_backoff_max': 1.0,
+        }, f)
+
+    from google.genai import types
+    from werkzeug.serving import make_server
+    from gemini_client import ClientPool
+    import app
+
+    pool = ClientPool(['benchmark'], rate_limiter=app.CLIENT_POOL.rate_limiter,
+                      http_options=types.HttpOptions(base_url=fake_url))
+    app.CLIENT_POOL = pool
+    app.TTS_SCHEDULER.client_pool = pool
+
+    server = make_server('127.0.0.1', 0, app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='benchmark-app', daemon=True).start()
+    return app, server, f"http://127.0.0.1:{server.server_port}"
+
+
+def upload_novel(client: httpx.Client, novel: bytes) -> dict:
+    response = client.post('/decode-file', files={'text_file': ('novel.txt', novel, 'text/plain')})
+    response.raise_for_status()
+    return response.json()
+
+
+def bench_decode(client, app, args) -> dict:
+    novel = synthetic_novel(args.novel_chapters, args.paragraphs, args.paragraph_chars).encode('utf-8')
+
+    def send(_):
+        return client.post('/decode-file', files={'text_file': ('novel.txt', novel, 'text/plain')}).status_code == 200
+
+    latencies, errors, elapsed = timed_requests(send, range(args.decode_runs), 1)
+    return {
+        'latencies': latencies, 'errors': errors, 'seconds': elapsed,
+        'throughput': len(novel) * args.decode_runs / elapsed / 1e6, 'unit': 'MB/s',
+        'detail': f"{len(novel) / 1e6:.1f} MB novel",
+    }
+
+
+def bench_generate(client, app, args) -> dict:
+    novel = synthetic_novel(1, args.requests, args.paragraph_chars, seed=1)
+    paragraphs = [p for p in novel.split('\n\n')[1:] if p]
+
+    def send(index):
+        response = client.post('/generate', data={
+            'text_content': paragraphs[index], 'save_to_file': 'true',
+            'chapter_title': 'benchmark', 'paragraph_index': str(index),
+        })
+        return response.status_code == 200
+
+    latencies, errors, elapsed = timed_requests(send, range(len(paragraphs)), args.concurrency)
+    return {
+        'latencies': latencies, 'errors': errors, 'seconds': elapsed,
+        'throughput': len(paragraphs) / elapsed, 'unit': 'req/s',
+    }
+
+
+def bench_paragraphs(client, app, args) -> dict:
+    toc = upload_novel(client, synthetic_novel(args.chapters, args.paragraphs, args.paragraph_chars).encode('utf-8'))
+    failed = 0
+
+    def send(chapter_index):
+        nonlocal failed
+        response = client.post('/generate-paragraphs', data={'doc_id': toc['doc_id'], 'chapter_index': chapter_index})
+        if response.status_code != 200:
+            return False
+        failed += len(response.json().get('failed_paragraphs', []))
+        return True
+
+    latencies, errors, elapsed = timed_requests(send, range(len(toc['chapters'])), args.concurrency)
+    total = toc['total_paragraphs']
+    return {
+        'latencies': latencies, 'errors': errors, 'seconds': elapsed,
+        'throughput': total / elapsed, 'unit': 'paragraphs/s',
+        'detail': f"{total} paragraphs, {failed} failed",
+    }
+
+
+def bench_concatenate(client, app, args) -> dict:
+    from wav_utils import WavStreamWriter
+
+    # Paragraph files are written directly, so this scenario measures concatenation alone
+    rng = random.Random(2)
+    chapters = []
+    for chapter in range(args.chapters):
+        filenames = []
+        for paragraph in range(1, args.paragraphs + 1):
+            filename = f"concat{chapter}_{paragraph:03d}.wav"
+            seconds = max(0.5, rng.gauss(args.paragraph_chars, args.paragraph_chars / 3) * 0.2)
+            writer = WavStreamWriter(os.path.join(app.OUTPUT_DIR, filename), SAMPLE_RATE, 16)
+            writer.write(synthetic_speech([seconds]))
+            writer.close()
+            app.OUTPUT_INDEX.refresh(writer.path)
+            filenames.append(filename)
+        chapters.append((f"concat{chapter}", filenames))
+
+    def send(chapter):
+        title, filenames = chapter
+        response = client.post('/concatenate-audio', json={'chapter_title': title, 'audio_files': filenames})
+        return response.status_code == 200
+
+    latencies, errors, elapsed = timed_requests(send, chapters, args.concurrency)
+    written = sum(os.path.getsize(os.path.join(app.OUTPUT_DIR, f"{title}_cat.wav"))
+                  for title, _ in chapters if os.path.exists(os.path.join(app.OUTPUT_DIR, f"{title}_cat.wav")))
+    return {
+        'latencies': latencies, 'errors': errors, 'seconds': elapsed,
+        'throughput': written / elapsed / 1e6, 'unit': 'MB/s',
+        'detail': f"{written / 1e6:.0f} MB written",
+    }
+
+
+BENCHMARKS = {
+    'decode': bench_decode,
+    'generate': bench_generate,
+    'paragraphs': bench_paragraphs,
+    'concatenate': bench_concatenate,
+}
+
+
+def run_scenario(name: str, args) -> dict:
+    """Run one scenario in this process (inside a temporary working directory) and return its results."""
+    tts = FakeTts(latency=args.latency, jitter=args.jitter, chunk_seconds=args.chunk_seconds,
+                  chunk_interval=args.chunk_interval, error_rate=args.error_rate,
+                  rate_limit_rate=args.rate_limit_rate, retry_delay=args.retry_delay, seed=args.seed)
+    fake = FakeGeminiServer(tts).start()
+    app, server, url = start_app(args, fake.url)
+    baseline = peak_rss_mb()
+    try:
+        with httpx.Client(base_url=url, timeout=None) as client:
+            result = BENCHMARKS[name](client, app, args)
+            scheduler = client.get('/scheduler-stats').json()
+    finally:
+        server.shutdown()
+        fake.close()
+
+    latencies = result.pop('latencies')
+    result.update({
+        'scenario': name,
+        'requests': len(latencies),
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'baseline_rss_mb': baseline,
+        'peak_rss_mb': peak_rss_mb(),
+        'api_requests': tts.stats['requests'],
+        'api_retries': scheduler['retries'],
+        'api_failures': scheduler['failures'],
+    })
+    return result
+
+
+def print_table(results: list[dict]):
+    print(f"{'scenario':<12} {'requests':>8} {'errors':>6} {'seconds':>8} {'throughput':>20} "
+          f"{'p50 ms':>9} {'p99 ms':>9} {'peak RSS MB':>11} {'API calls':>9} {'retries':>7}")
+    for r in results:
+        throughput = f"{r['throughput']:.2f} {r['unit']}"
+        print(f"{r['scenario']:<12} {r['requests']:>8} {r['errors']:>6} {r['seconds']:>8.2f} {throughput:>20} "
+              f"{r['p50_ms']:>9.1f} {r['p99_ms']:>9.1f} {r['peak_rss_mb']:>11.1f} {r['api_requests']:>9} {r['api_retries']:>7}")
+        if r.get('detail'):
+            print(f"{'':<12} {r['detail']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f"comma-separated subset of {', '.join(SCENARIOS)}")
+    parser.add_argument('--json', action='store_true', help='print results as JSON instead of a table')
+    novel = parser.add_argument_group('synthetic novel')
+    novel.add_argument('--novel-chapters', type=int, default=1000, help='chapters of the novel uploaded by the decode scenario')
+    novel.add_argument('--chapters', type=int, default=8, help='chapters generated and concatenated')
+    novel.add_argument('--paragraphs', type=int, default=40, help='paragraphs per chapter')
+    novel.add_argument('--paragraph-chars', type=int, default=80, help='average characters per paragraph')
+    load = parser.add_argument_group('load')
+    load.add_argument('--requests', type=int, default=50, help='requests sent by the generate scenario')
+    load.add_argument('--concurrency', type=int, default=4, help='requests in flight at once')
+    load.add_argument('--decode-runs', type=int, default=5)
+    load.add_argument('--workers', type=int, default=4, help='paragraph_workers of the app')
+    load.add_argument('--batch-chars', type=int, default=1000, help='paragraph_batch_chars of the app')
+    fake = parser.add_argument_group('fake Gemini server')
+    fake.add_argument('--latency', type=float, default=0.3, help='seconds to the first chunk')
+    fake.add_argument('--jitter', type=float, default=0.1, help='up to this many extra seconds to the first chunk')
+    fake.add_argument('--chunk-seconds', type=float, default=2.0, help='seconds of audio per streamed chunk')
+    fake.add_argument('--chunk-interval', type=float, default=0.05, help='seconds between streamed chunks')
+    fake.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with 503')
+    fake.add_argument('--rate-limit-rate', type=float, default=0.0, help='fraction of requests answered with 429')
+    fake.add_argument('--retry-delay', type=float, default=0.2, help='retryDelay of the 429 responses')
+    fake.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--run-scenario', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_scenario:
+        # Child process: the parent has already moved us into a temporary directory
+        result = run_scenario(args.run_scenario, args)
+        sys.stdout.flush()
+        print('RESULT ' + json.dumps(result))
+        return
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in scenarios if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+
+    results = []
+    for name in scenarios:
+        with tempfile.TemporaryDirectory(prefix=f'bench-{name}-') as workdir:
+            completed = subprocess.run(
+                [sys.executable, os.path.abspath(__file__)] + sys.argv[1:] + ['--run-scenario', name],
+                cwd=workdir, capture_output=True, text=True, env=dict(os.environ, PYTHONPATH=ROOT),
+            )
+        lines = [line for line in completed.stdout.splitlines() if line.startswith('RESULT ')]
+        if completed.returncode != 0 or not lines:
+            print(f"Scenario {name} failed:\n{completed.stdout[-2000:]}{completed.stderr[-4000:]}", file=sys.stderr)
+            continue
+        results.append(json.loads(lines[-1][len('RESULT '):]))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""Whole-book export: every chapter's audio joined into one WAV with chapter markers."""
+import os
+import struct
+from typing import NamedTuple
+from coordination import temp_name
+from wav_utils import COPY_BLOCK_SIZE, WAV_HEADER_SIZE, copy_file_range, read_wav_header, wav_header, write_silence
+
+# Largest RIFF chunk a 32-bit WAV header can describe
+MAX_RIFF_SIZE = 0xFFFFFFFF
+
+
+class ExportSegment(NamedTuple):
+    """One input file of an export and the silence written before it."""
+    path: str
+    data_size: int
+    silence_before: int
+
+
+class ChapterCue(NamedTuple):
+    """A chapter marker: the sample frame where the chapter's audio starts."""
+    title: str
+    frame: int
+
+
+class BookExportPlan(NamedTuple):
+    sample_rate: int
+    bits_per_sample: int
+    num_channels: int
+    segments: list[ExportSegment]
+    cues: list[ChapterCue]
+    data_size: int
+
+    @property
+    def duration(self) -> float:
+        block_align = self.num_channels * (self.bits_per_sample // 8)
+        return self.data_size / (self.sample_rate * block_align)
+
+
+def plan_book_export(chapters: list[tuple[str, list[str]]], paragraph_silence: float = 1.5,
+                     chapter_silence: float = 3.0) -> BookExportPlan:
+    """
+    Lay out an export from the WAV headers of its inputs; no audio is read.
+
+    Args:
+        chapters: (title, paragraph WAV paths in reading order) per chapter, in book order
+        paragraph_silence: Seconds of silence between paragraphs of a chapter
+        chapter_silence: Seconds of silence between chapters
+
+    Returns:
+        The plan: output format, the segments to copy, and one cue per chapter that has audio.
+        Files whose format differs from the first file are skipped, like concatenate_wav_files_pure_python.
+    """
+    segments = []
+    cues = []
+    data_size = 0
+    audio_format = None
+    for title, paths in chapters:
+        chapter_started = False
+        for path in paths:
+            header = read_wav_header(path)
+            file_format = (header['sample_rate'], header['bits_per_sample'], header['num_channels'])
+            if audio_format is None:
+                audio_format = file_format
+                sample_rate, bits_per_sample, num_channels = audio_format
+                block_align = num_channels * (bits_per_sample // 8)
+                # Rounded to whole sample frames so every cue falls on a frame boundary
+                paragraph_silence_bytes = int(sample_rate * paragraph_silence) * block_align
+                chapter_silence_bytes = int(sample_rate * chapter_silence) * block_align
+            elif file_format != audio_format:
+                print(f"Warning: {path} has different format, skipping...")
+                continue
+
+            if not data_size:
+                silence = 0
+            elif chapter_started:
+                silence = paragraph_silence_bytes
+            else:
+                silence = chapter_silence_bytes
+            data_size += silence
+            # A file cut off mid-frame still contributes only whole frames
+            file_size = header['data_size'] - header['data_size'] % block_align
+            if not chapter_started:
+                cues.append(ChapterCue(title, data_size // block_align))
+                chapter_started = True
+            segments.append(ExportSegment(path, file_size, silence))
+            data_size += file_size
+
+    if audio_format is None:
+        raise ValueError("No chapter audio to export")
+    return BookExportPlan(*audio_format, segments, cues, data_size)
+
+
+def cue_chunks(cues: list[ChapterCue]) -> bytes:
+    """
+    Build the `cue ` chunk and the `LIST`/`adtl` chunk labelling each cue point.
+
+    Cue positions are sample frames from the start of the data chunk; labels are
+    the chapter titles as NUL-terminated UTF-8.
+    """
+    cue_points = b''.join(
+        struct.pack('<II4sIII', cue_id, cue.frame, b'data', 0, 0, cue.frame)
+        for cue_id, cue in enumerate(cues, start=1)
+    )
+    cue = struct.pack('<4sII', b'cue ', 4 + len(cue_points), len(cues)) + cue_points
+
+    labels = []
+    for cue_id, chapter_cue in enumerate(cues, start=1):
+        text = chapter_cue.title.encode('utf-8') + b'\0'
+        label = struct.pack('<4sII', b'labl', 4 + len(text), cue_id) + text
+        # Chunks start on even offsets
+        labels.append(label + b'\0' * (len(label) % 2))
+    adtl = b'adtl' + b''.join(labels)
+    return cue + struct.pack('<4sI', b'LIST', len(adtl)) + adtl
+
+
+def write_book_export(plan: BookExportPlan, output_path: str):
+    """
+    Write a planned export. Memory use is one copy buffer, whatever the length of the book.
+
+    The header, including the chapter markers, is complete before any audio is
+    copied, since the plan already knows every size. The output is written to a
+    temporary file and renamed into place.
+    """
+    markers = cue_chunks(plan.cues)
+    padding = plan.data_size % 2
+    # Checked before the header is built, which cannot hold sizes past 32 bits
+    riff_size = WAV_HEADER_SIZE - 8 + len(markers) + plan.data_size + padding
+    if riff_size > MAX_RIFF_SIZE:
+        limit = plan.duration * (MAX_RIFF_SIZE - (riff_size - plan.data_size)) / plan.data_size
+        raise ValueError(
+            f"Book audio is {plan.duration / 3600:.1f} hours long, but a WAV file holds at most 4 GiB "
+            f"({limit / 3600:.1f} hours in this format); export the book in parts with a chapters list"
+        )
+    header = bytearray(wav_header(plan.data_size, plan.sample_rate, plan.bits_per_sample, plan.num_channels))
+    struct.pack_into('<I', header, 4, riff_size)
+
+    copy_buffer = bytearray(COPY_BLOCK_SIZE)
+    silence_block = memoryview(bytes(COPY_BLOCK_SIZE))
+    temp_path = temp_name(output_path)
+    try:
+        with open(temp_path, 'wb', buffering=0) as out:
+            # fmt chunk, then the markers, then the data chunk header
+            out.write(header[:36] + markers + header[36:])
+            for segment in plan.segments:
+                write_silence(out, segment.silence_before, silence_block)
+                source = read_wav_header(segment.path)
+                if source['data_size'] < segment.data_size:
+                    raise ValueError(f"{segment.path} changed during export")
+                with open(segment.path, 'rb') as src:
+                    copy_file_range(src, out, source['data_offset'], segment.data_size, copy_buffer)
+            out.write(b'\0' * padding)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    os.replace(temp_path, output_path)
+
+
+def export_book(chapters: list[tuple[str, list[str]]], output_path: str, paragraph_silence: float = 1.5,
+                chapter_silence: float = 3.0) -> BookExportPlan:
+    """Join every chapter's paragraph WAVs into `output_path` with a cue point per chapter; returns the plan."""
+    plan = plan_book_export(chapters, paragraph_silence, chapter_silence)
+    write_book_export(plan, output_path)
+    return plan
@@ -0,0 +1,328 @@
+"""Streaming chapter parser for large novels."""
+import bisect
+import codecs
+import io
+import re
+from typing import NamedTuple
+from text_encoding import NON_ASCII, SAMPLE_SIZE, detect_encoding
+
+# Chapter markers: 第 followed by numbers or Chinese numbers, then 章, plus the rest of the line
+# Examples: 第1章, 第一章, 第10章, etc.
+CHAPTER_PATTERN = re.compile(r'(第[0-9一二三四五六七八九十百千万]+章[^\n]*)')
+
+# Paragraphs are separated by blank lines
+PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+LINE_BREAKS = re.compile(r'\n+')
+NON_SPACE = re.compile(r'\S')
+
+# Paragraphs longer than this that contain single newlines are split into lines
+LONG_PARAGRAPH_CHARS = 500
+
+# Bytes read from the upload per step
+BLOCK_SIZE = 1024 * 1024
+
+PREFACE_TITLE = '前言'
+WHOLE_TEXT_TITLE = '全文'
+
+# Codec used to measure byte lengths of decoded text; BOM-handling codecs measure without the BOM
+BYTE_LENGTH_CODECS = {'utf-8-sig': 'utf-8', 'utf-16': 'utf-16-le'}
+
+
+class ChapterMarker(NamedTuple):
+    """A chapter heading found in the text, as char offsets into the text and a byte offset into the upload."""
+    title: str
+    char_start: int
+    body_start: int
+    byte_start: int
+
+
+class Chapter(NamedTuple):
+    """
+    One chapter of a Book, as offsets.
+
+    [char_start, char_end) covers the heading and the body, up to the next
+    chapter; the body starts at body_start. Preface and whole-text chapters
+    have no heading, so body_start == char_start.
+    """
+    title: str
+    char_start: int
+    body_start: int
+    char_end: int
+    byte_start: int
+    byte_end: int
+    has_heading: bool
+
+
+def strip_bounds(text: str, start: int, end: int) -> tuple[int, int]:
+    """Offsets of text[start:end].strip() within `text`, without copying the range."""
+    match = NON_SPACE.search(text, start, end)
+    if match is None:
+        return end, end
+    start = match.start()
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+
+def iter_paragraphs(text: str, start: int = 0, end: int | None = None):
+    """
+    Yield the paragraphs of text[start:end].
+
+    Paragraphs are separated by blank lines; a paragraph over LONG_PARAGRAPH_CHARS
+    characters that still contains single newlines is split into its lines. Only the
+    paragraphs themselves are copied out of `text`.
+    """
+    if end is None:
+        end = len(text)
+    position = start
+    breaks = PARAGRAPH_BREAK.finditer(text, start, end)
+    while position < end:
+        separator = next(breaks, None)
+        piece_end = separator.start() if separator else end
+        para_start, para_end = strip_bounds(text, position, piece_end)
+        position = separator.end() if separator else end
+        if para_start == para_end:
+            continue
+
+        if para_end - para_start > LONG_PARAGRAPH_CHARS and text.find('\n', para_start, para_end) != -1:
+            # Likely several paragraphs separated by single newlines
+            line_start = para_start
+            for line_break in LINE_BREAKS.finditer(text, para_start, para_end):
+                line = text[line_start:line_break.start()].strip()
+                if line:
+                    yield line
+                line_start = line_break.end()
+            line = text[line_start:para_end].strip()
+            if line:
+                yield line
+        else:
+            yield text[para_start:para_end]
+
+
+def detect_stream_encoding(stream, block_size: int = BLOCK_SIZE) -> tuple[str, bytes]:
+    """
+    Detect the encoding of a binary stream from its first non-ASCII bytes.
+
+    Returns (encoding, head): the bytes read for detection must be decoded before
+    the rest of the stream.
+    """
+    head = b''
+    while True:
+        data = stream.read(block_size)
+        head += data
+        match = NON_ASCII.search(head)
+        if not data or (match and len(head) >= match.start() + SAMPLE_SIZE):
+            return detect_encoding(head), head
+
+
+def read_text_blocks(stream, encoding: str, head: bytes = b'', block_size: int = BLOCK_SIZE, errors: str = 'strict'):
+    """
+    Decode `head` and then the rest of a binary stream block by block.
+
+    Yields (text, byte_start) where byte_start is the offset of the first
+    character of `text` from where reading started.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors=errors)
+    consumed = 0
+    while True:
+        data = head or stream.read(block_size)
+        head = b''
+        final = not data
+        # Bytes of a character split across reads come first in this block's text
+        byte_start = consumed - len(decoder.getstate()[0])
+        text = decoder.decode(data, final)
+        if consumed == 0 and encoding in BYTE_LENGTH_CODECS:
+            # A BOM stripped by the codec is not part of the text
+            for bom in (codecs.BOM_UTF8, codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE):
+                if data.startswith(bom):
+                    byte_start += len(bom)
+                    break
+        consumed += len(data)
+        if text:
+            yield text, byte_start
+        if final:
+            break
+
+
+class Book:
+    """
+    Decoded text of an upload plus the offsets of its chapters.
+
+    The text is kept as the decoded blocks it was read in, never joined, so the
+    book costs about one copy of the text. Chapter text and paragraphs are built
+    on demand from the blocks.
+    """
+
+    def __init__(self, encoding: str = 'utf-8'):
+        self.encoding = encoding
+        self.chapters: list[Chapter] = []
+        self.char_length = 0
+        self.byte_length = 0
+        self._blocks: list[str] = []
+        self._block_chars: list[int] = []  # char offset of each block
+        self._block_bytes: list[int] = []  # byte offset of each block
+        self._last_offset = (-1, 0, 0)  # (block, char offset in block, byte offset) of the last lookup
+
+    @classmethod
+    def from_stream(cls, stream, encoding: str | None = None, block_size: int = BLOCK_SIZE) -> 'Book':
+        """
+        Parse a binary stream, detecting its encoding when not given.
+
+        If the stream turns out not to be valid in that encoding past the detection
+        sample, a seekable stream is re-read with invalid bytes replaced.
+        """
+        start = stream.tell() if stream.seekable() else None
+        head = b''
+        if encoding is None:
+            encoding, head = detect_stream_encoding(stream, block_size)
+        try:
+            return cls._parse(read_text_blocks(stream, encoding, head, block_size), encoding)
+        except UnicodeDecodeError as e:
+            if start is None:
+                raise
+            print(f"Warning: text is not entirely {encoding} ({e.reason}), replacing invalid bytes")
+            stream.seek(start)
+            return cls._parse(read_text_blocks(stream, encoding, b'', block_size, 'replace'), encoding)
+
+    @classmethod
+    def from_bytes(cls, data: bytes, encoding: str | None = None) -> 'Book':
+        return cls.from_stream(io.BytesIO(data), encoding)
+
+    @classmethod
+    def from_text(cls, text: str) -> 'Book':
+        """Parse already decoded text; byte offsets are those of its UTF-8 encoding."""
+        return cls._parse([(text, 0)] if text else [], 'utf-8')
+
+    @classmethod
+    def _parse(cls, text_blocks, encoding: str) -> 'Book':
+        book = cls(encoding)
+
+        def blocks():
+            for text, byte_start in text_blocks:
+                book._append_block(text, byte_start)
+                yield text
+
+        markers = list(iter_chapter_markers(blocks(), book._byte_offset))
+        book.byte_length = book._byte_offset(book.char_length) if book._blocks else 0
+        book._index(markers)
+        return book
+
+    def _append_block(self, text: str, byte_start: int):
+        self._block_chars.append(self.char_length)
+        self._block_bytes.append(byte_start)
+        self._blocks.append(text)
+        self.char_length += len(text)
+
+    def _byte_offset(self, char_offset: int) -> int:
+        """
+        Byte offset in the upload of a char offset.
+
+        Measured by re-encoding the text from the start of its block, or from the
+        previous lookup in the same block, so increasing lookups encode the text once.
+        """
+        block = max(bisect.bisect_right(self._block_chars, char_offset) - 1, 0)
+        local = char_offset - self._block_chars[block]
+        last_block, last_local, last_bytes = self._last_offset
+        if last_block != block or last_local > local:
+            last_local, last_bytes = 0, self._block_bytes[block]
+        codec = BYTE_LENGTH_CODECS.get(self.encoding, self.encoding)
+        byte_offset = last_bytes + len(self._blocks[block][last_local:local].encode(codec, 'replace'))
+        self._last_offset = (block, local, byte_offset)
+        return byte_offset
+
+    def _index(self, markers: list[ChapterMarker]):
+        # Where the text starts in the upload, after any BOM
+        byte_start = self._block_bytes[0] if self._blocks else 0
+        if not markers:
+            self.chapters.append(Chapter(WHOLE_TEXT_TITLE, 0, 0, self.char_length, byte_start, self.byte_length, False))
+            return
+
+        if markers[0].char_start > 0:
+            self.chapters.append(Chapter(PREFACE_TITLE, 0, 0, markers[0].char_start, byte_start, markers[0].byte_start,
+                                         False))
+        ends = [(marker.char_start, marker.byte_start) for marker in markers[1:]]
+        ends.append((self.char_length, self.byte_length))
+        for marker, (char_end, byte_end) in zip(markers, ends):
+            self.chapters.append(Chapter(marker.title, marker.char_start, marker.body_start, char_end,
+                                         marker.byte_start, byte_end, True))
+
+    def text(self, start: int = 0, end: int | None = None) -> str:
+        """Return text[start:end], joining only the blocks that overlap the range."""
+        if end is None:
+            end = self.char_length
+        if start >= end:
+            return ''
+        first = bisect.bisect_right(self._block_chars, start) - 1
+        last = bisect.bisect_right(self._block_chars, end - 1) - 1
+        if first == last:
+            offset = self._block_chars[first]
+            return self._blocks[first][start - offset:end - offset]
+        pieces = [self._blocks[first][start - self._block_chars[first]:]]
+        pieces.extend(self._blocks[first + 1:last])
+        pieces.append(self._blocks[last][:end - self._block_chars[last]])
+        return ''.join(pieces)
+
+    def chapter_body(self, index: int) -> tuple[str, int, int]:
+        """Return (text, start, end) such that text[start:end] is the chapter body, copying at most one chapter."""
+        chapter = self.chapters[index]
+        text = self.text(chapter.char_start, chapter.char_end)
+        return text, chapter.body_start - chapter.char_start, len(text)
+
+    def chapter_content(self, index: int) -> str:
+        """The chapter body without its heading, stripped."""
+        text, start, end = self.chapter_body(index)
+        start, end = strip_bounds(text, start, end)
+        return text[start:end]
+
+    def iter_chapter_paragraphs(self, index: int, body: tuple[str, int, int] | None = None):
+        """Yield a chapter's paragraphs. Chapters with a heading, and the preface, start with their title."""
+        chapter = self.chapters[index]
+        if chapter.has_heading or chapter.title == PREFACE_TITLE:
+            yield chapter.title
+        text, start, end = body or self.chapter_body(index)
+        yield from iter_paragraphs(text, start, end)
+
+    def chapter_paragraphs(self, index: int) -> list[str]:
+        return list(self.iter_chapter_paragraphs(index))
+
+    def to_dicts(self) -> list[dict]:
+        """Chapters in the {'title', 'content', 'paragraphs'} form returned by parse_chapters."""
+        chapters = []
+        for index, chapter in enumerate(self.chapters):
+            body = self.chapter_body(index)
+            content_start, content_end = strip_bounds(*body)
+            chapters.append({
+                'title': chapter.title,
+                'content': body[0][content_start:content_end],
+                'paragraphs': list(self.iter_chapter_paragraphs(index, body)),
+            })
+        return chapters
+
+
+def iter_chapter_markers(blocks, byte_offset=None):
+    """
+    Yield a ChapterMarker for every chapter heading in a sequence of text blocks.
+
+    Each block is scanned once. Only the unfinished last line of a block is carried
+    over into the next scan, since a heading always ends at a newline. `byte_offset`
+    maps a char offset to a byte offset in the upload (0 when not given).
+    """
+    carry = ''
+    carry_start = 0
+    blocks = iter(blocks)
+    block = next(blocks, None)
+    while block is not None:
+        following = next(blocks, None)
+        scan = carry + block if carry else block
+        if following is None:
+            cut = len(scan)
+        else:
+            cut = scan.rfind('\n') + 1
+        for match in CHAPTER_PATTERN.finditer(scan, 0, cut):
+            title = match.group(1).strip()
+            char_start = carry_start + match.start()
+            yield ChapterMarker(title, char_start, char_start + len(title),
+                                byte_offset(char_start) if byte_offset else 0)
+        carry = scan[cut:]
+        carry_start += cut
+        block = following
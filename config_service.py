@@ -0,0 +1,149 @@
+"""config.json held in memory: re-read only when the file changes, and written in coalesced batches."""
+import atexit
+import json
+import os
+import threading
+import time
+from types import MappingProxyType
+from coordination import atomic_write, file_lock
+
+# Seconds between checks of config.json's modification time; reads in between do not touch the disk
+CHECK_INTERVAL = 1.0
+
+# Seconds an update waits for further updates before config.json is rewritten
+WRITE_DELAY = 1.0
+
+
+def freeze(value):
+    """Read-only copy of parsed JSON: objects become MappingProxyType, arrays tuples."""
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+class ConfigService:
+    """
+    Parsed configuration, shared by every request as an immutable snapshot.
+
+    snapshot() returns the same MappingProxyType until the configuration changes,
+    so readers (page loads, generation requests, job workers) neither parse JSON
+    nor, for `check_interval` seconds at a time, stat the file. The file is re-read
+    when its mtime, size or inode changes, for example when another worker process
+    or an editor rewrites it. update() publishes changes immediately and writes them
+    `write_delay` seconds later, together with any that arrive in the meantime, by
+    merging them into the file's current contents under `lock_path`.
+    When there is no file, `defaults` stand in for its contents.
+    """
+
+    def __init__(self, path: str, defaults: dict, lock_path: str | None = None,
+                 check_interval: float = CHECK_INTERVAL, write_delay: float = WRITE_DELAY):
+        self.path = path
+        self.defaults = dict(defaults)
+        self.lock_path = lock_path or path + '.lock'
+        self.check_interval = check_interval
+        self.write_delay = write_delay
+        self._file_data = None  # parsed file, or None when there is no file
+        self._signature = None  # (mtime_ns, size, inode) of the file _file_data came from
+        self._pending = {}  # updates not yet written
+        self._snapshot = MappingProxyType({})
+        self._checked = 0.0
+        self._timer = None
+        self._lock = threading.Lock()
+        self._stats = {'reloads': 0, 'updates': 0, 'writes': 0}
+        with self._lock:
+            self._checked = time.monotonic()
+            self._reload_if_changed(force=True)
+        # Updates still waiting for their write are saved on a clean exit
+        atexit.register(self.flush)
+
+    def _stat(self) -> tuple | None:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def _reload_if_changed(self, force: bool = False):
+        """Re-read the file if it changed since it was last read. Call with the lock held."""
+        signature = self._stat()
+        if signature == self._signature and not force:
+            return
+        data = None
+        if signature is not None:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except Exception as e:
+                # Keep serving the last good configuration; the next check tries again
+                print(f"Error loading config: {e}")
+                return
+        self._file_data = data
+        self._signature = signature
+        self._stats['reloads'] += 1
+        self._publish()
+
+    def _publish(self):
+        base = self._file_data if self._file_data is not None else self.defaults
+        self._snapshot = freeze({**base, **self._pending})
+
+    def snapshot(self) -> MappingProxyType:
+        """The current configuration, read-only. Checks the file at most every `check_interval` seconds."""
+        now = time.monotonic()
+        if now - self._checked >= self.check_interval:
+            with self._lock:
+                if now - self._checked >= self.check_interval:
+                    self._checked = now
+                    self._reload_if_changed()
+        return self._snapshot
+
+    def update(self, changes: dict):
+        """Apply `changes` to the snapshot now and to config.json after `write_delay` seconds."""
+        with self._lock:
+            self._pending.update(changes)
+            self._stats['updates'] += 1
+            self._publish()
+            if self._timer is None:
+                self._timer = threading.Timer(self.write_delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """Write pending updates now, merged into whatever config.json holds at this moment."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not self._pending:
+                return
+            pending = dict(self._pending)
+
+        try:
+            with file_lock(self.lock_path):
+                with self._lock:
+                    # Another worker process may have written the file since it was last read
+                    self._reload_if_changed()
+                    data = dict(self._file_data if self._file_data is not None else self.defaults)
+                data.update(pending)
+                with atomic_write(self.path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False, indent=2)
+                signature = self._stat()
+        except Exception as e:
+            # The updates stay pending and are written with the next one
+            print(f"Error saving config: {e}")
+            return
+
+        with self._lock:
+            self._file_data = data
+            self._signature = signature
+            for key, value in pending.items():
+                # Values updated again while the file was being written stay pending
+                if key in self._pending and self._pending[key] is value:
+                    del self._pending[key]
+            self._stats['writes'] += 1
+            self._publish()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, pending=len(self._pending))
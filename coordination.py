@@ -0,0 +1,218 @@
+"""Coordination between worker processes sharing one working directory: file locks, atomic writes and in-flight claims."""
+import asyncio
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS in_flight (
+    key TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    token TEXT NOT NULL,
+    started REAL NOT NULL
+);
+"""
+
+HOSTNAME = socket.gethostname()
+
+
+def process_owner() -> str:
+    """Identify this process across every process sharing the working directory."""
+    return f"{HOSTNAME}:{os.getpid()}"
+
+
+def owner_alive(owner: str) -> bool:
+    """Whether the process named by process_owner() may still be running. Owners on other hosts are assumed alive."""
+    host, _, pid = owner.rpartition(':')
+    if host != HOSTNAME or not pid.isdigit():
+        return True
+    if int(pid) == os.getpid():
+        return True
+    if os.name == 'nt':
+        # os.kill(pid, 0) would send CTRL_C_EVENT on Windows; rely on stale timeouts there
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def temp_name(path: str, suffix: str = '.part') -> str:
+    """
+    A temporary name next to `path` for writing it before os.replace().
+
+    Unique per writer, so two processes (or coroutines) producing the same file never
+    write into each other's temporary file; the last rename wins with a complete file.
+    """
+    return f"{path}.{os.getpid()}-{uuid.uuid4().hex[:8]}{suffix}"
+
+
+def remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+@contextmanager
+def atomic_write(path: str, mode: str = 'wb', **open_args):
+    """Open a temporary file that replaces `path` when the block completes, and is deleted if it raises."""
+    temp = temp_name(path, '.tmp')
+    try:
+        with open(temp, mode, **open_args) as f:
+            yield f
+        os.replace(temp, path)
+    except BaseException:
+        remove_quietly(temp)
+        raise
+
+
+@contextmanager
+def file_lock(path: str):
+    """
+    Hold an exclusive lock on `path` (created if missing) for the duration of the block.
+
+    Every acquisition opens its own descriptor, so the lock excludes other threads
+    of this process as well as other processes. It is not reentrant.
+    """
+    with open(path, 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK gives up after 10 seconds
+                    continue
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class InFlight:
+    """
+    Claims on work in progress, shared by every process using the same SQLite file.
+
+    A worker claims a key (for example the cache key of a synthesis) before doing the
+    work; another worker claiming the same key waits until it is released, then
+    usually finds the result already made. Claims left by a process that died are
+    taken over once its pid is gone, or after `stale_seconds` wherever liveness
+    cannot be checked.
+    """
+
+    def __init__(self, db_path: str, stale_seconds: float = 3600, poll_interval: float = 0.2):
+        self.db_path = db_path
+        self.stale_seconds = stale_seconds
+        self.poll_interval = poll_interval
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._stats = {'claims': 0, 'waits': 0, 'wait_seconds_total': 0.0, 'taken_over': 0}
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            # Claims under our pid were left by an earlier process that had the same pid
+            conn.execute("DELETE FROM in_flight WHERE owner = ?", (process_owner(),))
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def _conn(self) -> sqlite3.Connection:
+        """Return this thread's connection (sqlite3 connections are not shared across threads)."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def try_claim(self, key: str) -> str | None:
+        """Claim `key` and return a token for release(), or None while another live claim holds it."""
+        conn = self._conn()
+        now = time.time()
+        token = uuid.uuid4().hex
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute("SELECT owner, started FROM in_flight WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                owner, started = row
+                if owner_alive(owner) and now - started < self.stale_seconds:
+                    return None
+                print(f"Taking over in-flight claim on {key} from {owner}")
+                with self._stats_lock:
+                    self._stats['taken_over'] += 1
+            conn.execute(
+                "INSERT OR REPLACE INTO in_flight (key, owner, token, started) VALUES (?, ?, ?, ?)",
+                (key, process_owner(), token, now)
+            )
+        with self._stats_lock:
+            self._stats['claims'] += 1
+        return token
+
+    def release(self, key: str, token: str):
+        self._conn().execute("DELETE FROM in_flight WHERE key = ? AND token = ?", (key, token))
+
+    def _waited(self, started: float):
+        with self._stats_lock:
+            self._stats['waits'] += 1
+            self._stats['wait_seconds_total'] += time.monotonic() - started
+
+    @contextmanager
+    def claim(self, key: str):
+        """Hold the claim on `key` for the block, waiting first while someone else holds it."""
+        token = self.try_claim(key)
+        if token is None:
+            started = time.monotonic()
+            while token is None:
+                time.sleep(self.poll_interval)
+                token = self.try_claim(key)
+            self._waited(started)
+        try:
+            yield
+        finally:
+            self.release(key, token)
+
+    @asynccontextmanager
+    async def aclaim(self, key: str):
+        """Async counterpart of claim(); SQLite work runs on a worker thread and waiting does not block the loop."""
+        token = await asyncio.to_thread(self.try_claim, key)
+        if token is None:
+            started = time.monotonic()
+            while token is None:
+                await asyncio.sleep(self.poll_interval)
+                token = await asyncio.to_thread(self.try_claim, key)
+            self._waited(started)
+        try:
+            yield
+        finally:
+            await asyncio.to_thread(self.release, key, token)
+
+    def held(self) -> int:
+        """Claims currently held by any process."""
+        return self._conn().execute("SELECT COUNT(*) FROM in_flight").fetchone()[0]
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['held'] = self.held()
+        return stats
@@ -0,0 +1,209 @@
+"""Parsed uploads kept on the server under a content hash, so they are decoded and parsed once."""
+import hashlib
+import itertools
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from book_parser import Book, BLOCK_SIZE
+from coordination import atomic_write
+
+DOC_ID_PATTERN = re.compile(r'^[0-9a-f]{24}$')
+
+
+class Document:
+    """A parsed upload: the Book plus the per-chapter paragraph counts of its table of contents."""
+
+    def __init__(self, doc_id: str, filename: str, book: Book, paragraph_counts: list[int] | None = None):
+        self.doc_id = doc_id
+        self.filename = filename
+        self.book = book
+        self.created = time.time()
+        if paragraph_counts is None:
+            paragraph_counts = [
+                sum(1 for _ in book.iter_chapter_paragraphs(index)) for index in range(len(book.chapters))
+            ]
+        self.paragraph_counts = paragraph_counts
+
+    def toc(self) -> dict:
+        """Compact table of contents: chapter titles and paragraph counts, no text."""
+        return {
+            'doc_id': self.doc_id,
+            'filename': self.filename,
+            'encoding': self.book.encoding,
+            'total_paragraphs': sum(self.paragraph_counts),
+            'chapters': [
+                {'index': index, 'title': chapter.title, 'paragraph_count': count}
+                for index, (chapter, count) in enumerate(zip(self.book.chapters, self.paragraph_counts))
+            ],
+        }
+
+    def chapter(self, index: int):
+        """Return the Chapter at `index`, raising LookupError for an unknown index."""
+        if not 0 <= index < len(self.book.chapters):
+            raise LookupError(f'Chapter {index} not found')
+        return self.book.chapters[index]
+
+    def paragraphs(self, chapter_index: int, offset: int = 0, limit: int | None = None) -> list[str]:
+        """Paragraphs [offset, offset + limit) of a chapter; only that page is materialized."""
+        self.chapter(chapter_index)
+        paragraphs = self.book.iter_chapter_paragraphs(chapter_index)
+        stop = None if limit is None else offset + limit
+        return list(itertools.islice(paragraphs, offset, stop))
+
+    def paragraph(self, chapter_index: int, paragraph_index: int) -> str:
+        """One paragraph of a chapter (0-based, as numbered in the table of contents)."""
+        page = self.paragraphs(chapter_index, paragraph_index, 1) if paragraph_index >= 0 else []
+        if not page:
+            raise LookupError(f'Paragraph {paragraph_index} of chapter {chapter_index} not found')
+        return page[0]
+
+    def chapter_text(self, chapter_index: int) -> str:
+        """Text read for a whole chapter: the title, then all paragraphs (which start with the title again)."""
+        chapter = self.chapter(chapter_index)
+        return chapter.title + '\n\n' + '\n\n'.join(self.book.iter_chapter_paragraphs(chapter_index))
+
+
+def hash_stream(stream, block_size: int = BLOCK_SIZE) -> str:
+    """sha256 of a seekable binary stream from its current position; the position is restored."""
+    start = stream.tell()
+    digest = hashlib.sha256()
+    while True:
+        data = stream.read(block_size)
+        if not data:
+            break
+        digest.update(data)
+    stream.seek(start)
+    return digest.hexdigest()
+
+
+class DocumentStore:
+    """
+    LRU of parsed uploads keyed by the hash of their bytes, spilled to disk.
+
+    The most recently used `max_documents` are held in memory. Every upload is
+    also written to `directory` (raw bytes plus a small JSON with the detected
+    encoding and paragraph counts), so documents dropped from memory, or from a
+    previous run, are reloaded without re-detecting or re-counting anything.
+    At most `max_spilled` uploads are kept on disk, least recently used first out.
+    Uploading the same file again returns the existing document.
+    """
+
+    def __init__(self, directory: str, max_documents: int = 8, max_spilled: int = 100):
+        self.directory = directory
+        self.max_documents = max(1, int(max_documents))
+        self.max_spilled = max(self.max_documents, int(max_spilled))
+        self._documents = OrderedDict()  # doc_id -> Document, least recently used first
+        self._lock = threading.Lock()
+        self._stats = {
+            'uploads': 0,
+            'parsed': 0,
+            'parse_seconds_total': 0.0,
+            'loaded_from_disk': 0,
+            'evicted': 0,
+        }
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, doc_id: str) -> tuple[str, str]:
+        base = os.path.join(self.directory, doc_id)
+        return base + '.txt', base + '.json'
+
+    def add_upload(self, stream, filename: str = '') -> Document:
+        """Parse an uploaded file (a seekable binary stream) unless an identical one is already stored."""
+        doc_id = hash_stream(stream)[:24]
+        with self._lock:
+            self._stats['uploads'] += 1
+        document = self.get(doc_id)
+        if document is not None:
+            return document
+
+        start = time.perf_counter()
+        position = stream.tell()
+        document = Document(doc_id, filename, Book.from_stream(stream))
+        elapsed = time.perf_counter() - start
+        stream.seek(position)
+        self._spill(document, stream)
+        with self._lock:
+            self._stats['parsed'] += 1
+            self._stats['parse_seconds_total'] += elapsed
+        self._remember(document)
+        return document
+
+    def get(self, doc_id: str) -> Document | None:
+        """Return a document from memory, or from disk if it was spilled; None if unknown."""
+        with self._lock:
+            document = self._documents.get(doc_id)
+            if document is not None:
+                self._documents.move_to_end(doc_id)
+                return document
+        if not DOC_ID_PATTERN.match(doc_id or ''):
+            return None
+        return self._load(doc_id)
+
+    def _remember(self, document: Document):
+        with self._lock:
+            self._documents[document.doc_id] = document
+            self._documents.move_to_end(document.doc_id)
+            while len(self._documents) > self.max_documents:
+                # Still on disk; reloaded on the next request for it
+                self._documents.popitem(last=False)
+                self._stats['evicted'] += 1
+
+    def _spill(self, document: Document, stream):
+        text_path, meta_path = self._paths(document.doc_id)
+        with atomic_write(text_path) as f:
+            shutil.copyfileobj(stream, f, BLOCK_SIZE)
+
+        meta = {
+            'filename': document.filename,
+            'encoding': document.book.encoding,
+            'paragraph_counts': document.paragraph_counts,
+            'created': document.created,
+        }
+        with atomic_write(meta_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        self._prune()
+
+    def _load(self, doc_id: str) -> Document | None:
+        text_path, meta_path = self._paths(doc_id)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            with open(text_path, 'rb') as f:
+                book = Book.from_stream(f, meta['encoding'])
+            os.utime(meta_path)
+        except (OSError, ValueError, KeyError) as e:
+            if not isinstance(e, FileNotFoundError):
+                print(f"Error loading document {doc_id}: {e}")
+            return None
+
+        document = Document(doc_id, meta.get('filename', ''), book, meta.get('paragraph_counts'))
+        with self._lock:
+            self._stats['loaded_from_disk'] += 1
+        self._remember(document)
+        return document
+
+    def _prune(self):
+        """Drop the least recently used spilled documents beyond max_spilled."""
+        spilled = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.endswith('.json'):
+                    spilled.append((entry.stat().st_mtime, entry.name[:-len('.json')]))
+        spilled.sort()
+        for _, doc_id in spilled[:max(0, len(spilled) - self.max_spilled)]:
+            for path in self._paths(doc_id):
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    print(f"Error removing spilled document {path}: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['documents_in_memory'] = len(self._documents)
+            stats['characters_in_memory'] = sum(document.book.char_length for document in self._documents.values())
+        return stats
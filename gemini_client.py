@@ -0,0 +1,233 @@
+"""Process-wide pool of warm Gemini clients shared by every TTS call."""
+import asyncio
+import itertools
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+import httpx
+from google import genai
+from google.genai import types
+
+try:
+    # google-genai sends async calls through aiohttp instead of httpx when it is installed
+    import aiohttp  # noqa: F401
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    AIOHTTP_AVAILABLE = False
+
+# Bursts allowed by the token buckets, in seconds of quota. Small, so that any 60 second
+# window stays close to the per-minute quota.
+BURST_SECONDS = 5.0
+
+# Connections each client's async HTTP pool may open, so hundreds of concurrent async calls do not queue on it
+ASYNC_MAX_CONNECTIONS = 512
+
+
+class TokenBucket:
+    """Continuously refilled bucket of `per_minute` units; callers reserve units and wait off any debt."""
+
+    def __init__(self, per_minute: float, burst_seconds: float = BURST_SECONDS):
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self._level = self.capacity
+        self._updated = time.monotonic()
+
+    def reserve(self, amount: float, now: float) -> float:
+        """Take `amount` units (the level may go negative) and return how long until they are covered."""
+        self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+        self._updated = now
+        self._level -= amount
+        return -self._level / self.rate if self._level < 0 else 0.0
+
+
+class RateLimiter:
+    """Per-key token buckets for the account's requests-per-minute and tokens-per-minute quotas.
+
+    Each key gets a bucket of `requests_per_minute` requests and one of
+    `tokens_per_minute` tokens. Reservations are made before sleeping, so
+    concurrent callers queue up behind each other instead of all waking at once.
+    A value of 0 (or less) disables that limit.
+    """
+
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._buckets = {}  # key -> (request bucket or None, token bucket or None)
+        self._paused_until = {}  # key -> monotonic time
+        self._lock = threading.Lock()
+
+    def _key_buckets(self, key: str) -> tuple:
+        buckets = self._buckets.get(key)
+        if buckets is None:
+            buckets = self._buckets[key] = (
+                TokenBucket(self.requests_per_minute) if self.requests_per_minute and self.requests_per_minute > 0 else None,
+                TokenBucket(self.tokens_per_minute) if self.tokens_per_minute and self.tokens_per_minute > 0 else None,
+            )
+        return buckets
+
+    def acquire(self, key: str = '', tokens: int = 0) -> float:
+        """Block until `key` may make another request of `tokens` tokens. Returns seconds waited."""
+        wait = self.reserve(key, tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def reserve(self, key: str = '', tokens: int = 0) -> float:
+        """Reserve a request of `tokens` tokens for `key` and return how long the caller must wait before sending it."""
+        with self._lock:
+            now = time.monotonic()
+            requests, token_bucket = self._key_buckets(key)
+            wait = max(0.0, self._paused_until.get(key, 0.0) - now)
+            if requests is not None:
+                wait = max(wait, requests.reserve(1, now))
+            if token_bucket is not None and tokens:
+                wait = max(wait, token_bucket.reserve(tokens, now))
+        return wait
+
+    def pause(self, key: str, seconds: float):
+        """Hold back requests for `key` for the next `seconds` (e.g. after the API answered 429)."""
+        with self._lock:
+            until = time.monotonic() + seconds
+            self._paused_until[key] = max(self._paused_until.get(key, 0.0), until)
+
+
+class ClientLease:
+    """A client handed out by ClientPool.acquire()."""
+
+    def __init__(self, client, api_key: str):
+        self.client = client
+        self.api_key = api_key
+
+
+class ClientPool:
+    """
+    Keep one long-lived genai.Client per API key and rotate between keys.
+
+    A genai.Client owns an httpx connection pool, so reusing it keeps TLS
+    sessions and HTTP connections warm between calls. httpx clients are
+    thread-safe, so a single client per key can serve every worker thread.
+    """
+
+    def __init__(self, api_keys: list[str], rate_limiter: RateLimiter | None = None,
+                 http_options: types.HttpOptions | None = None, client_factory=None):
+        # De-duplicate while keeping the configured order
+        self.api_keys = [key for key in dict.fromkeys(api_keys) if key]
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.http_options = http_options
+        self._client_factory = client_factory or self._create_client
+        self._clients = {}
+        self._rotation = itertools.cycle(self.api_keys) if self.api_keys else None
+        self._lock = threading.Lock()
+        self._stats = {
+            'acquisitions': 0,
+            'clients_created': 0,
+            'client_reuses': 0,
+            'acquire_seconds_total': 0.0,
+            'acquire_seconds_max': 0.0,
+            'throttle_seconds_total': 0.0,
+            'http_requests': 0,
+            'http_connections_opened': 0,
+        }
+
+    def _create_client(self, api_key: str):
+        options = self.http_options.model_copy() if self.http_options else types.HttpOptions()
+        client_args = dict(options.client_args or {})
+        hooks = dict(client_args.get('event_hooks') or {})
+        hooks['request'] = list(hooks.get('request', [])) + [self._on_http_request]
+        client_args['event_hooks'] = hooks
+        options.client_args = client_args
+        async_client_args = dict(options.async_client_args or {})
+        if self._async_uses_httpx(options, async_client_args):
+            # Only httpx understands `limits`; aiohttp.ClientSession would reject it
+            async_client_args.setdefault('limits', httpx.Limits(max_connections=ASYNC_MAX_CONNECTIONS,
+                                                                max_keepalive_connections=ASYNC_MAX_CONNECTIONS))
+        options.async_client_args = async_client_args
+        return genai.Client(api_key=api_key, http_options=options)
+
+    @staticmethod
+    def _async_uses_httpx(options: types.HttpOptions, async_client_args: dict) -> bool:
+        """Whether genai.Client will make async calls with httpx (the same test google-genai applies)."""
+        return (not AIOHTTP_AVAILABLE or async_client_args.get('transport') is not None
+                or options.httpx_async_client is not None)
+
+    def _on_http_request(self, request):
+        """httpx request hook: count requests and trace new TCP connections."""
+        with self._lock:
+            self._stats['http_requests'] += 1
+        request.extensions['trace'] = self._trace
+
+    def _trace(self, event_name, info):
+        if event_name == 'connection.connect_tcp.complete':
+            with self._lock:
+                self._stats['http_connections_opened'] += 1
+
+    def _checkout(self) -> tuple[str, object, float]:
+        """Pick the next API key and its client; returns (api_key, client, seconds taken)."""
+        if self._rotation is None:
+            raise Exception('No Gemini API key configured')
+
+        start = time.perf_counter()
+        with self._lock:
+            api_key = next(self._rotation)
+            client = self._clients.get(api_key)
+            if client is None:
+                client = self._client_factory(api_key)
+                self._clients[api_key] = client
+                self._stats['clients_created'] += 1
+            else:
+                self._stats['client_reuses'] += 1
+            self._stats['acquisitions'] += 1
+        return api_key, client, time.perf_counter() - start
+
+    def _record_acquire(self, elapsed: float, throttled: float):
+        with self._lock:
+            self._stats['acquire_seconds_total'] += elapsed
+            self._stats['acquire_seconds_max'] = max(self._stats['acquire_seconds_max'], elapsed)
+            self._stats['throttle_seconds_total'] += throttled
+
+    @contextmanager
+    def acquire(self, tokens: int = 0):
+        """
+        Yield a ClientLease for the next API key in rotation.
+
+        Blocks for the key's rate limits (a request of `tokens` tokens) before yielding.
+        """
+        api_key, client, elapsed = self._checkout()
+        throttled = self.rate_limiter.acquire(api_key, tokens)
+        self._record_acquire(elapsed, throttled)
+        yield ClientLease(client, api_key)
+
+    @asynccontextmanager
+    async def acquire_async(self, tokens: int = 0):
+        """Like acquire(), but waits for the rate limits without blocking the event loop."""
+        api_key, client, elapsed = self._checkout()
+        throttled = self.rate_limiter.reserve(api_key, tokens)
+        if throttled > 0:
+            await asyncio.sleep(throttled)
+        self._record_acquire(elapsed, throttled)
+        yield ClientLease(client, api_key)
+
+    def stats(self) -> dict:
+        """Return a snapshot of pool usage counters."""
+        with self._lock:
+            stats = dict(self._stats)
+        acquisitions = stats['acquisitions']
+        requests = stats['http_requests']
+        stats['api_keys'] = len(self.api_keys)
+        stats['client_reuse_ratio'] = stats['client_reuses'] / acquisitions if acquisitions else 0.0
+        stats['connection_reuse_ratio'] = (
+            1 - stats['http_connections_opened'] / requests if requests else 0.0
+        )
+        stats['acquire_seconds_avg'] = stats['acquire_seconds_total'] / acquisitions if acquisitions else 0.0
+        return stats
+
+    def close(self):
+        """Close every pooled client and its connections."""
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            try:
+                client.close()
+            except Exception as e:
+                print(f"Error closing Gemini client: {e}")
@@ -0,0 +1,259 @@
+"""Persistent background job queue backed by a local SQLite database."""
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from coordination import owner_alive, process_owner
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    title TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS job_items (
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    owner TEXT,
+    updated REAL NOT NULL,
+    PRIMARY KEY (job_id, seq)
+);
+CREATE INDEX IF NOT EXISTS job_items_status ON job_items (status);
+"""
+
+# Job states: queued -> running -> completed | failed | cancelled
+# Item states: pending -> running -> done | failed | cancelled
+TERMINAL_JOB_STATES = ('completed', 'failed', 'cancelled')
+
+# Longest wait between retries after a database error (e.g. "database is locked" under contention)
+MAX_ERROR_BACKOFF = 30.0
+
+
+class JobQueue:
+    """
+    Queue of jobs, each made of independent items, processed by worker threads.
+
+    Every state change is committed to SQLite, so a restart only loses the items
+    that were running at the time; those are put back to pending on start().
+    Several processes can share one database: items are claimed atomically, and
+    start() only requeues items whose owning process is gone.
+    Handlers are looked up by job kind and must be idempotent: they are expected
+    to skip work whose output already exists.
+    """
+
+    def __init__(self, db_path: str, workers: int = 2, poll_interval: float = 0.5):
+        self.db_path = db_path
+        self.workers = max(1, int(workers))
+        self.poll_interval = poll_interval
+        self._handlers = {}
+        self._threads = []
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def _conn(self) -> sqlite3.Connection:
+        """Return this thread's connection (sqlite3 connections are not shared across threads)."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def register(self, kind: str, handler):
+        """Register `handler(payload: dict) -> str` for items of jobs of `kind`."""
+        self._handlers[kind] = handler
+
+    def start(self):
+        """Requeue items interrupted by a process that exited and start the worker threads."""
+        if self._threads:
+            return
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            running = conn.execute("SELECT job_id, seq, owner FROM job_items WHERE status = 'running'").fetchall()
+            # Items under our own owner name were left by an earlier process that had the same pid
+            orphans = [(now, row['job_id'], row['seq']) for row in running
+                       if row['owner'] is None or row['owner'] == process_owner() or not owner_alive(row['owner'])]
+            conn.executemany("UPDATE job_items SET status = 'pending', updated = ? WHERE job_id = ? AND seq = ?", orphans)
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f'job-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stopping.set()
+        self._wakeup.set()
+
+    def submit(self, kind: str, title: str, payloads: list[dict]) -> str:
+        """Create a job with one item per payload and return its id."""
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute('BEGIN')
+            conn.execute(
+                "INSERT INTO jobs (id, kind, title, status, created, updated) VALUES (?, ?, ?, 'queued', ?, ?)",
+                (job_id, kind, title, now, now)
+            )
+            conn.executemany(
+                "INSERT INTO job_items (job_id, seq, payload, status, updated) VALUES (?, ?, ?, 'pending', ?)",
+                [(job_id, seq, json.dumps(payload, ensure_ascii=False), now) for seq, payload in enumerate(payloads)]
+            )
+        self._wakeup.set()
+        return job_id
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel pending items of a job. Items already running are allowed to finish."""
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute('BEGIN')
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'cancelled', updated = ? WHERE id = ? AND status NOT IN (?, ?, ?)",
+                (now, job_id) + TERMINAL_JOB_STATES
+            )
+            conn.execute(
+                "UPDATE job_items SET status = 'cancelled', updated = ? WHERE job_id = ? AND status = 'pending'",
+                (now, job_id)
+            )
+        return cursor.rowcount > 0
+
+    def get(self, job_id: str, include_items: bool = False) -> dict | None:
+        """Return job status with per-state item counts, or None if unknown."""
+        conn = self._conn()
+        job = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if job is None:
+            return None
+        counts = dict(conn.execute(
+            "SELECT status, COUNT(*) FROM job_items WHERE job_id = ? GROUP BY status", (job_id,)
+        ).fetchall())
+        total = sum(counts.values())
+        finished = counts.get('done', 0) + counts.get('failed', 0) + counts.get('cancelled', 0)
+        result = {
+            'id': job['id'],
+            'kind': job['kind'],
+            'title': job['title'],
+            'status': job['status'],
+            'created': job['created'],
+            'updated': job['updated'],
+            'total': total,
+            'done': counts.get('done', 0),
+            'failed': counts.get('failed', 0),
+            'running': counts.get('running', 0),
+            'pending': counts.get('pending', 0),
+            'progress': finished / total if total else 1.0,
+        }
+        if include_items:
+            result['items'] = [
+                {'seq': row['seq'], 'status': row['status'], 'result': row['result'], 'error': row['error']}
+                for row in conn.execute(
+                    "SELECT seq, status, result, error FROM job_items WHERE job_id = ? ORDER BY seq", (job_id,)
+                )
+            ]
+        return result
+
+    def list_jobs(self, limit: int = 50) -> list[dict]:
+        rows = self._conn().execute("SELECT id FROM jobs ORDER BY created DESC LIMIT ?", (limit,)).fetchall()
+        return [self.get(row['id']) for row in rows]
+
+    def _claim(self):
+        """Atomically move the oldest pending item to running. Returns (job_id, seq, kind, payload) or None."""
+        conn = self._conn()
+        now = time.time()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                "SELECT i.job_id, i.seq, i.payload, j.kind FROM job_items i JOIN jobs j ON j.id = i.job_id "
+                "WHERE i.status = 'pending' ORDER BY j.created, i.seq LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE job_items SET status = 'running', attempts = attempts + 1, owner = ?, updated = ? "
+                "WHERE job_id = ? AND seq = ?",
+                (process_owner(), now, row['job_id'], row['seq'])
+            )
+            conn.execute(
+                "UPDATE jobs SET status = 'running', updated = ? WHERE id = ? AND status = 'queued'",
+                (now, row['job_id'])
+            )
+        return row['job_id'], row['seq'], row['kind'], json.loads(row['payload'])
+
+    def _finish(self, job_id: str, seq: int, status: str, result: str | None = None, error: str | None = None):
+        conn = self._conn()
+        now = time.time()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(
+                "UPDATE job_items SET status = ?, result = ?, error = ?, updated = ? WHERE job_id = ? AND seq = ?",
+                (status, result, error, now, job_id, seq)
+            )
+            counts = dict(conn.execute(
+                "SELECT status, COUNT(*) FROM job_items WHERE job_id = ? GROUP BY status", (job_id,)
+            ).fetchall())
+            if not counts.get('pending') and not counts.get('running'):
+                # A job only fails when nothing succeeded, matching the skip-on-failure behavior of the endpoints
+                final = 'completed' if counts.get('done') else 'failed'
+                conn.execute(
+                    "UPDATE jobs SET status = ?, updated = ? WHERE id = ? AND status != 'cancelled'",
+                    (final, now, job_id)
+                )
+            else:
+                conn.execute("UPDATE jobs SET updated = ? WHERE id = ?", (now, job_id))
+
+    def _worker(self):
+        backoff = self.poll_interval
+        while not self._stopping.is_set():
+            try:
+                claimed = self._claim()
+            except sqlite3.Error as e:
+                print(f"Job queue error claiming an item: {e}, retrying in {backoff:.1f}s")
+                self._stopping.wait(backoff)
+                backoff = min(backoff * 2, MAX_ERROR_BACKOFF)
+                continue
+            backoff = self.poll_interval
+            if claimed is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            job_id, seq, kind, payload = claimed
+            try:
+                outcome = {'status': 'done', 'result': self._handlers[kind](payload)}
+            except Exception as e:
+                print(f"Error in job {job_id} item {seq}: {e}")
+                outcome = {'status': 'failed', 'error': str(e)}
+            self._record(job_id, seq, **outcome)
+
+    def _record(self, job_id: str, seq: int, status: str, result: str | None = None, error: str | None = None):
+        """_finish() an item, retrying with backoff until the database takes it; the item's work is not redone."""
+        backoff = self.poll_interval
+        while True:
+            try:
+                self._finish(job_id, seq, status, result, error)
+                return
+            except sqlite3.Error as e:
+                print(f"Job queue error recording job {job_id} item {seq}: {e}, retrying in {backoff:.1f}s")
+            if self._stopping.wait(backoff):
+                # Left running; start() requeues it once this process is gone
+                return
+            backoff = min(backoff * 2, MAX_ERROR_BACKOFF)
@@ -0,0 +1,160 @@
+"""In-process metrics (counters and histograms) rendered in the Prometheus text format."""
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Bucket upper bounds shared by most histograms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+BYTES_BUCKETS = tuple(16 * 1024 * 4 ** i for i in range(9))  # 16 KiB .. 1 GiB
+THROUGHPUT_BUCKETS = tuple(1024 * 1024 * 4 ** i for i in range(8))  # 1 MiB/s .. 16 GiB/s
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+class Counter:
+    """A monotonically increasing count, optionally split by label values. Names end in _total."""
+
+    type = 'counter'
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Histogram:
+    """
+    Observations counted into cumulative buckets, with their sum and count.
+
+    Observing is a bisect and three additions under a lock, cheap enough for
+    every chunk of a stream.
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name: str, help_text: str, buckets: tuple = LATENCY_BUCKETS, labelnames: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        self._series = {}  # label values -> [bucket counts..., +Inf count], sum
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the seconds spent in the `with` block, whether or not it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            series = {key: (list(counts), total) for key, (counts, total) in self._series.items()}
+        for key, (counts, total) in sorted(series.items()):
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield self.name + '_bucket', dict(labels, le=format_value(bound)), cumulative
+            yield self.name + '_sum', labels, total
+            yield self.name + '_count', labels, cumulative
+
+
+class MetricsRegistry:
+    """
+    Named counters and histograms, plus collectors that turn existing stats() into samples.
+
+    A collector is called on every scrape and returns (name, type, help, value)
+    tuples, so counts the components already keep (cache hits, retries, ...) are
+    exported without being counted twice.
+    """
+
+    def __init__(self, prefix: str = ''):
+        self.prefix = prefix
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help_text: str, labelnames: tuple = ()) -> Counter:
+        return self._register(Counter(self.prefix + name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, buckets: tuple = LATENCY_BUCKETS, labelnames: tuple = ()) -> Histogram:
+        return self._register(Histogram(self.prefix + name, help_text, buckets, labelnames))
+
+    def register_collector(self, collect):
+        """Add a callable returning (name, type, help, value) tuples for each scrape."""
+        with self._lock:
+            self._collectors.append(collect)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+        for collect in collectors:
+            try:
+                collected = list(collect())
+            except Exception as e:
+                print(f"Error collecting metrics: {e}")
+                continue
+            for name, metric_type, help_text, value in collected:
+                name = self.prefix + name
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {metric_type}')
+                lines.append(f'{name} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,242 @@
+"""In-memory index of OUTPUT_DIR, kept current with inotify or polling."""
+import ctypes
+import ctypes.util
+import os
+import re
+import stat
+import struct
+import sys
+import threading
+import time
+from wav_utils import read_wav_header
+
+# {safe_title}_{NNN}.wav paragraph files
+PARAGRAPH_FILE_PATTERN = re.compile(r'^(?P<chapter>.+)_(?P<index>\d{3,})\.wav$')
+
+# Suffixes of files that are still being written
+TEMPORARY_SUFFIXES = ('.part', '.tmp')
+
+# inotify event masks (see inotify(7))
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+def parse_output_name(filename: str) -> tuple[str, int | None]:
+    """Split an output filename into (chapter, paragraph index); index is None for non-paragraph files."""
+    match = PARAGRAPH_FILE_PATTERN.match(filename)
+    if match:
+        return match.group('chapter'), int(match.group('index'))
+    return os.path.splitext(filename)[0], None
+
+
+class OutputIndex:
+    """
+    filename -> {size, mtime, chapter, paragraph, duration} map of an output directory.
+
+    Built once with os.scandir, then updated from inotify events on Linux or by a
+    periodic rescan elsewhere. Writers in this process should also call refresh()
+    after finishing a file so readers see it immediately. Durations are read from
+    WAV headers on first use and remembered until the file changes.
+    """
+
+    def __init__(self, directory: str, poll_interval: float = 5.0):
+        self.directory = directory
+        self.poll_interval = poll_interval
+        self._entries = {}
+        self._paragraphs = {}  # chapter -> {paragraph index: filename}
+        self._lock = threading.Lock()
+        self._thread = None
+        self.mode = None
+        self._stats = {
+            'rescans': 0,
+            'rescan_seconds_last': 0.0,
+            'rescan_seconds_total': 0.0,
+            'events': 0,
+            'refreshes': 0,
+        }
+        self.rescan()
+
+    def start(self):
+        """Start watching the directory for changes."""
+        if self._thread is not None:
+            return
+        fd = self._inotify_init() if sys.platform.startswith('linux') else None
+        if fd is not None:
+            self.mode = 'inotify'
+            self._thread = threading.Thread(target=self._watch_inotify, args=(fd,), name='output-index', daemon=True)
+        else:
+            self.mode = 'polling'
+            self._thread = threading.Thread(target=self._watch_polling, name='output-index', daemon=True)
+        self._thread.start()
+
+    def rescan(self):
+        """Rebuild the whole index from one directory listing."""
+        start = time.perf_counter()
+        entries = {}
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if entry.name.endswith(TEMPORARY_SUFFIXES) or not entry.is_file():
+                    continue
+                entries[entry.name] = self._make_entry(entry.name, entry.stat(), self._entries.get(entry.name))
+        paragraphs = {}
+        for name, entry in entries.items():
+            if entry['paragraph'] is not None:
+                paragraphs.setdefault(entry['chapter'], {})[entry['paragraph']] = name
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._entries = entries
+            self._paragraphs = paragraphs
+            self._stats['rescans'] += 1
+            self._stats['rescan_seconds_last'] = elapsed
+            self._stats['rescan_seconds_total'] += elapsed
+
+    def refresh(self, filename: str):
+        """Re-stat one file (by name or path) and update or drop its entry."""
+        name = os.path.basename(filename)
+        if name.endswith(TEMPORARY_SUFFIXES):
+            return
+        try:
+            stat_result = os.stat(os.path.join(self.directory, name))
+        except OSError:
+            stat_result = None
+        with self._lock:
+            self._stats['refreshes'] += 1
+            previous = self._entries.pop(name, None)
+            if previous and previous['paragraph'] is not None:
+                chapter_files = self._paragraphs.get(previous['chapter'], {})
+                chapter_files.pop(previous['paragraph'], None)
+                if not chapter_files:
+                    self._paragraphs.pop(previous['chapter'], None)
+            if stat_result is None or not stat.S_ISREG(stat_result.st_mode):
+                return
+            entry = self._make_entry(name, stat_result, previous)
+            self._entries[name] = entry
+            if entry['paragraph'] is not None:
+                self._paragraphs.setdefault(entry['chapter'], {})[entry['paragraph']] = name
+
+    @staticmethod
+    def _make_entry(name: str, stat_result, previous: dict | None) -> dict:
+        chapter, paragraph = parse_output_name(name)
+        entry = {
+            'size': stat_result.st_size,
+            'mtime': stat_result.st_mtime,
+            'mtime_ns': stat_result.st_mtime_ns,
+            'chapter': chapter,
+            'paragraph': paragraph,
+            'duration': None,
+        }
+        # Keep a known duration if the file has not changed
+        if previous and previous['mtime_ns'] == entry['mtime_ns'] and previous['size'] == entry['size']:
+            entry['duration'] = previous['duration']
+        return entry
+
+    def get(self, filename: str) -> dict | None:
+        with self._lock:
+            entry = self._entries.get(filename)
+            return dict(entry) if entry else None
+
+    def paragraph_files(self, chapter: str) -> dict[int, str]:
+        """Return {paragraph index: filename} for a sanitized chapter title."""
+        with self._lock:
+            return dict(self._paragraphs.get(chapter, {}))
+
+    def duration(self, filename: str) -> float | None:
+        """Duration in seconds of a WAV file, read from its header on first use."""
+        entry = self.get(filename)
+        if entry is None or not filename.endswith('.wav'):
+            return None
+        if entry['duration'] is None:
+            try:
+                header = read_wav_header(os.path.join(self.directory, filename))
+                entry['duration'] = header['data_size'] / header['byte_rate'] if header['byte_rate'] else 0.0
+            except (OSError, ValueError, struct.error):
+                return None
+            with self._lock:
+                current = self._entries.get(filename)
+                if current and current['mtime_ns'] == entry['mtime_ns']:
+                    current['duration'] = entry['duration']
+        return entry['duration']
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = sum(entry['size'] for entry in self._entries.values())
+        stats['mode'] = self.mode
+        return stats
+
+    def _inotify_init(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = libc.inotify_init1(os.O_CLOEXEC)
+            if fd < 0:
+                return None
+            mask = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+            if libc.inotify_add_watch(fd, os.fsencode(self.directory), mask) < 0:
+                os.close(fd)
+                return None
+        except (OSError, AttributeError) as e:
+            print(f"inotify unavailable, polling {self.directory} instead: {e}")
+            return None
+        # The index may have missed files written between the first scan and the watch
+        self.rescan()
+        return fd
+
+    def _watch_inotify(self, fd: int):
+        while True:
+            try:
+                data = os.read(fd, 64 * 1024)
+            except OSError as e:
+                print(f"inotify read failed, polling {self.directory} instead: {e}")
+                break
+
+            changed = set()
+            offset = 0
+            events = 0
+            lost_watch = False
+            while offset < len(data):
+                wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(data, offset)
+                name = data[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + length].rstrip(b'\0')
+                offset += INOTIFY_EVENT.size + length
+                events += 1
+                if mask & IN_Q_OVERFLOW:
+                    changed = None
+                    break
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                    lost_watch = True
+                    break
+                if name and not mask & IN_ISDIR:
+                    changed.add(os.fsdecode(name))
+
+            with self._lock:
+                self._stats['events'] += events
+            if lost_watch:
+                break
+            if changed is None:
+                # Event queue overflowed; we no longer know what changed
+                self.rescan()
+                continue
+            for name in changed:
+                self.refresh(name)
+
+        os.close(fd)
+        self.mode = 'polling'
+        self._watch_polling()
+
+    def _watch_polling(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                self.rescan()
+            except OSError as e:
+                print(f"Error rescanning {self.directory}: {e}")
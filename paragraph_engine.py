@@ -0,0 +1,37 @@
+"""Bounded-concurrency paragraph synthesis used by /generate-paragraphs."""
+from concurrent.futures import ThreadPoolExecutor
+
+
+class ParagraphEngine:
+    """Run paragraph synthesis on a shared, size-limited worker pool.
+
+    The pool is shared by every request, so `max_workers` bounds the number of
+    in-flight TTS calls for the whole process, not just for one chapter.
+    """
+
+    def __init__(self, max_workers: int = 4):
+        self.max_workers = max(1, int(max_workers))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='paragraph')
+
+    def run(self, paragraphs: list[tuple[int, str]], synthesize) -> list[tuple[int, str]]:
+        """
+        Synthesize paragraphs concurrently.
+
+        Args:
+            paragraphs: List of (index, text) pairs
+            synthesize: Callable (index, text) -> filename; it writes its own output file
+
+        Returns:
+            List of (index, filename) for paragraphs that succeeded, ordered by index.
+            Failed paragraphs are logged and skipped.
+        """
+        futures = [(index, self._executor.submit(synthesize, index, text)) for index, text in paragraphs]
+
+        results = []
+        for index, future in futures:
+            try:
+                results.append((index, future.result()))
+            except Exception as e:
+                # Continue with next paragraph if one fails
+                print(f"Error generating paragraph {index}: {e}")
+        return results
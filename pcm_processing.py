@@ -0,0 +1,202 @@
+"""
+Per-paragraph PCM processing before concatenation: edge silence trimming and loudness normalization.
+
+Works on 16-bit PCM straight out of memory-mapped WAV files. Clips are analysed
+through memoryviews of the mapping in 10 ms windows, so nothing is copied; a gain
+is applied one block at a time while writing. The per-window work runs in C:
+audioop where it is available, otherwise max, min and sums over memoryview casts
+and a lookup table for the gain.
+"""
+import math
+import mmap
+import sys
+import warnings
+from array import array
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import chain
+from operator import itemgetter, mul
+from typing import NamedTuple
+from batch_planner import MIN_SILENCE_LEVEL, SILENCE_RATIO, WINDOW_SECONDS, pcm_samples
+
+try:
+    # Part of the standard library before Python 3.13 (pydub needs it too; audioop-lts provides it after)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        import audioop
+except ImportError:
+    audioop = None
+
+# audioop works in native byte order; WAV data is little-endian
+AUDIOOP_AVAILABLE = audioop is not None and sys.byteorder == 'little'
+
+# Silence kept at each edge of a paragraph; protects soft onsets and fading word endings
+EDGE_SILENCE_SECONDS = 0.15
+
+# Loudness paragraphs are brought to: RMS of the windows that are not silent, in dBFS.
+# Audiobook guidelines ask for -23 to -18
+TARGET_LOUDNESS_DBFS = -20.0
+
+# A gain never amplifies by more than MAX_GAIN_DB (noise in near-silent clips) or lifts a peak above PEAK_CEILING_DBFS
+MAX_GAIN_DB = 12.0
+PEAK_CEILING_DBFS = -1.0
+
+# Level differences smaller than this are inaudible; such clips are copied unchanged
+MIN_GAIN_DB = 0.5
+
+# Without audioop, window energy is estimated from every ENERGY_STRIDE-th sample
+ENERGY_STRIDE = 4
+
+# Samples scaled per write when a gain is applied
+BLOCK_SAMPLES = 64 * 1024
+
+FULL_SCALE = 32768
+
+
+class ClipPlan(NamedTuple):
+    """The part of a clip to keep, in bytes of its data chunk, and the gain to apply to it."""
+    start: int
+    end: int
+    lead: int  # bytes of silence kept before the speech
+    trail: int  # bytes of silence kept after it
+    gain: float
+
+
+@contextmanager
+def mapped_wav_data(file_path: str, header: dict):
+    """Memory-map a WAV file and yield its audio data (whole frames only) as a read-only memoryview."""
+    block_align = header['block_align'] or header['num_channels'] * (header['bits_per_sample'] // 8)
+    size = header['data_size'] - header['data_size'] % block_align
+    if size <= 0:
+        yield memoryview(b'')
+        return
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapping:
+        view = memoryview(mapping)
+        data = view[header['data_offset']:header['data_offset'] + size]
+        try:
+            yield data
+        finally:
+            # The mapping cannot be closed while views of it exist
+            data.release()
+            view.release()
+
+
+def window_stats(window: memoryview) -> tuple[int, int, float]:
+    """(min, max, mean square) of a window of 16-bit little-endian PCM."""
+    if AUDIOOP_AVAILABLE:
+        low, high = audioop.minmax(window, 2)
+        return low, high, audioop.rms(window, 2) ** 2
+    samples = window.cast('h') if sys.byteorder == 'little' else pcm_samples(bytes(window))
+    sparse = samples[::ENERGY_STRIDE]
+    return min(samples), max(samples), sum(map(mul, sparse, sparse)) / len(sparse)
+
+
+def plan_clip(data: memoryview, sample_rate: int, num_channels: int = 1,
+              edge_silence: float | None = EDGE_SILENCE_SECONDS,
+              target_dbfs: float | None = TARGET_LOUDNESS_DBFS) -> ClipPlan:
+    """
+    Decide how to trim and level one clip of 16-bit PCM.
+
+    Args:
+        data: The clip's audio data, whole frames
+        sample_rate: Sample rate of the clip
+        num_channels: Interleaved channels
+        edge_silence: Seconds of silence to keep at each edge, or None to keep the clip whole
+        target_dbfs: Speech loudness to normalize to, or None to leave the level alone
+
+    Returns:
+        The plan. Clips without any sound are kept whole at unity gain.
+    """
+    frame_bytes = 2 * num_channels
+    frames = len(data) // frame_bytes
+    keep_whole = ClipPlan(0, frames * frame_bytes, 0, 0, 1.0)
+    if not frames or (edge_silence is None and target_dbfs is None):
+        return keep_whole
+
+    # Peak-to-peak level of each window, as in the batch splitter's silence detection, and its energy
+    window_frames = max(1, int(sample_rate * WINDOW_SECONDS))
+    window = window_frames * frame_bytes
+    levels = []
+    energies = []
+    peak = 1
+    for start in range(0, frames * frame_bytes, window):
+        low, high, energy = window_stats(data[start:start + window])
+        levels.append(high - low)
+        energies.append(energy)
+        peak = max(peak, high, -low)
+    loud = sorted(levels)[int(len(levels) * 0.9)]
+    threshold = max(MIN_SILENCE_LEVEL, loud * SILENCE_RATIO)
+    voiced = [i for i, level in enumerate(levels) if level >= threshold]
+    if not voiced:
+        return keep_whole
+
+    # Silence before the first and after the last window with sound, in frames
+    lead = voiced[0] * window_frames
+    trail = max(0, frames - (voiced[-1] + 1) * window_frames)
+    start, end = 0, frames
+    if edge_silence is not None:
+        keep = int(sample_rate * edge_silence)
+        start = max(0, lead - keep)
+        end = min(frames, frames - trail + keep)
+        lead, trail = lead - start, trail - (frames - end)
+
+    gain = 1.0
+    if target_dbfs is not None:
+        # The last window may be short, but one window's weight hardly moves the average
+        rms = math.sqrt(sum(energies[i] for i in voiced) / len(voiced)) or 1
+        gain_db = min(target_dbfs - 20 * math.log10(rms / FULL_SCALE),
+                      MAX_GAIN_DB,
+                      PEAK_CEILING_DBFS - 20 * math.log10(peak / FULL_SCALE))
+        if abs(gain_db) >= MIN_GAIN_DB:
+            # Rounded so clips of similar level share a lookup table
+            gain = 10 ** (round(gain_db, 1) / 20)
+
+    return ClipPlan(start * frame_bytes, end * frame_bytes, lead * frame_bytes, trail * frame_bytes, gain)
+
+
+@lru_cache(maxsize=64)
+def gain_table(gain: float) -> array:
+    """Every 16-bit sample scaled by `gain` and clipped, indexed by the sample's unsigned bit pattern."""
+    return array('h', [min(FULL_SCALE - 1, max(-FULL_SCALE, round(sample * gain)))
+                       for sample in chain(range(0, FULL_SCALE), range(-FULL_SCALE, 0))])
+
+
+def scale_block(block: memoryview, gain: float):
+    """A block of 16-bit little-endian PCM multiplied by `gain`, clipped to full scale."""
+    if AUDIOOP_AVAILABLE:
+        return audioop.mul(block, 2, gain)
+    if sys.byteorder == 'little':
+        # The samples' unsigned bit patterns index the table directly
+        return lookup(gain_table(gain), block.cast('H'))
+    patterns = array('H', bytes(block))
+    patterns.byteswap()
+    scaled = lookup(gain_table(gain), patterns)
+    scaled.byteswap()
+    return scaled
+
+
+def lookup(table: array, indexes) -> array:
+    """table[i] for every i in `indexes`, gathered in one C call."""
+    if len(indexes) == 1:
+        # itemgetter returns a bare value for a single index
+        return array('h', [table[indexes[0]]])
+    return array('h', itemgetter(*indexes)(table))
+
+
+def write_clip(out, data: memoryview, plan: ClipPlan) -> int:
+    """Write the kept part of a clip to the raw file `out`, applying the plan's gain. Returns the bytes written."""
+    clip = data[plan.start:plan.end]
+    if plan.gain == 1.0:
+        write_all(out, clip)
+        return len(clip)
+
+    block_bytes = 2 * BLOCK_SAMPLES
+    for offset in range(0, len(clip), block_bytes):
+        write_all(out, memoryview(scale_block(clip[offset:offset + block_bytes], plan.gain)).cast('B'))
+    return len(clip)
+
+
+def write_all(out, data: memoryview):
+    """Write all of `data` to a raw file, which may accept less than asked for in one call."""
+    while data:
+        data = data[out.write(data):]
@@ -0,0 +1,151 @@
+"""
+Production launcher: several worker processes serving the app on one port.
+
+The parent binds the listening socket once and starts `--workers` processes that
+all accept from it, so the kernel spreads connections over them and generation,
+WAV assembly and encoding use every core. Workers share the working directory:
+outputs are written under unique temporary names and renamed into place, config
+saves are locked, background jobs are claimed from the shared jobs.db, and a
+synthesis in progress is claimed in coordination.db so two workers asked for the
+same audio make one Gemini call (see coordination.py). A worker that exits is
+restarted; SIGTERM or Ctrl+C stops them all.
+
+    python serve.py --workers 4 --port 5000
+    python serve.py --workers 4 --asgi      # each worker runs asgi:application under uvicorn
+"""
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+# Seconds a worker gets to finish its requests after SIGTERM before it is killed
+GRACEFUL_TIMEOUT = 30
+
+# A worker that exits sooner than this after starting is restarted only after RESTART_DELAY
+MIN_UPTIME = 10
+RESTART_DELAY = 5
+
+
+def serve_worker(fd: int, host: str, use_asgi: bool):
+    """Worker process body: serve the app on the inherited listening socket until SIGTERM."""
+    # Ctrl+C reaches the whole process group; the supervisor turns it into an orderly SIGTERM
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if use_asgi:
+        import uvicorn
+        uvicorn.run('asgi:application', fd=fd, log_level='warning')
+        return
+
+    from werkzeug.serving import make_server
+    from app import app, start_background_workers
+    server = make_server(host, 0, app, threaded=True, fd=fd)
+    start_background_workers()
+    # shutdown() waits for serve_forever() to return, so it cannot run on the signal handler's thread
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    print(f"Worker {os.getpid()} serving")
+    server.serve_forever()
+
+
+class Supervisor:
+    """Starts the worker processes, restarts the ones that exit, and stops them all on shutdown."""
+
+    def __init__(self, sock: socket.socket, host: str, workers: int, use_asgi: bool):
+        self.sock = sock
+        self.host = host
+        self.workers = workers
+        self.use_asgi = use_asgi
+        self._processes = {}  # slot -> (Popen, start time)
+        self._stopping = False
+
+    def _spawn(self, slot: int):
+        fd = self.sock.fileno()
+        command = [sys.executable, os.path.abspath(__file__), '--worker-fd', str(fd), '--host', self.host]
+        if self.use_asgi:
+            command.append('--asgi')
+        env = dict(os.environ, UGMPA_WORKERS=str(self.workers))
+        process = subprocess.Popen(command, pass_fds=(fd,), env=env)
+        self._processes[slot] = (process, time.monotonic())
+
+    def stop(self, signum=None, frame=None):
+        self._stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for slot in range(self.workers):
+            self._spawn(slot)
+        restart_at = {}
+        while not self._stopping:
+            time.sleep(0.5)
+            now = time.monotonic()
+            for slot, (process, started) in list(self._processes.items()):
+                if process.poll() is None or slot in restart_at:
+                    continue
+                print(f"Worker {process.pid} exited with status {process.returncode}")
+                # A worker that keeps failing at startup (bad config, port problems) is not restarted in a tight loop
+                restart_at[slot] = now + (RESTART_DELAY if now - started < MIN_UPTIME else 0)
+            for slot, when in list(restart_at.items()):
+                if when <= now:
+                    del restart_at[slot]
+                    self._spawn(slot)
+        self.shutdown()
+
+    def shutdown(self):
+        print("Stopping workers")
+        processes = [process for process, _ in self._processes.values()]
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+        deadline = time.monotonic() + GRACEFUL_TIMEOUT
+        for process in processes:
+            try:
+                process.wait(max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+
+def listen(host: str, port: int, backlog: int = 1024) -> socket.socket:
+    sock = socket.create_server((host, port), backlog=backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the app with several worker processes on one port.')
+    parser.add_argument('--host', default=os.environ.get('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 5000)))
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='worker processes (default: one per core)')
+    parser.add_argument('--asgi', action='store_true', help='run asgi:application under uvicorn in each worker')
+    parser.add_argument('--worker-fd', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker_fd is not None:
+        serve_worker(args.worker_fd, args.host, args.asgi)
+        return
+
+    if args.asgi:
+        try:
+            import uvicorn  # noqa: F401
+        except ImportError:
+            sys.exit('--asgi needs uvicorn: pip install uvicorn')
+
+    if os.name == 'nt':
+        # Windows cannot hand a listening socket to a child process this way
+        print("⚠ Warning: multiple workers are not supported on Windows, serving with one process")
+        from app import app, start_background_workers
+        start_background_workers()
+        app.run(host=args.host, port=args.port, threaded=True)
+        return
+
+    sock = listen(args.host, args.port)
+    print(f"Serving on http://{args.host}:{args.port} with {args.workers} worker(s)")
+    Supervisor(sock, args.host, max(1, args.workers), args.asgi).run()
+
+
+if __name__ == '__main__':
+    main()
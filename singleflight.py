@@ -0,0 +1,140 @@
+"""Single-flight: callers asking for the same work at the same time share one execution of it."""
+import asyncio
+import threading
+
+
+def _wake(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class Flight:
+    """
+    One execution in progress, finished exactly once with a result or an exception.
+
+    Threads wait on it with wait(), coroutines with wait_async(); a coroutine that
+    is cancelled while waiting stops waiting without affecting the execution.
+    """
+
+    def __init__(self):
+        self.result = None
+        self.error = None
+        self.task = None  # asyncio task doing the work, when a coroutine leads
+        self._done = threading.Event()
+        self._waiters = []  # (loop, future) of waiting coroutines
+        self._lock = threading.Lock()
+
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def finish(self, result=None, error: BaseException | None = None) -> bool:
+        """Record the outcome and wake every waiter. Returns False if the flight had already finished."""
+        with self._lock:
+            if self._done.is_set():
+                return False
+            self.result = result
+            self.error = error
+            self._done.set()
+            waiters, self._waiters = self._waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future)
+        return True
+
+    def _outcome(self):
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def wait(self):
+        """Block until the flight finishes; return its result or raise its exception."""
+        self._done.wait()
+        return self._outcome()
+
+    async def wait_async(self):
+        """Async counterpart of wait()."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            if self._done.is_set():
+                future.set_result(None)
+            else:
+                self._waiters.append((loop, future))
+        await future
+        return self._outcome()
+
+
+class SingleFlight:
+    """
+    Calls with the same key made while one is running attach to it instead of starting their own.
+
+    The first caller leads: its work runs once, and every caller that arrives before
+    it finishes receives the same result or exception. Nothing is kept once a flight
+    lands; the next call with that key starts a new one. Sync and async callers share
+    flights, so a thread can wait for work led by a coroutine and the other way round.
+    """
+
+    def __init__(self):
+        self._flights = {}  # key -> Flight
+        self._lock = threading.Lock()
+        self._stats = {'flights': 0, 'joined': 0}
+
+    def begin(self, key) -> tuple[Flight, bool]:
+        """
+        Join the flight for `key`, starting one if there is none.
+
+        Returns (flight, leader). A leader must call end() once the work is done, however
+        it ends; other callers wait on the flight.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self._stats['joined'] += 1
+                return flight, False
+            flight = self._flights[key] = Flight()
+            self._stats['flights'] += 1
+            return flight, True
+
+    def end(self, key, flight: Flight, result=None, error: BaseException | None = None):
+        """Land a flight started by begin(). Later calls for the same flight are ignored."""
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.finish(result, error)
+
+    def do(self, key, fn):
+        """Return fn(), or the result of the call of it already running for `key`."""
+        flight, leader = self.begin(key)
+        if not leader:
+            return flight.wait()
+        try:
+            result = fn()
+        except BaseException as e:
+            self.end(key, flight, error=e)
+            raise
+        self.end(key, flight, result)
+        return result
+
+    async def ado(self, key, fn):
+        """
+        Async counterpart of do() for a coroutine function `fn`.
+
+        The work runs in a task of its own, so cancelling the request that started it
+        (a client going away) does not cancel it for the callers that joined.
+        """
+        flight, leader = self.begin(key)
+        if leader:
+            flight.task = asyncio.ensure_future(fn())
+            flight.task.add_done_callback(lambda task: self._task_done(key, flight, task))
+        return await flight.wait_async()
+
+    def _task_done(self, key, flight: Flight, task: asyncio.Task):
+        if task.cancelled():
+            self.end(key, flight, error=asyncio.CancelledError())
+        elif task.exception() is not None:
+            self.end(key, flight, error=task.exception())
+        else:
+            self.end(key, flight, task.result())
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, in_flight=len(self._flights))
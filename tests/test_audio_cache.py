@@ -0,0 +1,81 @@
+import os
+
+import audio_cache
+from audio_cache import AudioCache
+
+
+def test_fetch_to_links_a_cached_entry(tmp_path):
+    cache = AudioCache(str(tmp_path / 'cache'), 1 << 20)
+    cache.put_bytes('ab' * 32, b'RIFF audio', '.wav')
+    output = cache.fetch_to('ab' * 32, str(tmp_path / 'out'))
+    assert output == str(tmp_path / 'out.wav')
+    assert (tmp_path / 'out.wav').read_bytes() == b'RIFF audio'
+    assert cache.fetch_to('cd' * 32, str(tmp_path / 'other')) is None
+
+
+def test_fetch_to_treats_an_entry_evicted_after_lookup_as_a_miss(tmp_path, monkeypatch):
+    cache = AudioCache(str(tmp_path / 'cache'), 1 << 20)
+    key = 'ab' * 32
+    cache.put_bytes(key, b'RIFF audio', '.wav')
+    find = cache._find
+
+    def find_then_evict(key):
+        # Another process evicts the entry between the lookup and the link
+        path = find(key)
+        os.remove(path)
+        return path
+
+    monkeypatch.setattr(cache, '_find', find_then_evict)
+    assert cache.fetch_to(key, str(tmp_path / 'out')) is None
+    assert not (tmp_path / 'out.wav').exists()
+    stats = cache.stats()
+    assert (stats['entries'], stats['bytes'], stats['hits'], stats['misses']) == (0, 0, 0, 1)
+
+
+def test_an_entry_whose_file_is_gone_counts_as_a_miss(tmp_path):
+    cache = AudioCache(str(tmp_path / 'cache'), 1 << 20)
+    key = 'ab' * 32
+    cache.put_bytes(key, b'RIFF audio', '.wav')
+    assert cache.lookup(key) is not None
+    os.remove(cache.lookup(key))
+    assert cache.lookup(key) is None
+    stats = cache.stats()
+    assert (stats['entries'], stats['hits'], stats['misses']) == (0, 2, 1)
+
+
+def test_recency_survives_a_restart_without_touching_files(tmp_path):
+    directory = str(tmp_path / 'cache')
+    cache = AudioCache(directory, 1 << 20)
+    for key in ('aa' * 32, 'bb' * 32, 'cc' * 32):
+        cache.put_bytes(key, key.encode(), '.wav')
+    path = cache.lookup('aa' * 32)
+    mtime = os.stat(path).st_mtime_ns
+    cache.lookup('aa' * 32)
+    assert os.stat(path).st_mtime_ns == mtime
+
+    reopened = AudioCache(directory, 1 << 20)
+    assert list(reopened._entries) == ['bb' * 32, 'cc' * 32, 'aa' * 32]
+    assert os.path.exists(os.path.join(directory, audio_cache.ACCESS_DB))
+
+
+def test_recaching_in_another_format_removes_the_old_file(tmp_path):
+    directory = tmp_path / 'cache'
+    cache = AudioCache(str(directory), 1 << 20)
+    key = 'ab' * 32
+    cache.put_bytes(key, b'wav audio', '.wav')
+    cache.put_bytes(key, b'mp3', '.mp3')
+    assert sorted(os.listdir(directory / 'ab')) == [key + '.mp3']
+    assert cache.stats()['bytes'] == 3
+    assert cache.lookup(key).endswith('.mp3')
+
+
+def test_load_keeps_only_the_newest_file_of_a_key(tmp_path):
+    directory = tmp_path / 'cache'
+    key = 'ab' * 32
+    (directory / 'ab').mkdir(parents=True)
+    (directory / 'ab' / (key + '.wav')).write_bytes(b'old audio')
+    os.utime(directory / 'ab' / (key + '.wav'), (1, 1))
+    (directory / 'ab' / (key + '.mp3')).write_bytes(b'new')
+    cache = AudioCache(str(directory), 1 << 20)
+    assert os.listdir(directory / 'ab') == [key + '.mp3']
+    assert cache.stats()['bytes'] == 3
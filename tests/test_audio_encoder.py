@@ -0,0 +1,266 @@
+import hashlib
+import math
+import random
+import struct
+
+import pytest
+
+from audio_encoder import _utf8_number, encode_flac
+from wav_utils import wav_header
+
+RATE = 24000
+
+# Samples per block for the block size codes that need no extra header bytes (RFC 9639, 9.1.1)
+BLOCK_SIZE_CODES = {1: 192, 2: 576, 3: 1152, 4: 2304, 5: 4608, 8: 256, 9: 512, 10: 1024,
+                    11: 2048, 12: 4096, 13: 8192, 14: 16384, 15: 32768}
+FIXED_COEFFICIENTS = [[], [1], [2, -1], [3, -3, 1], [4, -6, 4, -1]]
+
+
+def crc(data: bytes, polynomial: int, width: int) -> int:
+    """Bit by bit CRC with a zero initial value, as FLAC frame headers and frames use."""
+    value = 0
+    top = 1 << (width - 1)
+    for byte in data:
+        value ^= byte << (width - 8)
+        for _ in range(8):
+            value = (value << 1) ^ polynomial if value & top else value << 1
+    return value & ((1 << width) - 1)
+
+
+class BitReader:
+    def __init__(self, data: bytes, offset: int):
+        self.data = data
+        self.bit = offset * 8
+
+    def read(self, count: int) -> int:
+        value = 0
+        for _ in range(count):
+            byte = self.data[self.bit >> 3]
+            value = (value << 1) | ((byte >> (7 - (self.bit & 7))) & 1)
+            self.bit += 1
+        return value
+
+    def read_signed(self, count: int) -> int:
+        value = self.read(count)
+        return value - (1 << count) if count and value >> (count - 1) else value
+
+    def read_unary(self) -> int:
+        zeros = 0
+        while not self.read(1):
+            zeros += 1
+        return zeros
+
+    def read_utf8_number(self) -> int:
+        first = self.read(8)
+        length = 0
+        while first & (0x80 >> length):
+            length += 1
+        number = first & (0xFF >> (length + 1))
+        for _ in range(length - 1):
+            continuation = self.read(8)
+            assert continuation >> 6 == 0b10
+            number = (number << 6) | (continuation & 0x3F)
+        return number
+
+    @property
+    def offset(self) -> int:
+        return self.bit // 8
+
+
+def decode_residual(reader: BitReader, block_size: int, order: int) -> list[int]:
+    assert reader.read(2) == 0
+    partition_order = reader.read(4)
+    residual = []
+    for partition in range(1 << partition_order):
+        parameter = reader.read(4)
+        assert parameter != 0b1111
+        count = (block_size >> partition_order) - (order if partition == 0 else 0)
+        for _ in range(count):
+            folded = (reader.read_unary() << parameter) | reader.read(parameter)
+            residual.append(folded >> 1 if not folded & 1 else -(folded >> 1) - 1)
+    return residual
+
+
+def decode_subframe(reader: BitReader, block_size: int, bits_per_sample: int) -> list[int]:
+    assert reader.read(1) == 0
+    kind = reader.read(6)
+    assert reader.read(1) == 0, 'wasted bits are not used'
+    if kind == 0:
+        return [reader.read_signed(bits_per_sample)] * block_size
+    if kind == 1:
+        return [reader.read_signed(bits_per_sample) for _ in range(block_size)]
+    assert 8 <= kind <= 12, f'unexpected subframe type {kind}'
+    order = kind - 8
+    samples = [reader.read_signed(bits_per_sample) for _ in range(order)]
+    for value in decode_residual(reader, block_size, order):
+        prediction = sum(c * samples[-1 - i] for i, c in enumerate(FIXED_COEFFICIENTS[order]))
+        samples.append(value + prediction)
+    return samples
+
+
+def decode_flac(data: bytes) -> tuple[dict, bytes]:
+    """
+    Decode a FLAC stream of the kind encode_flac writes, checking it against the format as it goes.
+
+    Returns (STREAMINFO fields, interleaved signed PCM as little-endian bytes).
+    """
+    assert data[:4] == b'fLaC'
+    assert data[4] == 0x80, 'STREAMINFO must be the first and only metadata block'
+    assert int.from_bytes(data[5:8], 'big') == 34
+    info = data[8:42]
+    min_block, max_block = struct.unpack('>HH', info[:4])
+    min_frame = int.from_bytes(info[4:7], 'big')
+    max_frame = int.from_bytes(info[7:10], 'big')
+    packed = int.from_bytes(info[10:18], 'big')
+    streaminfo = {
+        'min_block_size': min_block,
+        'max_block_size': max_block,
+        'sample_rate': packed >> 44,
+        'channels': ((packed >> 41) & 7) + 1,
+        'bits_per_sample': ((packed >> 36) & 31) + 1,
+        'total_samples': packed & ((1 << 36) - 1),
+        'md5': info[18:34],
+    }
+    channels = streaminfo['channels']
+    bits_per_sample = streaminfo['bits_per_sample']
+
+    decoded = [[] for _ in range(channels)]
+    offset = 42
+    frame_number = 0
+    while offset < len(data):
+        reader = BitReader(data, offset)
+        assert reader.read(15) == 0b111111111111100, 'frame sync'
+        assert reader.read(1) == 0, 'fixed block size stream'
+        block_size_code = reader.read(4)
+        sample_rate_code = reader.read(4)
+        assert reader.read(4) == channels - 1, 'independent channels'
+        assert reader.read(3) in (0, {8: 1, 16: 4}[bits_per_sample])
+        assert reader.read(1) == 0
+        assert reader.read_utf8_number() == frame_number
+        if block_size_code == 6:
+            block_size = reader.read(8) + 1
+        elif block_size_code == 7:
+            block_size = reader.read(16) + 1
+        else:
+            block_size = BLOCK_SIZE_CODES[block_size_code]
+        assert sample_rate_code == 0, 'sample rate from STREAMINFO'
+        assert crc(data[offset:reader.offset], 0x07, 8) == reader.read(8), 'header CRC-8'
+
+        for channel in range(channels):
+            decoded[channel] += decode_subframe(reader, block_size, bits_per_sample)
+        reader.bit = (reader.bit + 7) // 8 * 8
+        end = reader.offset
+        assert crc(data[offset:end], 0x8005, 16) == int.from_bytes(data[end:end + 2], 'big'), 'frame CRC-16'
+        assert min_frame <= end + 2 - offset <= max_frame
+        assert block_size <= max_block
+        offset = end + 2
+        frame_number += 1
+
+    assert len(decoded[0]) == streaminfo['total_samples']
+    interleaved = [decoded[c][i] for i in range(len(decoded[0])) for c in range(channels)]
+    pcm = struct.pack(f'<{len(interleaved)}{"h" if bits_per_sample == 16 else "b"}', *interleaved)
+    assert hashlib.md5(pcm).digest() == streaminfo['md5'], 'MD5 signature'
+    return streaminfo, pcm
+
+
+def write_wav(path, samples: list[int], bits_per_sample: int = 16, num_channels: int = 1) -> str:
+    if bits_per_sample == 16:
+        data = struct.pack(f'<{len(samples)}h', *samples)
+    else:
+        data = bytes(samples)
+    with open(path, 'wb') as f:
+        f.write(wav_header(len(data), RATE, bits_per_sample, num_channels) + data)
+    return str(path)
+
+
+def speech_like(count: int, seed: int = 1) -> list[int]:
+    """Tones, noise and stretches of digital silence, so every subframe type is exercised."""
+    rng = random.Random(seed)
+    samples = []
+    while len(samples) < count:
+        kind = rng.choice(['tone', 'noise', 'silence'])
+        length = rng.randrange(500, 6000)
+        if kind == 'tone':
+            frequency = rng.uniform(100, 3000)
+            samples += [int(9000 * math.sin(2 * math.pi * frequency * i / RATE)) for i in range(length)]
+        elif kind == 'noise':
+            samples += [rng.randint(-32768, 32767) for _ in range(length)]
+        else:
+            samples += [0] * length
+    return samples[:count]
+
+
+def round_trip(tmp_path, samples, bits_per_sample=16, num_channels=1, block_size=4096):
+    wav_path = write_wav(tmp_path / 'in.wav', samples, bits_per_sample, num_channels)
+    flac_path = str(tmp_path / 'out.flac')
+    encode_flac(wav_path, flac_path, block_size=block_size)
+    with open(flac_path, 'rb') as f:
+        return decode_flac(f.read())
+
+
+def test_mono_round_trip(tmp_path):
+    samples = speech_like(3 * 4096 + 123)
+    info, pcm = round_trip(tmp_path, samples)
+    assert pcm == struct.pack(f'<{len(samples)}h', *samples)
+    assert (info['sample_rate'], info['channels'], info['bits_per_sample']) == (RATE, 1, 16)
+    assert info['total_samples'] == len(samples)
+
+
+def test_stereo_round_trip(tmp_path):
+    left, right = speech_like(5000, seed=2), speech_like(5000, seed=3)
+    samples = [sample for pair in zip(left, right) for sample in pair]
+    info, pcm = round_trip(tmp_path, samples, num_channels=2, block_size=1152)
+    assert pcm == struct.pack(f'<{len(samples)}h', *samples)
+    assert info['channels'] == 2
+
+
+def test_8bit_round_trip(tmp_path):
+    samples = [128 + int(100 * math.sin(i / 10)) for i in range(3000)] + [128] * 500 + [0, 255] * 100
+    info, pcm = round_trip(tmp_path, samples, bits_per_sample=8, block_size=1024)
+    # FLAC stores 8-bit audio signed
+    assert pcm == bytes((sample - 128) & 0xFF for sample in samples)
+    assert info['bits_per_sample'] == 8
+
+
+def test_many_small_frames_and_extremes(tmp_path):
+    # Over 128 frames needs multi-byte frame numbers; full-scale steps stress the predictors
+    samples = [32767, -32768] * 1000 + [-32768] * 100 + [5] * 100 + speech_like(1000)
+    _, pcm = round_trip(tmp_path, samples, block_size=16)
+    assert pcm == struct.pack(f'<{len(samples)}h', *samples)
+
+
+def test_empty_file(tmp_path):
+    info, pcm = round_trip(tmp_path, [])
+    assert pcm == b''
+    assert info['total_samples'] == 0
+
+
+def test_compresses_silence_and_tones(tmp_path):
+    samples = [0] * 24000 + [int(9000 * math.sin(2 * math.pi * 440 * i / RATE)) for i in range(24000)]
+    round_trip(tmp_path, samples)
+    assert (tmp_path / 'out.flac').stat().st_size < 0.5 * (tmp_path / 'in.wav').stat().st_size
+
+
+@pytest.mark.parametrize('number, coded', [
+    (0, b'\x00'),
+    (0x7F, b'\x7f'),
+    (0x80, b'\xc2\x80'),
+    (0x7FF, b'\xdf\xbf'),
+    (0x800, b'\xe0\xa0\x80'),
+    (0xFFFF, b'\xef\xbf\xbf'),
+    (0x10000, b'\xf0\x90\x80\x80'),
+    (0x7FFFFFFF, b'\xfd\xbf\xbf\xbf\xbf\xbf'),
+    (0x80000000, b'\xfe\x82\x80\x80\x80\x80\x80'),
+])
+def test_utf8_frame_numbers(number, coded):
+    assert _utf8_number(number) == coded
+
+
+@pytest.mark.parametrize('num_channels', [1, 2])
+def test_libsndfile_decodes_output(tmp_path, num_channels):
+    soundfile = pytest.importorskip('soundfile')
+    samples = speech_like(20000 * num_channels, seed=4)
+    round_trip(tmp_path, samples, num_channels=num_channels)
+    with soundfile.SoundFile(str(tmp_path / 'out.flac')) as reader:
+        assert (reader.samplerate, reader.channels) == (RATE, num_channels)
+        assert bytes(reader.buffer_read(dtype='int16')) == struct.pack(f'<{len(samples)}h', *samples)
@@ -0,0 +1,100 @@
+import math
+from array import array
+
+from batch_planner import PARAGRAPH_SEPARATOR, ParagraphBatch, ParagraphBatcher, choose_gaps, find_silences
+
+RATE = 24000
+
+
+def tone(seconds: float, amplitude: int = 8000) -> list[int]:
+    return [int(amplitude * math.sin(2 * math.pi * 220 * i / RATE)) for i in range(int(seconds * RATE))]
+
+
+def silence(seconds: float) -> list[int]:
+    return [0] * int(seconds * RATE)
+
+
+def assert_covers(ranges, total, num_channels=1):
+    assert ranges[0][0] == 0
+    assert ranges[-1][1] == total
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end == start
+    for start, end in ranges:
+        assert start % num_channels == 0 and end % num_channels == 0
+        assert start <= end
+
+
+def test_plan_packs_paragraphs_up_to_the_character_budget():
+    batcher = ParagraphBatcher(max_chars=10, max_paragraphs=3)
+    batches = batcher.plan([(1, 'aaaa'), (2, 'bbbb'), (3, 'cccccccccccc'), (4, 'd'), (5, 'e'), (6, 'f'), (7, 'g')])
+    assert batches == [
+        ParagraphBatch([1, 2], ['aaaa', 'bbbb']),
+        ParagraphBatch([3], ['cccccccccccc']),
+        ParagraphBatch([4, 5, 6], ['d', 'e', 'f']),
+        ParagraphBatch([7], ['g']),
+    ]
+    assert batches[0].text == 'aaaa' + PARAGRAPH_SEPARATOR + 'bbbb'
+    assert batcher.stats()['requests_saved'] == 3
+
+
+def test_find_silences_skips_edges_and_short_runs():
+    levels = [0, 0, 900, 900, 0, 900, 0, 0, 0, 900, 0, 0]
+    assert find_silences(levels, 2) == [(6, 9)]
+
+
+def test_choose_gaps_needs_a_gap_per_cut():
+    assert choose_gaps([(10, 20)], [5.0, 50.0], 100) is None
+
+
+def test_choose_gaps_follows_expected_positions_in_order():
+    gaps = [(10, 12), (30, 32), (50, 52), (70, 72)]
+    assert choose_gaps(gaps, [31.0, 69.0], 100) == [1, 3]
+
+
+def test_choose_gaps_prefers_a_longer_gap_at_a_similar_distance():
+    gaps = [(40, 41), (46, 60)]
+    assert choose_gaps(gaps, [45.0], 100) == [1]
+
+
+def test_split_cuts_in_the_middle_of_paragraph_pauses():
+    # Paragraph lengths follow the text lengths; a short breath inside the second one is not a cut
+    samples = array('h', tone(1.0) + silence(0.6) + tone(1.0) + silence(0.25) + tone(1.0) + silence(0.6) + tone(1.0))
+    ranges, method = ParagraphBatcher().split(samples, RATE, ['a' * 10, 'b' * 20, 'c' * 10])
+    assert method == 'split_by_silence'
+    assert_covers(ranges, len(samples))
+    first_pause = int(1.3 * RATE)
+    second_pause = int((1.0 + 0.6 + 1.0 + 0.25 + 1.0 + 0.3) * RATE)
+    window = int(RATE * 0.01)
+    assert abs(ranges[0][1] - first_pause) <= window
+    assert abs(ranges[1][1] - second_pause) <= window
+
+
+def test_split_interleaved_stereo_on_frame_boundaries():
+    mono = tone(1.0) + silence(0.5) + tone(1.0)
+    samples = array('h', [sample for sample in mono for _ in range(2)])
+    ranges, method = ParagraphBatcher().split(samples, RATE, ['a' * 10, 'b' * 10], num_channels=2)
+    assert method == 'split_by_silence'
+    assert_covers(ranges, len(samples), num_channels=2)
+    assert abs(ranges[0][1] // 2 - int(1.25 * RATE)) <= int(RATE * 0.01)
+
+
+def test_split_without_pauses_falls_back_to_proportional_cuts():
+    samples = array('h', tone(3.0))
+    ranges, method = ParagraphBatcher().split(samples, RATE, ['a' * 10, 'b' * 20])
+    assert method == 'split_proportional'
+    assert_covers(ranges, len(samples))
+    assert abs(ranges[0][1] - RATE) <= 0.5 * RATE + int(RATE * 0.01)
+
+
+def test_split_rejects_pauses_that_leave_a_paragraph_far_too_short():
+    # The only pause is right at the start, where no paragraph could end
+    samples = array('h', tone(0.2) + silence(0.5) + tone(4.0))
+    ranges, method = ParagraphBatcher().split(samples, RATE, ['a' * 10, 'b' * 10])
+    assert method == 'split_proportional'
+    assert_covers(ranges, len(samples))
+
+
+def test_split_single_paragraph_keeps_everything():
+    samples = array('h', tone(0.5))
+    assert ParagraphBatcher().split(samples, RATE, ['only']) == ([(0, len(samples))], 'single')
+
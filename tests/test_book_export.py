@@ -0,0 +1,117 @@
+import struct
+import wave
+
+import pytest
+
+from book_export import BookExportPlan, ChapterCue, export_book, plan_book_export, write_book_export
+from wav_utils import wav_header
+
+RATE = 8000
+
+
+def write_wav(path, data: bytes, bits_per_sample: int = 16, sample_rate: int = RATE) -> str:
+    with open(path, 'wb') as f:
+        f.write(wav_header(len(data), sample_rate, bits_per_sample) + data)
+    return str(path)
+
+
+def riff_chunks(data: bytes) -> list[tuple[bytes, bytes]]:
+    """(id, body) of every chunk in a RIFF/WAVE file, honouring the pad byte after odd-sized chunks."""
+    riff, size, wave_id = struct.unpack_from('<4sI4s', data)
+    assert (riff, wave_id) == (b'RIFF', b'WAVE')
+    assert size == len(data) - 8
+    chunks = []
+    offset = 12
+    while offset < len(data):
+        chunk_id, chunk_size = struct.unpack_from('<4sI', data, offset)
+        chunks.append((chunk_id, data[offset + 8:offset + 8 + chunk_size]))
+        offset += 8 + chunk_size + chunk_size % 2
+    assert offset == len(data)
+    return chunks
+
+
+def parse_cues(cue: bytes) -> list[tuple[int, int]]:
+    count = struct.unpack_from('<I', cue)[0]
+    assert len(cue) == 4 + 24 * count
+    points = []
+    for i in range(count):
+        cue_id, position, chunk, chunk_start, block_start, offset = struct.unpack_from('<II4sIII', cue, 4 + 24 * i)
+        assert (position, chunk, chunk_start, block_start) == (offset, b'data', 0, 0)
+        points.append((cue_id, offset))
+    return points
+
+
+def parse_labels(adtl: bytes) -> dict[int, str]:
+    assert adtl[:4] == b'adtl'
+    labels = {}
+    offset = 4
+    while offset < len(adtl):
+        chunk_id, size, cue_id = struct.unpack_from('<4sII', adtl, offset)
+        assert chunk_id == b'labl'
+        text = adtl[offset + 12:offset + 8 + size]
+        assert text.endswith(b'\0')
+        labels[cue_id] = text[:-1].decode('utf-8')
+        offset += 8 + size + size % 2
+    return labels
+
+
+@pytest.fixture
+def book(tmp_path):
+    one = write_wav(tmp_path / 'one_001.wav', b'\x01\x00' * 100)
+    two = write_wav(tmp_path / 'one_002.wav', b'\x02\x00' * 50)
+    three = write_wav(tmp_path / 'two_001.wav', b'\x03\x00' * 30)
+    return [('第一章 开始', [one, two]), ('Empty', []), ('第二章', [three])]
+
+
+def test_plan_places_silences_and_cues(book):
+    plan = plan_book_export(book, paragraph_silence=0.01, chapter_silence=0.02)
+    assert [segment.silence_before for segment in plan.segments] == [0, 160, 320]
+    assert plan.cues == [ChapterCue('第一章 开始', 0), ChapterCue('第二章', 100 + 80 + 50 + 160)]
+    assert plan.data_size == 2 * (100 + 80 + 50 + 160 + 30)
+
+
+def test_plan_skips_other_formats_and_needs_audio(tmp_path, book):
+    other = write_wav(tmp_path / 'other.wav', b'\x00' * 10, sample_rate=16000)
+    plan = plan_book_export([('A', [other])] + book)
+    assert plan.sample_rate == 16000
+    assert len(plan.segments) == 1
+    with pytest.raises(ValueError):
+        plan_book_export([('Empty', [])])
+
+
+def test_export_writes_markers_and_audio(tmp_path, book):
+    output = str(tmp_path / 'book.wav')
+    plan = export_book(book, output, paragraph_silence=0.01, chapter_silence=0.02)
+    with open(output, 'rb') as f:
+        data = f.read()
+
+    chunks = riff_chunks(data)
+    assert [chunk_id for chunk_id, _ in chunks] == [b'fmt ', b'cue ', b'LIST', b'data']
+    assert parse_cues(chunks[1][1]) == [(1, 0), (2, plan.cues[1].frame)]
+    assert parse_labels(chunks[2][1]) == {1: '第一章 开始', 2: '第二章'}
+    audio = chunks[3][1]
+    assert audio == (b'\x01\x00' * 100 + b'\0' * 160 + b'\x02\x00' * 50 + b'\0' * 320 + b'\x03\x00' * 30)
+
+    # Other readers skip the marker chunks
+    with wave.open(output) as reader:
+        assert reader.getframerate() == RATE
+        assert reader.readframes(reader.getnframes()) == audio
+
+
+def test_export_pads_odd_sized_data(tmp_path):
+    path = write_wav(tmp_path / 'odd.wav', b'\x80' * 7, bits_per_sample=8)
+    output = str(tmp_path / 'book.wav')
+    export_book([('Odd title', [path])], output)
+    with open(output, 'rb') as f:
+        data = f.read()
+    chunks = riff_chunks(data)
+    assert chunks[-1] == (b'data', b'\x80' * 7)
+    assert data.endswith(b'\x80' * 7 + b'\0')
+    assert parse_labels(chunks[2][1]) == {1: 'Odd title'}
+
+
+def test_export_refuses_audio_past_the_riff_limit(tmp_path):
+    plan = BookExportPlan(24000, 16, 1, [], [ChapterCue('Long', 0)], 5 * 2 ** 30)
+    with pytest.raises(ValueError, match=r'31\.1 hours long, .* at most 4 GiB \(24\.9 hours'):
+        write_book_export(plan, str(tmp_path / 'book.wav'))
+    assert not list(tmp_path.iterdir())
@@ -0,0 +1,137 @@
+import codecs
+import io
+import random
+import re
+
+import pytest
+
+from book_parser import Book, iter_paragraphs
+
+
+def legacy_parse_paragraphs(text):
+    """parse_paragraphs as it was before the streaming parser, kept as the reference."""
+    if not text:
+        return []
+    paragraphs = re.split(r'\n\s*\n', text)
+    result = []
+    for para in paragraphs:
+        para = para.strip()
+        if not para:
+            continue
+        if len(para) > 500 and '\n' in para:
+            for sub_para in re.split(r'\n+', para):
+                sub_para = sub_para.strip()
+                if sub_para:
+                    result.append(sub_para)
+        else:
+            result.append(para)
+    return result if result else [text.strip()]
+
+
+def legacy_parse_chapters(text):
+    """parse_chapters as it was before the streaming parser, kept as the reference."""
+    chapters = []
+    matches = list(re.finditer(r'(第[0-9一二三四五六七八九十百千万]+章[^\n]*)', text))
+    if not matches:
+        full_text = text.strip()
+        return [{'title': '全文', 'content': full_text, 'paragraphs': legacy_parse_paragraphs(full_text)}]
+    if matches[0].start() > 0:
+        preface_content = text[:matches[0].start()].strip()
+        preface_paragraphs = legacy_parse_paragraphs(preface_content)
+        preface_paragraphs.insert(0, '前言')
+        chapters.append({'title': '前言', 'content': preface_content, 'paragraphs': preface_paragraphs})
+    for i, match in enumerate(matches):
+        chapter_title = match.group(1).strip()
+        chapter_end = matches[i + 1].start() if i < len(matches) - 1 else len(text)
+        chapter_content = text[match.start():chapter_end].replace(chapter_title, '', 1).strip()
+        paragraphs = legacy_parse_paragraphs(chapter_content)
+        paragraphs.insert(0, chapter_title)
+        chapters.append({'title': chapter_title, 'content': chapter_content, 'paragraphs': paragraphs})
+    return chapters
+
+
+SENTENCES = ['他说，这件事情我们明天再谈。', '天色已晚，街上的人渐渐少了。', 'The rain had stopped.',
+             '“你来了？”她问。', '𠀀𠀁 rare characters outside the BMP.', '第三章的内容在下一页。']
+SEPARATORS = ['\n\n', '\n \n', '\r\n\r\n', '\n　　\n', '\n\n\n\t\n', '\n']
+HEADINGS = ['第一章 开端', '第2章', '第十二章 归来 ', '第一百零三章\t夜', '第99章 尾声\r']
+
+
+def random_book(rng: random.Random) -> str:
+    pieces = []
+    if rng.random() < 0.7:
+        pieces.append(rng.choice(['序：这是一本书。\n\n', '\n', '  \n前言文字\n']))
+    for _ in range(rng.randrange(0, 6)):
+        if rng.random() < 0.8:
+            pieces.append(rng.choice(['', '\n', '　　']) + rng.choice(HEADINGS) + '\n')
+        for _ in range(rng.randrange(0, 8)):
+            if rng.random() < 0.15:
+                # Long enough to be split into its lines
+                lines = ['　　' + ''.join(rng.choices(SENTENCES, k=rng.randrange(3, 8))) for _ in range(rng.randrange(2, 9))]
+                pieces.append('\n'.join(lines))
+            else:
+                pieces.append('　　' + ''.join(rng.choices(SENTENCES, k=rng.randrange(1, 4))))
+            pieces.append(rng.choice(SEPARATORS))
+    return ''.join(pieces)
+
+
+BOOKS = [random_book(random.Random(seed)) for seed in range(60)] + [
+    '',
+    '   \n\n  ',
+    '没有章节的短文。',
+    '第一章',
+    '\n第一章 开端\n',
+    '第一章 开端\n第一章 开端\n重复的标题。',
+    '正文中提到第五章但不在行首。\n\n第六章 真正的标题\n内容',
+    'x' * 600 + '\n' + 'y' * 10,
+]
+
+
+@pytest.mark.parametrize('text', BOOKS)
+def test_matches_legacy_parser(text):
+    assert Book.from_text(text).to_dicts() == legacy_parse_chapters(text)
+
+
+@pytest.mark.parametrize('text', BOOKS[:20] + BOOKS[-6:])
+def test_iter_paragraphs_matches_legacy_split(text):
+    if text.strip():
+        assert list(iter_paragraphs(text)) == legacy_parse_paragraphs(text)
+
+
+def test_iter_paragraphs_of_a_range():
+    text = 'skip\n\n' + '第一段\n\n第二段' + '\n\nskip'
+    assert list(iter_paragraphs(text, 6, 6 + len('第一段\n\n第二段'))) == ['第一段', '第二段']
+
+
+ENCODINGS = ['utf-8', 'gb18030', 'utf-8-sig', 'utf-16']
+
+
+@pytest.mark.parametrize('encoding', ENCODINGS)
+@pytest.mark.parametrize('block_size', [5, 64, 4096])
+def test_streamed_blocks_match_and_byte_offsets_point_at_chapters(encoding, block_size):
+    for seed in range(0, 60, 6):
+        text = BOOKS[seed]
+        data = text.encode(encoding)
+        book = Book.from_stream(io.BytesIO(data), encoding, block_size=block_size)
+        assert book.to_dicts() == legacy_parse_chapters(text)
+        if text:
+            assert book.byte_length == len(data)
+
+        decode = codecs.getdecoder({'utf-8-sig': 'utf-8', 'utf-16': 'utf-16-le'}.get(encoding, encoding))
+        for chapter in book.chapters:
+            assert decode(data[chapter.byte_start:chapter.byte_end])[0] == text[chapter.char_start:chapter.char_end]
+        # Chapters tile the upload, BOM aside
+        assert [c.byte_end for c in book.chapters[:-1]] == [c.byte_start for c in book.chapters[1:]]
+
+
+@pytest.mark.parametrize('encoding', ['utf-8', 'gb18030', 'big5'])
+def test_detects_the_encoding_of_a_stream(encoding):
+    text = '第一章 開端\n\n他說，這件事情我們明天再談。天色已晚，街上的人漸漸少了。\n\n第二章 歸來\n\n時間到了。'
+    book = Book.from_stream(io.BytesIO(text.encode(encoding)), block_size=16)
+    assert book.encoding == encoding
+    assert book.to_dicts() == legacy_parse_chapters(text)
+
+
+def test_invalid_bytes_past_the_sample_are_replaced():
+    data = ('第一章 开端\n\n' + '内容。' * 50).encode('utf-8') + b'\xff\xfe' + '结束。'.encode('utf-8')
+    book = Book.from_bytes(data, 'utf-8')
+    assert book.chapter_paragraphs(0)[-1].endswith('��结束。')
@@ -0,0 +1,57 @@
+import sqlite3
+import time
+
+from jobs import JobQueue
+
+
+def wait_for(queue, job_id, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id, include_items=True)
+        if job['status'] in ('completed', 'failed'):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f'job {job_id} did not finish: {job}')
+
+
+def flaky(method, failures: int):
+    """Wrap a JobQueue method to raise "database is locked" the first `failures` times."""
+    calls = []
+
+    def wrapper(*args, **kwargs):
+        calls.append(args)
+        if len(calls) <= failures:
+            raise sqlite3.OperationalError('database is locked')
+        return method(*args, **kwargs)
+    return wrapper, calls
+
+
+def test_items_run_and_failures_are_recorded(tmp_path):
+    queue = JobQueue(str(tmp_path / 'jobs.db'), workers=2, poll_interval=0.01)
+    queue.register('echo', lambda payload: payload['text'] if payload['text'] != 'bad' else 1 / 0)
+    queue.start()
+    try:
+        job = wait_for(queue, queue.submit('echo', 'Echo', [{'text': 'a'}, {'text': 'bad'}, {'text': 'c'}]))
+    finally:
+        queue.stop()
+    assert job['status'] == 'completed'
+    assert [(item['status'], item['result']) for item in job['items']] == [('done', 'a'), ('failed', None), ('done', 'c')]
+
+
+def test_workers_survive_database_errors(tmp_path, monkeypatch):
+    queue = JobQueue(str(tmp_path / 'jobs.db'), workers=1, poll_interval=0.01)
+    queue.register('echo', lambda payload: payload['text'])
+    claim, claims = flaky(queue._claim, 2)
+    finish, finishes = flaky(queue._finish, 2)
+    monkeypatch.setattr(queue, '_claim', claim)
+    monkeypatch.setattr(queue, '_finish', finish)
+    queue.start()
+    try:
+        first = wait_for(queue, queue.submit('echo', 'First', [{'text': 'a'}]))
+        second = wait_for(queue, queue.submit('echo', 'Second', [{'text': 'b'}]))
+    finally:
+        queue.stop()
+    assert first['items'][0]['result'] == 'a'
+    assert second['items'][0]['result'] == 'b'
+    assert len(claims) > 2 and len(finishes) == 4
+    assert all(thread.is_alive() for thread in queue._threads)
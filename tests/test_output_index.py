@@ -0,0 +1,36 @@
+import os
+
+from output_index import OutputIndex
+from wav_utils import wav_header
+
+
+def write_wav(path, seconds: float, sample_rate: int = 8000):
+    data = bytes(2 * int(seconds * sample_rate))
+    path.write_bytes(wav_header(len(data), sample_rate) + data)
+
+
+def test_index_groups_paragraph_files_by_chapter(tmp_path):
+    write_wav(tmp_path / 'Chapter_001.wav', 0.1)
+    write_wav(tmp_path / 'Chapter_002.wav', 0.1)
+    write_wav(tmp_path / 'Chapter.wav', 0.1)
+    (tmp_path / 'Chapter_003.wav.part').write_bytes(b'')
+    index = OutputIndex(str(tmp_path))
+    index.rescan()
+    assert index.paragraph_files('Chapter') == {1: 'Chapter_001.wav', 2: 'Chapter_002.wav'}
+    assert index.get('Chapter.wav')['paragraph'] is None
+    assert index.get('Chapter_003.wav.part') is None
+
+
+def test_duration_is_read_once_and_follows_changes(tmp_path):
+    path = tmp_path / 'Chapter.wav'
+    write_wav(path, 1.5)
+    index = OutputIndex(str(tmp_path))
+    index.rescan()
+    assert index.duration('Chapter.wav') == 1.5
+    assert index.get('Chapter.wav')['duration'] == 1.5
+
+    write_wav(path, 2.0)
+    os.utime(path, ns=(1, 1))
+    index.refresh(str(path))
+    assert index.duration('Chapter.wav') == 2.0
+    assert index.duration('missing.wav') is None
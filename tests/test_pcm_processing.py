@@ -0,0 +1,134 @@
+import math
+import struct
+from array import array
+
+import pytest
+
+import pcm_processing
+from batch_planner import pcm_bytes
+from pcm_processing import MAX_GAIN_DB, ClipPlan, gain_table, lookup, mapped_wav_data, plan_clip, write_clip
+from wav_utils import concatenate_wav_files_pure_python, read_wav_header, wav_header
+
+RATE = 24000
+
+
+@pytest.fixture(params=['audioop', 'pure'])
+def implementation(request, monkeypatch):
+    if request.param == 'audioop':
+        if not pcm_processing.AUDIOOP_AVAILABLE:
+            pytest.skip('audioop is not available')
+    else:
+        monkeypatch.setattr(pcm_processing, 'AUDIOOP_AVAILABLE', False)
+    return request.param
+
+
+def tone(seconds: float, amplitude: int = 8000) -> list[int]:
+    return [int(amplitude * math.sin(2 * math.pi * 220 * i / RATE)) for i in range(int(seconds * RATE))]
+
+
+def silence(seconds: float) -> list[int]:
+    return [0] * int(seconds * RATE)
+
+
+def pcm(samples: list[int]) -> memoryview:
+    return memoryview(pcm_bytes(array('h', samples)))
+
+
+def write_wav(path, samples: list[int]):
+    data = pcm_bytes(array('h', samples))
+    with open(path, 'wb') as f:
+        f.write(wav_header(len(data), RATE) + data)
+    return str(path)
+
+
+def test_plan_clip_trims_edges_to_the_kept_silence(implementation):
+    data = pcm(silence(1.0) + tone(1.0) + silence(1.0))
+    plan = plan_clip(data, RATE, edge_silence=0.15, target_dbfs=None)
+    keep = int(0.15 * RATE)
+    assert plan == ClipPlan(2 * (RATE - keep), 2 * (2 * RATE + keep), 2 * keep, 2 * keep, 1.0)
+
+
+def test_plan_clip_keeps_short_edges_whole(implementation):
+    data = pcm(silence(0.05) + tone(1.0))
+    plan = plan_clip(data, RATE, edge_silence=0.15, target_dbfs=None)
+    assert (plan.start, plan.end) == (0, len(data))
+    assert plan.lead == 2 * int(0.05 * RATE)
+    assert plan.trail == 0
+
+
+def test_plan_clip_trims_whole_stereo_frames(implementation):
+    mono = silence(0.5) + tone(0.5) + silence(0.5)
+    data = pcm([sample for sample in mono for _ in range(2)])
+    plan = plan_clip(data, RATE, num_channels=2, edge_silence=0.1, target_dbfs=None)
+    assert plan.start % 4 == 0 and plan.end % 4 == 0
+    assert plan.start == 4 * (RATE // 2 - int(0.1 * RATE))
+
+
+def test_plan_clip_leaves_silence_and_disabled_processing_alone(implementation):
+    data = pcm(silence(1.0))
+    assert plan_clip(data, RATE) == ClipPlan(0, len(data), 0, 0, 1.0)
+    data = pcm(silence(1.0) + tone(1.0))
+    assert plan_clip(data, RATE, edge_silence=None, target_dbfs=None) == ClipPlan(0, len(data), 0, 0, 1.0)
+
+
+def test_plan_clip_normalizes_speech_loudness(implementation):
+    # RMS of a sine is amplitude / sqrt(2): -15.26 dBFS here, so about -4.7 dB to reach -20
+    plan = plan_clip(pcm(silence(0.5) + tone(2.0)), RATE, edge_silence=None, target_dbfs=-20.0)
+    assert 20 * math.log10(plan.gain) == pytest.approx(-4.7, abs=0.15)
+
+
+def test_plan_clip_limits_amplification(implementation):
+    plan = plan_clip(pcm(tone(1.0, amplitude=100)), RATE, edge_silence=None, target_dbfs=-20.0)
+    assert 20 * math.log10(plan.gain) == pytest.approx(MAX_GAIN_DB)
+
+
+def test_plan_clip_keeps_peaks_below_the_ceiling(implementation):
+    samples = tone(1.0, amplitude=2000)
+    samples[1000] = 30000
+    plan = plan_clip(pcm(samples), RATE, edge_silence=None, target_dbfs=-20.0)
+    assert plan.gain == 1.0
+
+
+def test_write_clip_copies_the_kept_bytes(tmp_path, implementation):
+    data = pcm(tone(0.5))
+    with open(tmp_path / 'out.raw', 'wb', buffering=0) as out:
+        assert write_clip(out, data, ClipPlan(100, 2000, 0, 0, 1.0)) == 1900
+    assert (tmp_path / 'out.raw').read_bytes() == bytes(data[100:2000])
+
+
+def test_write_clip_scales_and_clips(tmp_path, implementation):
+    samples = [0, 1, -1, 1000, -1000, 20000, -20000, 32767, -32768] * 10000
+    with open(tmp_path / 'out.raw', 'wb', buffering=0) as out:
+        write_clip(out, pcm(samples), ClipPlan(0, 2 * len(samples), 0, 0, 2.0))
+    written = array('h', (tmp_path / 'out.raw').read_bytes())
+    expected = [max(-32768, min(32767, 2 * sample)) for sample in samples]
+    assert len(written) == len(expected)
+    assert all(abs(a - b) <= 1 for a, b in zip(written, expected))
+
+
+def test_gain_table_and_lookup():
+    table = gain_table(0.5)
+    assert table[1000] == 500
+    assert table[0x10000 - 1000] == -500
+    assert lookup(table, array('H', [1000])) == array('h', [500])
+
+
+def test_concatenation_trims_and_keeps_the_pause(tmp_path):
+    clip = silence(1.0) + tone(1.0) + silence(1.0)
+    paths = [write_wav(tmp_path / 'a.wav', clip), write_wav(tmp_path / 'b.wav', clip)]
+    output = str(tmp_path / 'out.wav')
+    concatenate_wav_files_pure_python(paths, output, silence_seconds=1.0, edge_silence=0.15, target_dbfs=None)
+
+    keep = int(0.15 * RATE)
+    kept = 2 * (RATE + 2 * keep)
+    # The edge silence each clip kept counts towards the one second pause
+    pause = 2 * (RATE - 2 * keep)
+    header = read_wav_header(output)
+    assert header['data_size'] == 2 * kept + pause
+    with open(output, 'rb') as f:
+        riff_size = struct.unpack('<4sI', f.read(8))[1]
+    assert riff_size == 36 + header['data_size']
+    with mapped_wav_data(output, header) as data:
+        samples = array('h', bytes(data))
+    assert not any(samples[kept // 2 - keep:kept // 2 + pause // 2 + keep])
+    assert any(samples[keep:keep + RATE])
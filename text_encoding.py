@@ -0,0 +1,78 @@
+"""Single-pass encoding detection for uploaded text files."""
+import codecs
+import re
+
+# Bytes sampled for scoring candidate encodings
+SAMPLE_SIZE = 16 * 1024
+
+# Byte order marks, longest first
+BOMS = [
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+# Legacy encodings scored when the text is not UTF-8, in order of preference on ties
+LEGACY_ENCODINGS = ['gb18030', 'big5']
+
+# Very frequent Chinese characters (simplified and traditional). Text decoded with the wrong
+# double-byte codec still decodes, but into rare characters that almost never hit this set.
+COMMON_CHARACTERS = re.compile(
+    '[的一是不了在人有我他这個个们們中来來上大为為和国國地到以说說时時要就出会會可也你对對生能而子那得于於着著'
+    '下自之年过過发發后後作里裡用道行所然家种種事成方多经經么麼去法学學如都同现現当當没沒动動面起看定天分还還进進'
+    '好小部其些主样樣理心她本前开開但因只从從想实實日者意无無力它与與长長把机機十民第公此已工使情明性知全三又关關点點'
+    '正业業外将將两兩高间間由问問很最重并並物手应應向头頭文体體相见見被利什二等产產或新己制身果加月话話合回特代内內信'
+    '表化老给給世位次度门門任常先海通教儿兒原东東声聲提立及比员員解水名真论論处處走义義各入几幾口认認条條平系气氣题題'
+    '活更别別打女变變四神总總何电電数數安少报報才结結反受目太量再感建务務做接必场場件计計管期市直德资資命山金指克许許]'
+)
+NON_ASCII = re.compile(rb'[\x80-\xff]')
+
+
+def detect_encoding(data: bytes) -> str:
+    """
+    Guess the encoding of `data` from its BOM or a bounded sample.
+
+    The sample starts at the first non-ASCII byte, so long ASCII prologues (licence
+    headers, tables of contents in Latin letters) do not hide the real encoding. UTF-8
+    is accepted when the sample is valid UTF-8; otherwise GB18030 and Big5 are scored
+    by how many very common Chinese characters they produce. When neither produces
+    any, the text is taken to be Western and decoded as cp1252: GB18030 decodes
+    almost any 8-bit byte sequence without errors, so a clean decode alone proves nothing.
+    """
+    for bom, encoding in BOMS:
+        if data.startswith(bom):
+            return encoding
+
+    match = NON_ASCII.search(data)
+    if match is None:
+        return 'utf-8'
+    sample = data[match.start():match.start() + SAMPLE_SIZE]
+    final = match.start() + SAMPLE_SIZE >= len(data)
+
+    try:
+        # Not final: a multi-byte character cut off at the end of the sample is not an error
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+
+    scores = []
+    for encoding in LEGACY_ENCODINGS:
+        text = codecs.getincrementaldecoder(encoding)(errors='replace').decode(sample, final)
+        errors = text.count('�')
+        hits = len(COMMON_CHARACTERS.findall(text))
+        scores.append((errors == 0 and hits > 0, hits - 8 * errors, errors == 0, encoding))
+
+    # Prefer a clean decode with common characters, then the best score
+    best = max(scores, key=lambda score: score[:2])
+    if best[0]:
+        return best[3]
+    try:
+        codecs.getincrementaldecoder('cp1252')().decode(sample, final)
+        return 'cp1252'
+    except UnicodeDecodeError:
+        pass
+    clean = [score[3] for score in scores if score[2]]
+    if clean:
+        return clean[0]
+    return best[3]
@@ -0,0 +1,334 @@
+"""Retries, backoff and circuit breaking around Gemini TTS calls."""
+import asyncio
+import random
+import re
+import threading
+import time
+from collections import deque
+import httpx
+
+# HTTP statuses worth retrying: rate limiting and transient server errors
+RETRYABLE_STATUSES = (408, 429, 500, 502, 503, 504)
+
+# "retryDelay": "27s" in the RetryInfo detail of a 429 response
+RETRY_DELAY_PATTERN = re.compile(r"""retryDelay['"]?\s*:\s*['"]?(\d+(?:\.\d+)?)s""")
+
+# Outcomes the circuit breaker remembers, and the share of failures among them (and the
+# calls in flight) that opens the circuit
+CIRCUIT_WINDOW = 20
+CIRCUIT_FAILURE_RATIO = 0.5
+
+# CJK characters are about one token each; other text about four characters per token
+CJK_START = 0x2E80
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough input token count of `text`, for the tokens-per-minute bucket."""
+    cjk = sum(1 for ch in text if ord(ch) >= CJK_START)
+    return cjk + (len(text) - cjk) // 4 + 1
+
+
+def error_status(error: Exception) -> int | None:
+    """HTTP status of an API error (google.genai.errors.APIError carries it as .code)."""
+    code = getattr(error, 'code', None)
+    return code if isinstance(code, int) else None
+
+
+def is_retryable(error: Exception) -> bool:
+    """Rate limiting, transient server errors and dropped or timed out connections are retried."""
+    if isinstance(error, (httpx.TransportError, ConnectionError, TimeoutError)):
+        return True
+    return error_status(error) in RETRYABLE_STATUSES
+
+
+def retry_delay(error: Exception) -> float | None:
+    """The delay a 429 response asks for, if it names one."""
+    match = RETRY_DELAY_PATTERN.search(str(getattr(error, 'details', '') or ''))
+    return float(match.group(1)) if match else None
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the API while the circuit breaker is open."""
+
+
+class StreamInterrupted(Exception):
+    """A retryable error after audio had started to arrive; only the whole call can be retried."""
+
+    def __init__(self, error: Exception):
+        super().__init__(f"Audio stream interrupted: {error}")
+        self.error = error
+
+
+class CircuitBreaker:
+    """
+    Stop calling a degraded API for a while.
+
+    The circuit opens when at least `failure_threshold` server-side failures make
+    up half or more of the recent outcomes plus the calls still waiting for an
+    answer. Consecutive failures therefore open it, but a few errors among many
+    concurrent calls (errors tend to come back before audio does) do not. While
+    open, calls are refused for `reset_seconds`. Then a single trial call is let
+    through (half-open): success closes the circuit, failure opens it again.
+    Rate limiting (429) is left to the rate limiter and does not count.
+
+    Every call let through by before_call() must end in exactly one of
+    record_success(), record_failure() or release().
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_seconds = reset_seconds
+        self.state = 'closed'
+        self.opened = 0
+        self._outcomes = deque(maxlen=max(CIRCUIT_WINDOW, 2 * self.failure_threshold))  # True for a failure
+        self._in_flight = 0
+        self._retry_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def before_call(self) -> float:
+        """Return 0 if a call may start now, else the seconds until the circuit lets one through."""
+        with self._lock:
+            if self.state != 'closed':
+                now = time.monotonic()
+                if now < self._retry_at or self._trial_running:
+                    return max(self._retry_at - now, 0.1)
+                self.state = 'half-open'
+                self._trial_running = True
+            self._in_flight += 1
+            return 0.0
+
+    def _finish(self):
+        self._in_flight = max(0, self._in_flight - 1)
+        self._trial_running = False
+
+    def record_success(self):
+        """The API answered (audio arrived, or it rejected the request itself)."""
+        with self._lock:
+            self._finish()
+            if self.state != 'closed':
+                self.state = 'closed'
+                self._outcomes.clear()
+            self._outcomes.append(False)
+
+    def release(self):
+        """The call was abandoned before the API answered."""
+        with self._lock:
+            self._finish()
+
+    def record_failure(self, error: Exception):
+        with self._lock:
+            self._finish()
+            if error_status(error) == 429:
+                return
+            self._outcomes.append(True)
+            failures = sum(self._outcomes)
+            if self.state == 'half-open' or (failures >= self.failure_threshold and
+                                             failures >= CIRCUIT_FAILURE_RATIO * (len(self._outcomes) + self._in_flight)):
+                if self.state != 'open':
+                    self.opened += 1
+                self.state = 'open'
+                self._retry_at = time.monotonic() + self.reset_seconds
+
+
+class TtsScheduler:
+    """
+    Run TTS calls through the client pool's rate limits with retries.
+
+    Retryable failures are retried up to `max_attempts` times with exponential
+    backoff and full jitter (at least the delay a 429 asks for, during which the
+    key is paused in the rate limiter). While the circuit is open, calls wait for
+    it for up to `circuit_wait_max` seconds in total, then fail with CircuitOpenError.
+    A streamed call is retried only until its first chunk arrives; after that the
+    error is raised as StreamInterrupted, which run() retries by repeating the
+    whole operation.
+    """
+
+    def __init__(self, client_pool, max_attempts: int = 5, backoff_base: float = 1.0, backoff_max: float = 60.0,
+                 breaker: CircuitBreaker | None = None, circuit_wait_max: float = 120.0):
+        self.client_pool = client_pool
+        self.max_attempts = max(1, int(max_attempts))
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.circuit_wait_max = circuit_wait_max
+        self.breaker = breaker or CircuitBreaker()
+        self._lock = threading.Lock()
+        self._stats = {
+            'calls': 0,
+            'attempts': 0,
+            'successes': 0,
+            'failures': 0,
+            'retries': 0,
+            'rate_limited': 0,
+            'interrupted': 0,
+            'circuit_rejections': 0,
+            'backoff_seconds_total': 0.0,
+            'circuit_wait_seconds_total': 0.0,
+        }
+
+    def _count(self, name: str, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        requested = retry_delay(error)
+        if requested is not None:
+            delay = max(delay, min(requested, self.backoff_max))
+        return delay
+
+    def _circuit_wait(self, circuit_waited: float) -> float:
+        """Seconds to wait for the circuit before the next attempt (0 to go ahead); raises once waited too long."""
+        wait = self.breaker.before_call()
+        if wait:
+            self._count('circuit_rejections')
+            if circuit_waited + wait > self.circuit_wait_max:
+                self._count('failures')
+                raise CircuitOpenError(f"Gemini API unavailable (circuit open), retry in {wait:.0f}s")
+            self._count('circuit_wait_seconds_total', wait)
+        return wait
+
+    def _failure_delay(self, error: Exception, attempt: int, started: bool, api_key) -> float:
+        """
+        Record a failed attempt and return the backoff before attempt number `attempt` + 1.
+
+        Re-raises the error when it is not worth retrying or attempts are used up, and
+        raises StreamInterrupted when audio had already been passed on.
+        """
+        retryable = is_retryable(error)
+        if not started:
+            # (A call whose audio had started was already counted as answered)
+            if retryable:
+                self.breaker.record_failure(error)
+            else:
+                # The API answered; it is the request that is wrong
+                self.breaker.record_success()
+        if not retryable:
+            self._count('failures')
+            raise error
+        if error_status(error) == 429:
+            self._count('rate_limited')
+        if started:
+            self._count('interrupted')
+            raise StreamInterrupted(error) from error
+        if attempt >= self.max_attempts:
+            self._count('failures')
+            raise error
+        delay = self._backoff(attempt, error)
+        if error_status(error) == 429 and api_key is not None:
+            self.client_pool.rate_limiter.pause(api_key, delay)
+        print(f"Gemini call failed ({error!r}), retry {attempt}/{self.max_attempts - 1} in {delay:.1f}s")
+        self._count('retries')
+        self._count('backoff_seconds_total', delay)
+        return delay
+
+    def _restart_delay(self, interrupted: StreamInterrupted, attempt: int) -> float:
+        if attempt >= self.max_attempts:
+            raise interrupted.error
+        delay = self._backoff(attempt, interrupted.error)
+        print(f"{interrupted}, restarting ({attempt}/{self.max_attempts - 1}) in {delay:.1f}s")
+        self._count('retries')
+        self._count('backoff_seconds_total', delay)
+        return delay
+
+    def stream(self, call, tokens: int = 0):
+        """
+        Yield the chunks of `call(lease)`, retrying failures that happen before the first chunk.
+
+        Args:
+            call: Callable taking a ClientLease and returning an iterable of chunks
+            tokens: Estimated tokens of the request, for the tokens-per-minute limit
+        """
+        self._count('calls')
+        attempt = 0
+        circuit_waited = 0.0
+        while True:
+            wait = self._circuit_wait(circuit_waited)
+            if wait:
+                circuit_waited += wait
+                time.sleep(wait)
+                continue
+
+            started = False
+            api_key = None
+            try:
+                self._count('attempts')
+                with self.client_pool.acquire(tokens) as lease:
+                    api_key = lease.api_key
+                    for chunk in call(lease):
+                        if not started:
+                            # Audio is arriving: the API is answering
+                            started = True
+                            self.breaker.record_success()
+                        yield chunk
+                if not started:
+                    self.breaker.record_success()
+                self._count('successes')
+                return
+            except Exception as e:
+                attempt += 1
+                time.sleep(self._failure_delay(e, attempt, started, api_key))
+
+    async def astream(self, call, tokens: int = 0):
+        """
+        Async variant of stream(): `call(lease)` returns an async iterable of chunks.
+
+        Waits (for rate limits, the circuit and backoff) never block the event loop.
+        """
+        self._count('calls')
+        attempt = 0
+        circuit_waited = 0.0
+        while True:
+            wait = self._circuit_wait(circuit_waited)
+            if wait:
+                circuit_waited += wait
+                await asyncio.sleep(wait)
+                continue
+
+            started = False
+            api_key = None
+            try:
+                self._count('attempts')
+                async with self.client_pool.acquire_async(tokens) as lease:
+                    api_key = lease.api_key
+                    async for chunk in call(lease):
+                        if not started:
+                            # Audio is arriving: the API is answering
+                            started = True
+                            self.breaker.record_success()
+                        yield chunk
+                if not started:
+                    self.breaker.record_success()
+                self._count('successes')
+                return
+            except asyncio.CancelledError:
+                if not started:
+                    self.breaker.release()
+                raise
+            except Exception as e:
+                attempt += 1
+                await asyncio.sleep(self._failure_delay(e, attempt, started, api_key))
+
+    def run(self, operation):
+        """Call `operation()`, repeating it when a stream it consumes is interrupted."""
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return operation()
+            except StreamInterrupted as e:
+                time.sleep(self._restart_delay(e, attempt))
+
+    async def arun(self, operation):
+        """Async variant of run(): awaits `operation()`, repeating it when a stream it consumes is interrupted."""
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return await operation()
+            except StreamInterrupted as e:
+                await asyncio.sleep(self._restart_delay(e, attempt))
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats['circuit_state'] = self.breaker.state
+        stats['circuit_opened'] = self.breaker.opened
+        stats['throttle_seconds_total'] = self.client_pool.stats()['throttle_seconds_total']
+        return stats
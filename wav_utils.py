@@ -0,0 +1,292 @@
+"""WAV header helpers and constant-memory WAV concatenation."""
+import os
+import struct
+import time
+from coordination import remove_quietly, temp_name
+from pcm_processing import mapped_wav_data, plan_clip, write_clip
+
+# Size of the blocks used when copying audio data between files
+COPY_BLOCK_SIZE = 1024 * 1024
+
+WAV_HEADER_SIZE = 44
+
+# Data size advertised in the header of a WAV streamed before its length is known
+STREAMING_DATA_SIZE = 0xFFFFFFFF - 36
+
+
+def wav_header(data_size: int, sample_rate: int, bits_per_sample: int = 16, num_channels: int = 1) -> bytes:
+    """Build a canonical 44-byte PCM WAV header for `data_size` bytes of audio."""
+    bytes_per_sample = bits_per_sample // 8
+    block_align = num_channels * bytes_per_sample
+    byte_rate = sample_rate * block_align
+    chunk_size = 36 + data_size
+
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF",
+        chunk_size,
+        b"WAVE",
+        b"fmt ",
+        16,
+        1,
+        num_channels,
+        sample_rate,
+        byte_rate,
+        block_align,
+        bits_per_sample,
+        b"data",
+        data_size
+    )
+
+
+def convert_to_wav(audio_data: bytes, mime_type: str) -> bytes:
+    """Generates a WAV file header for the given audio data and parameters."""
+    parameters = parse_audio_mime_type(mime_type)
+    header = wav_header(len(audio_data), parameters["rate"], parameters["bits_per_sample"])
+    return header + audio_data
+
+
+def parse_audio_mime_type(mime_type: str) -> dict[str, int | None]:
+    """Parses bits per sample and rate from an audio MIME type string."""
+    bits_per_sample = 16
+    rate = 24000
+
+    parts = mime_type.split(";")
+    for param in parts:
+        param = param.strip()
+        if param.lower().startswith("rate="):
+            try:
+                rate_str = param.split("=", 1)[1]
+                rate = int(rate_str)
+            except (ValueError, IndexError):
+                pass
+        elif param.startswith("audio/L"):
+            try:
+                bits_per_sample = int(param.split("L", 1)[1])
+            except (ValueError, IndexError):
+                pass
+
+    return {"bits_per_sample": bits_per_sample, "rate": rate}
+
+
+def read_wav_header(file_path: str) -> dict:
+    """Read WAV file header and return audio parameters."""
+    with open(file_path, 'rb') as f:
+        # Read RIFF header
+        riff_chunk = f.read(12)
+        if riff_chunk[:4] != b'RIFF' or riff_chunk[8:12] != b'WAVE':
+            raise ValueError("Not a valid WAV file")
+
+        # Read fmt chunk
+        fmt_chunk_id = f.read(4)
+        if fmt_chunk_id != b'fmt ':
+            raise ValueError("Missing fmt chunk")
+
+        fmt_chunk_size = struct.unpack('<I', f.read(4))[0]
+        fmt_data = f.read(fmt_chunk_size)
+
+        # Parse fmt data
+        audio_format, num_channels, sample_rate = struct.unpack('<HHI', fmt_data[:8])
+        byte_rate, block_align = struct.unpack('<IH', fmt_data[8:14])
+        bits_per_sample = struct.unpack('<H', fmt_data[14:16])[0] if fmt_chunk_size >= 16 else 16
+
+        # Find data chunk
+        while True:
+            chunk_id = f.read(4)
+            if chunk_id == b'data':
+                data_size = struct.unpack('<I', f.read(4))[0]
+                data_offset = f.tell()
+                break
+            elif chunk_id == b'':
+                raise ValueError("Missing data chunk")
+            else:
+                chunk_size = struct.unpack('<I', f.read(4))[0]
+                f.seek(chunk_size, 1)
+
+        # Streamed WAVs may carry a placeholder size; never read past the end of the file
+        f.seek(0, os.SEEK_END)
+        data_size = min(data_size, f.tell() - data_offset)
+
+        return {
+            'num_channels': num_channels,
+            'sample_rate': sample_rate,
+            'bits_per_sample': bits_per_sample,
+            'byte_rate': byte_rate,
+            'block_align': block_align,
+            'data_size': data_size,
+            'data_offset': data_offset
+        }
+
+
+def read_wav_data(file_path: str, header: dict) -> bytes:
+    """Read audio data from WAV file."""
+    with open(file_path, 'rb') as f:
+        f.seek(header['data_offset'])
+        return f.read(header['data_size'])
+
+
+def copy_file_range(src, dst, offset: int, count: int, buffer: bytearray | None = None):
+    """
+    Copy `count` bytes of `src` starting at `offset` to the current position of `dst`.
+
+    `dst` must be an unbuffered (raw) file so its OS file offset is the write
+    position. Uses os.copy_file_range where the platform supports it (no copy
+    through user space) and falls back to fixed-size block copies.
+    """
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while count > 0:
+                copied = os.copy_file_range(src.fileno(), dst.fileno(), min(count, 1 << 30), offset)
+                if copied == 0:
+                    break
+                offset += copied
+                count -= copied
+            return
+        except OSError:
+            # e.g. EXDEV on older kernels or unsupported filesystems - finish with plain copies
+            pass
+
+    if buffer is None:
+        buffer = bytearray(COPY_BLOCK_SIZE)
+    view = memoryview(buffer)
+    src.seek(offset)
+    while count > 0:
+        read = src.readinto(view[:min(count, len(buffer))])
+        if not read:
+            break
+        dst.write(view[:read])
+        count -= read
+
+
+def write_silence(out, count: int, block: memoryview):
+    """Write `count` zero bytes to `out` from a preallocated block of zeros."""
+    while count > 0:
+        count -= out.write(block[:count])
+
+
+def concatenate_wav_files_pure_python(audio_files: list[str], output_path: str, silence_seconds: float = 1.5,
+                                      edge_silence: float | None = None, target_dbfs: float | None = None):
+    """
+    Concatenate multiple WAV files without requiring ffmpeg.
+    Assumes all WAV files have the same format; files that differ are skipped.
+
+    Audio is streamed from file to file, so memory use does not depend on the
+    number or length of the inputs. The header is written with placeholder sizes
+    and patched once the total is known. The output is written to a temporary
+    file and renamed into place.
+
+    With `edge_silence` and/or `target_dbfs`, 16-bit inputs first go through
+    pcm_processing: each one's leading and trailing silence is cut down to
+    `edge_silence` seconds and its speech brought to `target_dbfs`. Trimmed files
+    are joined so that `silence_seconds` separates the end of one file's speech
+    from the start of the next, the silence they kept included.
+    """
+    if not audio_files:
+        raise ValueError("No audio files provided")
+
+    # Read first file to get format
+    first_header = read_wav_header(audio_files[0])
+    sample_rate = first_header['sample_rate']
+    bits_per_sample = first_header['bits_per_sample']
+    num_channels = first_header['num_channels']
+    block_align = num_channels * (bits_per_sample // 8)
+
+    # Calculate silence duration, rounded to whole sample frames
+    silence_bytes = int(sample_rate * silence_seconds) * block_align
+    silence_block = memoryview(bytes(min(silence_bytes, COPY_BLOCK_SIZE)))
+    copy_buffer = bytearray(COPY_BLOCK_SIZE)
+
+    process = (edge_silence is not None or target_dbfs is not None) and bits_per_sample == 16
+    if (edge_silence is not None or target_dbfs is not None) and not process:
+        print(f"Warning: {bits_per_sample}-bit audio is concatenated without trimming or normalization")
+
+    temp_path = temp_name(output_path)
+    total_data_size = 0
+    previous_trail = 0
+    try:
+        with open(temp_path, 'wb', buffering=0) as out:
+            out.write(wav_header(0, sample_rate, bits_per_sample, num_channels))
+
+            for file_path in audio_files:
+                header = read_wav_header(file_path)
+
+                # Verify format matches
+                if header['sample_rate'] != sample_rate or header['bits_per_sample'] != bits_per_sample or header['num_channels'] != num_channels:
+                    print(f"Warning: {file_path} has different format, skipping...")
+                    continue
+
+                if not process:
+                    # Add silence between files
+                    if total_data_size:
+                        write_silence(out, silence_bytes, silence_block)
+                        total_data_size += silence_bytes
+
+                    with open(file_path, 'rb') as src:
+                        copy_file_range(src, out, header['data_offset'], header['data_size'], copy_buffer)
+                    total_data_size += header['data_size']
+                    continue
+
+                with mapped_wav_data(file_path, header) as data:
+                    plan = plan_clip(data, sample_rate, num_channels, edge_silence, target_dbfs)
+                    if total_data_size:
+                        gap = silence_bytes
+                        if edge_silence is not None:
+                            # The silence kept at the edges is part of the pause
+                            gap = max(0, gap - previous_trail - plan.lead)
+                        write_silence(out, gap, silence_block)
+                        total_data_size += gap
+                    total_data_size += write_clip(out, data, plan)
+                previous_trail = plan.trail
+
+            # Patch RIFF and data chunk sizes now that the total is known
+            out.seek(0)
+            out.write(wav_header(total_data_size, sample_rate, bits_per_sample, num_channels))
+    except BaseException:
+        remove_quietly(temp_path)
+        raise
+
+    os.replace(temp_path, output_path)
+
+
+class WavStreamWriter:
+    """
+    Write PCM to a WAV file as it arrives.
+
+    The header is written with placeholder sizes up front and patched on close(),
+    so audio of unknown length never has to be held in memory. `write_seconds`
+    accumulates the time spent in file I/O, not in waiting for the audio.
+    """
+
+    def __init__(self, path: str, sample_rate: int, bits_per_sample: int = 16, num_channels: int = 1):
+        start = time.perf_counter()
+        self.path = path
+        self.sample_rate = sample_rate
+        self.bits_per_sample = bits_per_sample
+        self.num_channels = num_channels
+        self.data_size = 0
+        self._file = open(path, 'wb')
+        self._file.write(wav_header(0, sample_rate, bits_per_sample, num_channels))
+        self.write_seconds = time.perf_counter() - start
+
+    def write(self, pcm: bytes):
+        start = time.perf_counter()
+        self._file.write(pcm)
+        self.data_size += len(pcm)
+        self.write_seconds += time.perf_counter() - start
+
+    def close(self):
+        if self._file.closed:
+            return
+        start = time.perf_counter()
+        self._file.seek(0)
+        self._file.write(wav_header(self.data_size, self.sample_rate, self.bits_per_sample, self.num_channels))
+        self._file.close()
+        self.write_seconds += time.perf_counter() - start
+
+    def abort(self):
+        """Close and delete a partially written file."""
+        self._file.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass